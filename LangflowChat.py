@@ -1,15 +1,33 @@
 import os
 import time
 import json
+import asyncio
 import os.path
-import bcrypt
-import sqlite3
-import aiohttp
-from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
 import chainlit as cl
 from dotenv import load_dotenv
-from utils import get_thinking_content, filter_content
-from config.chat_settings import get_chat_settings, get_model_config, MODEL_CONFIGS
+from utils import (
+    LangflowTokenPipeline,
+    THINKING,
+    MarkdownStreamNormalizer,
+    CredentialVerifier,
+    get_shared_data_layer,
+    close_shared_data_layer,
+    get_langflow_session,
+    close_langflow_session,
+    iter_ndjson_events,
+    RequestTrace,
+    install_metrics_endpoint,
+    install_search_endpoint,
+    close_metrics,
+)
+from config.chat_settings import (
+    get_chat_settings,
+    get_starters,
+    get_auth_config,
+    get_langflow_pool_config,
+    get_markdown_config,
+    MARKDOWN_NORMALIZE,
+)
 
 load_dotenv()
 
@@ -20,34 +38,38 @@ LANGFLOW_API_KEY = os.getenv("LANGFLOW_API_KEY")
 
 # Remove the OpenAI client initialization since we're using Langflow
 
-def authenticate_user(username: str, password: str):
-    """验证用户凭据"""
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
+# 登录校验与 main.py 共用同一实现（线程池 + 短时缓存）
+credential_verifier = CredentialVerifier(**get_auth_config())
+
+# 在 Chainlit 服务上挂载 /metrics（Prometheus 文本格式）
+install_metrics_endpoint()
+
+# 聊天记录全文搜索接口（只搜索当前登录用户的会话）
+install_search_endpoint(get_shared_data_layer())
 
-    c.execute("SELECT password_hash, role FROM users WHERE username = ?", (username,))
-    user = c.fetchone()
-    conn.close()
+async def authenticate_user(username: str, password: str):
+    """验证用户凭据"""
+    try:
+        role = await credential_verifier.verify(username, password)
+    except Exception as e:
+        print(f"认证错误: {e}")
+        return None
 
-    if user:
-        stored_password_hash, role = user
-        if bcrypt.checkpw(password.encode("utf-8"), stored_password_hash):
-            return cl.User(identifier=username, metadata={"role": role, "provider": "credentials"})
+    if role:
+        return cl.User(identifier=username, metadata={"role": role, "provider": "credentials"})
 
     return None
 
 @cl.data_layer
 def get_data_layer():
-    return SQLAlchemyDataLayer(
-        conninfo="sqlite+aiosqlite:///mychat.db",
-        storage_provider=None
-    )
+    # 进程内唯一实例：重复调用不会再创建新的引擎和连接池
+    return get_shared_data_layer()
 
 # 用户认证
 @cl.password_auth_callback
-def auth_callback(username: str, password: str):
+async def auth_callback(username: str, password: str):
     """Chainlit 认证回调"""
-    return authenticate_user(username, password)
+    return await authenticate_user(username, password)
 
 
 @cl.on_chat_resume
@@ -61,6 +83,9 @@ async def on_message(msg: cl.Message):
     messages = cl.chat_context.to_openai()
     print("Historical messages:", messages)
     start = time.time()
+    cl.user_session.set("cancel_reason", None)
+    # Langflow 后端以 flow 作为模型标签
+    trace = RequestTrace("langflow", FLOW_ID or "")
     
     url = f"{BASE_API_URL}/api/v1/run/{FLOW_ID}?stream=true"
     payload = {
@@ -75,99 +100,106 @@ async def on_message(msg: cl.Message):
     thinking = False
     final_answer = cl.Message(content="")
     thinking_step = None
+    # 转义解码 + <think> 分流，标签或转义序列跨 chunk 拆分时也能正确处理
+    pipeline = LangflowTokenPipeline()
+    # 修正代码块标记等 Markdown 格式
+    markdown = MarkdownStreamNormalizer(**get_markdown_config()) if MARKDOWN_NORMALIZE else None
+
+    async def emit(kind, text):
+        nonlocal thinking, thinking_step
+        trace.on_token(kind)
+        if kind == THINKING:
+            # 如果有思考内容，创建或更新 thinking_step
+            if not thinking_step:
+                thinking_step = cl.Step(name="Thinking")
+                await thinking_step.__aenter__()
+                thinking = True
+            await thinking_step.stream_token(text)
+        else:
+            if markdown:
+                text = markdown.feed(text)
+            # stream_token 会累加到 final_answer.content，无需另外拼接
+            if text:
+                await final_answer.stream_token(text)
+
+    async def flush_markdown():
+        if markdown:
+            text = markdown.flush()
+            if text:
+                await final_answer.stream_token(text)
+            trace.extra["markdown_fixes"] = markdown.fixes
     
-    async with aiohttp.ClientSession() as session:
-        try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {LANGFLOW_API_KEY}" 
-            }
+    # 所有会话共用一个 aiohttp 会话，复用到 Langflow 的连接
+    session = get_langflow_session()
+    max_event_bytes = get_langflow_pool_config()["max_event_bytes"]
+    try:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {LANGFLOW_API_KEY}" 
+        }
+        
+        async with session.post(url, json=payload, headers=headers) as response:
+            print(f"Response status: {response.status}")
             
-            async with session.post(url, json=payload, headers=headers) as response:
-                print(f"Response status: {response.status}")
-                
-                if response.status != 200:
-                    error_text = await response.text()
-                    print(f"Error response: {error_text}")
-                    raise Exception(f"API request failed: {response.status} - {error_text}")
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Error response: {error_text}")
+                raise Exception(f"API request failed: {response.status} - {error_text}")
+            
+            try:
+                # 按字节缓冲读取 NDJSON：事件跨读取拆分、超长事件、心跳空行都在读取器中处理
+                async for event_data in iter_ndjson_events(response.content, max_event_bytes=max_event_bytes):
+                    event_type = event_data.get("event")
                 
-                buffer = ""
-                async for line in response.content:
-                    if not line:
-                        continue
-                        
-                    try:
-                        line_text = line.decode('utf-8').strip()
-                        if not line_text:
-                            continue
-                            
-                        event_data = json.loads(line_text)
-                        event_type = event_data["event"]
-                        
-                        if event_type == "add_message":
-                            message_id = event_data["data"]["id"]
-                            
-                        elif event_type == "token":
-                            chunk = event_data["data"].get("chunk", "")
-                            if chunk:  # 过滤空心跳包
-                                try:
-                                    # 首先尝试直接解码
-                                    decoded = chunk
-                                    if '\\u' in chunk:
-                                        decoded = chunk.encode().decode('unicode_escape')
-                                        
-                                    # 使用 get_thinking_content 检查是否包含思考内容
-                                    thinking_content = get_thinking_content(type('Delta', (), {'content': decoded})())
-                                    
-                                    if thinking_content:
-                                        # 如果有思考内容，创建或更新 thinking_step
-                                        if not thinking_step:
-                                            thinking_step = cl.Step(name="Thinking")
-                                            await thinking_step.__aenter__()
-                                            thinking = True
-                                        await thinking_step.stream_token(thinking_content)
-                                    else:
-                                        # 如果没有思考内容，使用 filter_content 处理普通内容
-                                        filtered_content = filter_content(decoded)
-                                        if filtered_content:
-                                            buffer += filtered_content
-                                            await final_answer.stream_token(filtered_content)
-                                            
-                                except Exception as decode_error:
-                                    print(f"解码错误: {decode_error}, 原始chunk: {chunk}")
-                                    
-                        elif event_type == "end":
-                            if thinking and thinking_step:
-                                thought_for = round(time.time() - start)
-                                thinking_step.name = f"Thought for {thought_for}s"
-                                await thinking_step.update()
-                                await thinking_step.__aexit__(None, None, None)
-                                thinking = False
+                    if event_type == "add_message":
+                        message_id = event_data["data"]["id"]
+                    
+                    elif event_type == "token":
+                        chunk = event_data["data"].get("chunk", "")
+                        if chunk:  # 过滤空心跳包
+                            for kind, text in pipeline.feed(chunk):
+                                await emit(kind, text)
                             
-                            # 设置最终答案
-                            final_answer.content = buffer
-                            await final_answer.send()
-                            
-                    except json.JSONDecodeError as e:
-                        print(f"解析失败的行: {line_text}, 错误: {str(e)}")
-                        continue
-                        
-        except Exception as e:
-            print(f"请求错误: {str(e)}")
-            await cl.Message(content=f"抱歉，发生错误: {str(e)}").send()
+                    elif event_type == "end":
+                        for kind, text in pipeline.flush():
+                            await emit(kind, text)
+                        await flush_markdown()
+
+                        if thinking and thinking_step:
+                            thought_for = round(time.time() - start)
+                            thinking_step.name = f"Thought for {thought_for}s"
+                            await thinking_step.update()
+                            await thinking_step.__aexit__(None, None, None)
+                            thinking = False
+                    
+                        await final_answer.send()
+                        trace.finish()
+            except asyncio.CancelledError:
+                # 用户点击停止或断开连接：直接关闭响应和底层连接，不再读取 Langflow 的剩余输出
+                response.close()
+                raise
+
+    except asyncio.CancelledError:
+        # 保存已经输出的部分，思考步骤正常结束
+        if thinking and thinking_step:
+            thinking_step.name = f"Thought for {round(time.time() - start)}s"
+            await thinking_step.update()
+            await thinking_step.__aexit__(None, None, None)
+        await flush_markdown()
+        if final_answer.content:
+            await final_answer.send()
+        trace.cancel(cl.user_session.get("cancel_reason") or "stop")
+        raise
+    except Exception as e:
+        trace.finish("error")
+        print(f"请求错误: {str(e)}")
+        await cl.Message(content=f"抱歉，发生错误: {str(e)}").send()
 
 
 @cl.set_starters
 async def set_starters():
-    # 从配置文件加载启动器配置
-    config_path = os.path.join(os.path.dirname(__file__), 'config', 'starters.json')
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            return [cl.Starter(**starter) for starter in config['starters']]
-    except Exception as e:
-        print(f"Error loading starters config: {e}")
-        return []
+    # 启动器配置缓存在内存中，config/starters.json 修改后自动重新加载
+    return get_starters()
 
 # 从配置模块导入get_chat_settings函数
 
@@ -185,4 +217,27 @@ async def start_chat():
 async def on_settings_update(settings):
     # We don't need to update OpenAI client anymore
     # Just store the settings if needed for future use
-    pass
\ No newline at end of file
+    pass
+
+
+@cl.on_stop
+async def on_stop():
+    """用户点击停止：Chainlit 会取消正在执行的 on_message，这里只记录取消原因"""
+    cl.user_session.set("cancel_reason", "stop")
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    """用户关闭页面或断开连接：取消仍在进行的回复，释放到 Langflow 的连接"""
+    task = cl.context.session.current_task
+    if task and not task.done():
+        cl.user_session.set("cancel_reason", "disconnect")
+        task.cancel()
+
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+    """进程退出时关闭 Langflow 会话，写入缓冲区中的步骤并关闭数据库连接池"""
+    await close_langflow_session()
+    await close_shared_data_layer()
+    close_metrics()
\ No newline at end of file
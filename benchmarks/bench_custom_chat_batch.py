@@ -0,0 +1,160 @@
+"""CustomChatOpenAI 批量请求吞吐基准
+
+在后台线程启动一个本地的假 OpenAI 端点（每个请求固定延迟，返回 reasoning_content），
+比较逐个调用 invoke、batch（线程池）与 abatch（事件循环）的吞吐，并检查：
+
+- 结果按输入顺序返回，思考内容被包装为 <think>
+- return_exceptions=True 时失败的请求在对应位置返回异常
+- config 中的回调和 tags 对每个请求生效（每个请求一次 on_llm_start，tags 传到回调）
+
+用法：
+    python benchmarks/bench_custom_chat_batch.py
+    python benchmarks/bench_custom_chat_batch.py --requests 200 --concurrency 32 --latency 0.1
+    python benchmarks/bench_custom_chat_batch.py --rps 20     # 同时验证端点限流
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+
+from custom_chat import CustomChatOpenAI, close_clients  # noqa: E402
+
+
+class CountingHandler(BaseCallbackHandler):
+    """统计每个请求的回调次数，检查 batch 是否经过 BaseChatModel 的回调流程"""
+
+    def __init__(self):
+        self.starts = 0
+        self.ends = 0
+        self.errors = 0
+        self.tagged = 0
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, tags=None, **kwargs):
+        with self._lock:
+            self.starts += 1
+            self.tagged += "bench" in (tags or ())
+
+    def on_llm_end(self, response, **kwargs):
+        with self._lock:
+            self.ends += 1
+
+    def on_llm_error(self, error, **kwargs):
+        with self._lock:
+            self.errors += 1
+
+    def ok(self, count):
+        return self.starts == self.tagged == count and self.ends + self.errors == count and self.errors == 1
+
+
+def start_server(port, latency):
+    """在后台线程中运行假端点，content 为 "fail" 的请求返回 400"""
+
+    async def chat(request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        await asyncio.sleep(latency)
+        if prompt == "fail":
+            return web.json_response({"error": {"message": "bad request", "type": "invalid_request_error"}}, status=400)
+        return web.json_response({
+            "id": "bench",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": f"echo:{prompt}", "reasoning_content": "思考"},
+            }],
+        })
+
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", chat)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+
+def check(results, prompts, handler):
+    ok = 0
+    for result, prompt in zip(results, prompts):
+        if prompt == "fail":
+            ok += isinstance(result, Exception)
+        else:
+            ok += (not isinstance(result, Exception)
+                   and result.content == f"<think>\n\n思考\n</think>\n\necho:{prompt}")
+    return ok == len(prompts) and handler.ok(len(prompts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="假端点的单次延迟（秒）")
+    parser.add_argument("--rps", type=float, default=None, help="端点限流（每秒请求数）")
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    start_server(args.port, args.latency)
+    llm = CustomChatOpenAI(
+        model="bench",
+        base_url=f"http://127.0.0.1:{args.port}/v1",
+        api_key="bench",
+        max_retries=0,
+        batch_concurrency=args.concurrency,
+        requests_per_second=args.rps,
+    )
+    prompts = [f"q{i}" for i in range(args.requests)]
+    prompts[len(prompts) // 2] = "fail"
+
+    print(f"{args.requests} 个请求 / 并发 {args.concurrency} / 端点延迟 {args.latency * 1000:.0f}ms"
+          + (f" / 限流 {args.rps} rps" if args.rps else ""))
+    print(f"{'方式':<12}{'耗时s':>10}{'请求/秒':>10}{'结果正确':>10}")
+
+    sequential_count = min(args.requests, 20)
+    t0 = time.perf_counter()
+    for prompt in prompts[:sequential_count]:
+        if prompt != "fail":
+            llm.invoke(prompt)
+    elapsed = time.perf_counter() - t0
+    print(f"{'invoke 逐个':<12}{elapsed:>10.2f}{sequential_count / elapsed:>10.1f}{'-':>10}  (前 {sequential_count} 个)")
+
+    handler = CountingHandler()
+    t0 = time.perf_counter()
+    results = llm.batch(prompts, {"callbacks": [handler], "tags": ["bench"]}, return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    print(f"{'batch':<12}{elapsed:>10.2f}{len(prompts) / elapsed:>10.1f}{str(check(results, prompts, handler)):>10}")
+
+    async def run_abatch():
+        try:
+            return await llm.abatch(prompts, {"callbacks": [handler], "tags": ["bench"]}, return_exceptions=True)
+        finally:
+            await close_clients()
+
+    handler = CountingHandler()
+    t0 = time.perf_counter()
+    results = asyncio.run(run_abatch())
+    elapsed = time.perf_counter() - t0
+    print(f"{'abatch':<12}{elapsed:>10.2f}{len(prompts) / elapsed:>10.1f}{str(check(results, prompts, handler)):>10}")
+
+
+if __name__ == "__main__":
+    main()
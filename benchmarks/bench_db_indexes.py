@@ -0,0 +1,136 @@
+"""数据库索引基准
+
+生成一个合成的聊天数据库（默认 100 万条 steps），在迁移 2（索引）之前和之后
+分别测量侧边栏会话列表查询和恢复会话查询的耗时。
+
+用法：
+    python benchmarks/bench_db_indexes.py                  # 100 万条 steps
+    python benchmarks/bench_db_indexes.py --steps 200000   # 更小的数据集
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrate_db import connect, migrate  # noqa: E402
+
+# 与 Chainlit SQLAlchemyDataLayer.get_all_user_threads 相同的查询
+THREAD_LIST_QUERY = """
+    SELECT t."id", t."createdAt", t."name", MAX(s."createdAt") AS updatedAt
+    FROM threads t
+    LEFT JOIN steps s ON t."id" = s."threadId"
+    WHERE t."userId" = ? OR t."id" = ?
+    GROUP BY t."id", t."createdAt", t."name", t."userId", t."userIdentifier", t."tags", t."metadata"
+    ORDER BY updatedAt DESC NULLS LAST
+    LIMIT 1000
+"""
+
+RESUME_STEPS_QUERY = """
+    SELECT s.*, f."value", f."comment", f."id"
+    FROM steps s LEFT JOIN feedbacks f ON s."id" = f."forId"
+    WHERE s."threadId" = ?
+    ORDER BY s."createdAt" ASC
+"""
+
+RESUME_ELEMENTS_QUERY = 'SELECT * FROM elements e WHERE e."threadId" = ?'
+
+
+def generate(conn, steps, users, steps_per_thread, seed=0):
+    rng = random.Random(seed)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(users)]
+    conn.execute("BEGIN")
+    conn.executemany(
+        'INSERT INTO users (id, identifier, "createdAt", metadata) VALUES (?, ?, ?, ?)',
+        [(uid, f"user{i}", datetime(2024, 1, 1).isoformat(), "{}") for i, uid in enumerate(user_ids)],
+    )
+    base = datetime(2024, 1, 1)
+    thread_ids = []
+    threads = steps // steps_per_thread
+    for t in range(threads):
+        thread_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        thread_ids.append(thread_id)
+        created = base + timedelta(minutes=rng.randint(0, 500000))
+        user_index = rng.randrange(users)
+        conn.execute(
+            'INSERT INTO threads (id, "createdAt", name, "userId", "userIdentifier", tags, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (thread_id, created.isoformat(), f"thread {t}", user_ids[user_index], f"user{user_index}", "[]", "{}"),
+        )
+        rows = []
+        for s in range(steps_per_thread):
+            step_time = (created + timedelta(seconds=s * 30)).isoformat()
+            kind = "user_message" if s % 2 == 0 else "assistant_message"
+            rows.append((
+                str(uuid.UUID(int=rng.getrandbits(128))), thread_id, step_time, step_time, step_time,
+                kind, kind, "", "lorem ipsum " * 20, 0, 0, 0, "{}",
+            ))
+        conn.executemany(
+            'INSERT INTO steps (id, "threadId", "createdAt", "start", "end", name, type, input, output, '
+            'streaming, "isError", "waitForAnswer", metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows,
+        )
+        if t % 1000 == 0:
+            conn.execute("COMMIT")
+            conn.execute("BEGIN")
+    conn.execute("COMMIT")
+    return user_ids, thread_ids
+
+
+def time_query(conn, query, params_list, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for params in params_list:
+            conn.execute(query, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best / len(params_list)
+
+
+def measure(conn, user_ids, thread_ids, samples):
+    rng = random.Random(1)
+    users = [(rng.choice(user_ids), None) for _ in range(samples)]
+    threads = [(rng.choice(thread_ids),) for _ in range(samples)]
+    return {
+        "会话列表 (thread list)": time_query(conn, THREAD_LIST_QUERY, users),
+        "恢复会话 steps": time_query(conn, RESUME_STEPS_QUERY, threads),
+        "恢复会话 elements": time_query(conn, RESUME_ELEMENTS_QUERY, threads),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--steps-per-thread", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--db", default=None, help="数据库路径（默认使用临时文件）")
+    args = parser.parse_args()
+
+    db_file = args.db or os.path.join(tempfile.mkdtemp(), "bench_chat.db")
+    conn = connect(db_file)
+    migrate(conn, target=1, verbose=False)
+
+    start = time.time()
+    user_ids, thread_ids = generate(conn, args.steps, args.users, args.steps_per_thread)
+    print(f"生成 {len(thread_ids)} 个会话 / {args.steps} 条 steps，用时 {time.time() - start:.1f}s ({db_file})")
+
+    before = measure(conn, user_ids, thread_ids, args.samples)
+    start = time.time()
+    migrate(conn, verbose=False)
+    print(f"执行索引迁移用时 {time.time() - start:.1f}s")
+    after = measure(conn, user_ids, thread_ids, args.samples)
+
+    print(f"\n{'查询':<24}{'迁移前 (ms)':>14}{'迁移后 (ms)':>14}{'加速':>10}")
+    for name in before:
+        b, a = before[name] * 1000, after[name] * 1000
+        print(f"{name:<24}{b:>14.2f}{a:>14.2f}{b / a if a else float('inf'):>9.1f}x")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
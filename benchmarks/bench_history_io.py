@@ -0,0 +1,91 @@
+"""聊天记录导出 / 导入基准
+
+生成合成的聊天数据库，分别以不同规模运行 history_io.py 的导出和导入（各自在独立
+进程中，报告 rows/s 和内存峰值），检查往返后的行数一致。数据量增加 N 倍时，
+内存峰值应基本不变。最后用 --replace 再导入一次，检查行数不变、全文索引中每个步骤和
+会话标题仍只有一个文档。
+
+用法：
+    python benchmarks/bench_history_io.py                          # 10 万和 100 万条 steps
+    python benchmarks/bench_history_io.py --steps 100000 300000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_db_indexes import generate  # noqa: E402
+from migrate_db import connect, migrate  # noqa: E402
+
+TABLES = ("users", "threads", "steps", "elements", "feedbacks")
+
+
+def counts(db_file):
+    conn = connect(db_file)
+    try:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in TABLES}
+    finally:
+        conn.close()
+
+
+def run(*args):
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "history_io.py"), *args], capture_output=True, text=True, check=True
+    )
+    # 只保留最后的汇总行
+    return [line for line in result.stdout.splitlines() if line.startswith(("✅", "   耗时"))]
+
+
+def check_search_index(db_file):
+    """在单独的进程中检查全文索引（不把 search_index 的依赖加载进本进程，子进程会继承内存峰值）"""
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "search_index.py"), "check", db_file], capture_output=True, text=True
+    )
+    return [line for line in result.stdout.splitlines() if line.startswith(("  ", "✅", "⚠️"))]
+
+
+def bench(steps, args, tmp):
+    source = os.path.join(tmp, f"source_{steps}.db")
+    target = os.path.join(tmp, f"target_{steps}.db")
+    archive = os.path.join(tmp, f"history_{steps}.jsonl.gz")
+    conn = connect(source)
+    migrate(conn, verbose=False)
+    generate(conn, steps, args.users, args.steps_per_thread)
+    conn.close()
+
+    print(f"== {steps} 条 steps，数据库 {os.path.getsize(source) / 1e6:.0f} MB ==")
+    for line in run("export", source, "-o", archive):
+        print(line)
+    print(f"   导出文件 {os.path.getsize(archive) / 1e6:.1f} MB")
+    for line in run("import", archive, target, "--batch", str(args.batch)):
+        print(line)
+    source_counts, target_counts = counts(source), counts(target)
+    print(f"   往返行数{'一致' if source_counts == target_counts else f'不一致: {source_counts} != {target_counts}'}")
+
+    for line in run("import", archive, target, "--batch", str(args.batch), "--replace"):
+        print(line)
+    replaced_counts = counts(target)
+    print(f"   --replace 再导入后行数{'不变' if replaced_counts == source_counts else f'变化: {replaced_counts}'}")
+    for line in check_search_index(target):
+        print(f"   {line.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--steps-per-thread", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=5000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for steps in args.steps:
+            bench(steps, args, tmp)
+
+
+if __name__ == "__main__":
+    main()
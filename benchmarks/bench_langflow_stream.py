@@ -0,0 +1,148 @@
+"""Langflow 流式读取基准
+
+启动一个本地的假 Langflow 服务（按 NDJSON 流式返回 add_message/token/end 事件），
+比较两种客户端实现的每轮延迟：
+
+- 旧实现：每条消息新建 aiohttp.ClientSession，按行迭代 response.content 并逐行 json.loads
+- 新实现：共享会话 + iter_ndjson_events（字节缓冲、预检查、超长事件丢弃）
+
+用法：
+    python benchmarks/bench_langflow_stream.py
+    python benchmarks/bench_langflow_stream.py --turns 500 --concurrency 20 --tokens 400
+    python benchmarks/bench_langflow_stream.py --big-event 200000   # 每轮额外发送一个超大事件
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.langflow_client import close_langflow_session, get_langflow_session, iter_ndjson_events  # noqa: E402
+
+
+def make_app(tokens, big_event):
+    async def run_flow(request):
+        await request.read()
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        events = [{"event": "add_message", "data": {"id": "m1", "text": ""}}]
+        if big_event:
+            events.append({"event": "add_message", "data": {"id": "m2", "text": "x" * big_event}})
+        events.extend(
+            {"event": "token", "data": {"chunk": f"<think>t{i}</think>" if i == 0 else f"词{i} ", "id": "m1"}}
+            for i in range(tokens)
+        )
+        events.append({"event": "end", "data": {"result": {}}})
+        # Langflow 用空行分隔事件；按小块写出，使事件跨读取拆分
+        payload = "".join(json.dumps(e, ensure_ascii=False) + "\n\n" for e in events).encode("utf-8")
+        for i in range(0, len(payload), 1500):
+            await response.write(payload[i:i + 1500])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/api/v1/run/{flow_id}", run_flow)
+    return app
+
+
+async def old_turn(url):
+    """旧实现：每轮新建会话，按行读取"""
+    tokens = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json={"input_value": "hi"}) as response:
+            async for line in response.content:
+                line_text = line.decode("utf-8").strip()
+                if not line_text:
+                    continue
+                try:
+                    event = json.loads(line_text)
+                except json.JSONDecodeError:
+                    continue
+                if event["event"] == "token":
+                    tokens += 1
+    return tokens
+
+
+async def new_turn(url):
+    """新实现：共享会话 + iter_ndjson_events"""
+    tokens = 0
+    session = get_langflow_session()
+    async with session.post(url, json={"input_value": "hi"}) as response:
+        async for event in iter_ndjson_events(response.content):
+            if event["event"] == "token":
+                tokens += 1
+    return tokens
+
+
+async def run(turn, url, turns, concurrency, expected_tokens):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                tokens = await turn(url)
+                if tokens != expected_tokens:
+                    failures += 1
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(turns)))
+    return latencies, failures, time.perf_counter() - start
+
+
+def report(name, latencies, failures, elapsed):
+    if not latencies:
+        print(f"{name:<10}{'-':>10}{'-':>10}{'-':>10}{'-':>10}{failures:>8}")
+        return
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    mean = statistics.fmean(latencies) * 1000
+    rate = len(latencies) / elapsed
+    print(f"{name:<10}{mean:>10.2f}{p50:>10.2f}{p95:>10.2f}{rate:>10.1f}{failures:>8}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--tokens", type=int, default=300, help="每轮的 token 事件数")
+    parser.add_argument("--big-event", type=int, default=0, help="每轮额外发送的超大事件字节数")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    runner = web.AppRunner(make_app(args.tokens, args.big_event))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    url = f"http://127.0.0.1:{args.port}/api/v1/run/bench?stream=true"
+
+    try:
+        # 预热
+        await old_turn(url)
+        await new_turn(url)
+
+        print(f"{args.turns} 轮 / 并发 {args.concurrency} / 每轮 {args.tokens} 个 token 事件")
+        print(f"{'实现':<10}{'平均ms':>10}{'p50ms':>10}{'p95ms':>10}{'轮/秒':>10}{'失败':>8}")
+        report("旧实现", *await run(old_turn, url, args.turns, args.concurrency, args.tokens))
+        report("新实现", *await run(new_turn, url, args.turns, args.concurrency, args.tokens))
+    finally:
+        await close_langflow_session()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
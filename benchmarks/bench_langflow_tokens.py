@@ -0,0 +1,137 @@
+"""Langflow token 处理吞吐基准
+
+对比 LangflowChat 旧的逐 token 处理（'\\u' 检查 + unicode_escape + ThinkStreamParser）
+与 LangflowTokenPipeline 的每 token 耗时，并检查输出是否正确；另外检查 decode_escapes
+在被转义的反斜杠、代理对、其他转义等边界情况下的结果，以及这些输入在任意位置切成
+两个 chunk 时流水线的输出与不切分时相同。
+
+不含转义的流上流水线与旧实现相当或更快；含转义的流上流水线更慢（本机 token 大小的 chunk
+约 1.0 对 0.5 us/token，64~256 字符的 chunk 约 3.4 对 2.1 us），换来的是正确的输出：旧实现
+把 chunk 中的中文按 latin-1 解码成乱码，转义被切到两个 chunk 时整个 chunk 被丢弃。
+解码本身（json 的 scanstring）已占每个大 chunk 约 1.3 us。
+
+用法：
+    python benchmarks/bench_langflow_tokens.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import ThinkStreamParser, THINKING, LangflowTokenPipeline  # noqa: E402
+from utils.langflow_tokens import decode_escapes  # noqa: E402
+
+THINK_TEXT = "嗯，用户想要一个 Python 脚本。先考虑 smtplib，再考虑定时任务 cron 😀。" * 40
+ANSWER_TEXT = "下面是示例代码：\n\n```python\nimport smtplib\n```\n如需 HTML 邮件请修改 MIME 类型。" * 40
+
+# (输入, 期望的解码结果)
+DECODE_CASES = {
+    "中文与转义混合": ("中文\\u4e2d\\u6587 é", "中文中文 é"),
+    "代理对": ("\\ud83d\\ude00!", "😀!"),
+    "孤立的代理项": ("\\ud83d!\\ude00", "\ufffd!\ufffd"),
+    "被转义的反斜杠": ("C:\\\\u0041", "C:\\\\u0041"),
+    "被转义的反斜杠 + 转义": ("\\\\\\u0041", "\\\\A"),
+    "其他转义不解码": ('print("a\\n") \\u4e2d', 'print("a\\n") 中'),
+    "不完整的转义": ("\\u12 \\u4e2d", "\\u12 中"),
+    "引号和换行": ('"\\u4e2d"\n', '"中"\n'),
+    "被转义的反斜杠后接 u": ("a\\\\u4e2d b", "a\\\\u4e2d b"),
+    "被转义的反斜杠 + 代理对": ("\\\\ud83d\\ude00", "\\\\ud83d\ufffd"),
+}
+
+
+def split_stream(text, min_size, max_size, seed):
+    rng = random.Random(seed)
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(min_size, max_size)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def escape_some(text, ratio, seed):
+    """把一部分非 ASCII 字符替换为 \\uXXXX 转义，模拟二次转义的 chunk"""
+    rng = random.Random(seed)
+    out = []
+    for ch in text:
+        if ord(ch) > 127 and rng.random() < ratio:
+            encoded = ch.encode("utf-16-le")
+            out.extend("\\u%04x" % int.from_bytes(encoded[i:i + 2], "little") for i in range(0, len(encoded), 2))
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def run_legacy(chunks):
+    thinking, answer = [], []
+    parser = ThinkStreamParser()
+    for chunk in chunks:
+        try:
+            decoded = chunk
+            if "\\u" in chunk:
+                decoded = chunk.encode().decode("unicode_escape")
+            for kind, text in parser.feed(decoded):
+                (thinking if kind == THINKING else answer).append(text)
+        except Exception:
+            pass
+    for kind, text in parser.flush():
+        (thinking if kind == THINKING else answer).append(text)
+    return "".join(thinking), "".join(answer)
+
+
+def split_consistent(source):
+    """在每个位置切成两个 chunk，流水线输出都与整体输入一次处理时相同"""
+    whole = run_pipeline([source])
+    return all(run_pipeline([source[:i], source[i:]]) == whole for i in range(len(source) + 1))
+
+
+def run_pipeline(chunks):
+    thinking, answer = [], []
+    pipeline = LangflowTokenPipeline()
+    for chunk in chunks:
+        for kind, text in pipeline.feed(chunk):
+            (thinking if kind == THINKING else answer).append(text)
+    for kind, text in pipeline.flush():
+        (thinking if kind == THINKING else answer).append(text)
+    return "".join(thinking), "".join(answer)
+
+
+def bench(func, chunks, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(chunks)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    print("== decode_escapes 边界情况 ==")
+    for name, (source, expected) in DECODE_CASES.items():
+        ok = decode_escapes(source) == expected and split_consistent(source)
+        print(f"  {name:<14} {'正确' if ok else '错误'}")
+
+    text = f"<think>{THINK_TEXT}</think>{ANSWER_TEXT}"
+    escaped = f"<think>{escape_some(THINK_TEXT, 0.3, 3)}</think>{escape_some(ANSWER_TEXT, 0.3, 4)}"
+    streams = {
+        "plain, token-sized": split_stream(text, 1, 6, seed=1),
+        "plain, large chunks": split_stream(text, 64, 256, seed=2),
+        "escaped, token-sized": split_stream(escaped, 1, 6, seed=5),
+        "escaped, large chunks": split_stream(escaped, 64, 256, seed=6),
+    }
+    expected = (THINK_TEXT, ANSWER_TEXT)
+
+    for name, chunks in streams.items():
+        legacy_time, legacy_result = bench(run_legacy, chunks)
+        pipeline_time, pipeline_result = bench(run_pipeline, chunks)
+        print(f"\n== {name}: {len(chunks)} tokens ==")
+        print(f"  legacy   : {legacy_time * 1e6 / len(chunks):8.3f} us/token  "
+              f"{len(chunks) / legacy_time / 1e6:6.2f} M tokens/s  正确: {legacy_result == expected}")
+        print(f"  pipeline : {pipeline_time * 1e6 / len(chunks):8.3f} us/token  "
+              f"{len(chunks) / pipeline_time / 1e6:6.2f} M tokens/s  正确: {pipeline_result == expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""回答流 Markdown 修正基准
+
+- 系统提示词：对比原来要求模型在代码块前空行的长提示词与现在的短提示词，计算每轮节省的 token
+- 修正效果：内置几类常见的格式错误，按不同大小切分成流，检查输出与切分方式无关、结果正确
+- 开销：每个 chunk 的处理耗时，以及暂存字符数（决定最多让 token 晚出现多少字符）
+
+用法：
+    python benchmarks/bench_markdown_stream.py                  # 使用内置的模拟回答
+    python benchmarks/bench_markdown_stream.py stream.jsonl     # 使用录制的流
+
+录制文件每行一个 delta，例如 {"content": "..."}，格式与 bench_thinking_parser.py 相同。
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MarkdownStreamNormalizer, count_tokens  # noqa: E402
+from utils.context_window import _get_encoding  # noqa: E402
+
+OLD_SYSTEM_PROMPT = (
+    "You are a helpful assistant. STOP! Read this carefully: When providing code blocks, you MUST ensure "
+    "there is a blank line before the opening triple backticks (```). Never start a code block directly "
+    "after a sentence without a newline."
+)
+NEW_SYSTEM_PROMPT = "You are a helpful assistant."
+
+# (模型输出, 期望的修正结果)
+CASES = {
+    "开始标记接在句子后": (
+        "下面是示例代码：```python\nimport smtplib\n```\n如需 HTML 邮件请修改 MIME 类型。",
+        "下面是示例代码：\n\n```python\nimport smtplib\n```\n如需 HTML 邮件请修改 MIME 类型。",
+    ),
+    "开始标记前没有空行": (
+        "Run this:\n```bash\npip install chainlit\n```\nThen start the app.",
+        "Run this:\n\n```bash\npip install chainlit\n```\nThen start the app.",
+    ),
+    "结束标记接在代码行末尾": (
+        "示例：\n\n```js\nconsole.log(1);```\n完成。",
+        "示例：\n\n```js\nconsole.log(1);\n```\n完成。",
+    ),
+    "正文接在结束标记后": (
+        "示例：\n\n```sql\nSELECT 1;\n```这样就可以了。",
+        "示例：\n\n```sql\nSELECT 1;\n```\n\n这样就可以了。",
+    ),
+    "标题缺少空格": ("##安装步骤\n1. 下载\n", "## 安装步骤\n1. 下载\n"),
+    "未闭合的代码块": ("代码：\n\n```py\nprint(1)", "代码：\n\n```py\nprint(1)\n```\n"),
+    "行内代码不修改": ("用 ```a``` 或 `b` 表示。\n", "用 ```a``` 或 `b` 表示。\n"),
+    "Markdown 代码块内嵌套代码块": (
+        "```md\n```py\nx\n```\n```\n完成。",
+        "```md\n```py\nx\n```\n```\n完成。",
+    ),
+}
+ANSWER_TEXT = (
+    "这个问题可以用 Python 解决，思路如下：先读取配置，再建立连接。"
+    "下面是示例代码：```python\nimport smtplib\n\ndef send(msg):\n    server = smtplib.SMTP('localhost')\n"
+    "    server.send_message(msg)```\n如需 HTML 邮件请修改 MIME 类型，`msg.set_content()` 可以设置正文。\n"
+    "##注意事项\n- 端口默认 25\n- 生产环境请使用 TLS\n\n"
+) * 40
+
+
+def split_stream(text, min_size, max_size, seed):
+    """把文本切成随机长度的 chunk，模拟上游的 delta"""
+    rng = random.Random(seed)
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(min_size, max_size)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def load_recorded(path):
+    chunks = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                content = json.loads(line).get("content")
+                if content:
+                    chunks.append(content)
+    return chunks
+
+
+def normalize(chunks):
+    """返回 (输出, 修正次数, 最多暂存的字符数)"""
+    normalizer = MarkdownStreamNormalizer()
+    out, max_held = [], 0
+    for chunk in chunks:
+        out.append(normalizer.feed(chunk))
+        max_held = max(max_held, normalizer.held)
+    out.append(normalizer.flush())
+    return "".join(out), normalizer.fixes, max_held
+
+
+def bench(chunks, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        normalize(chunks)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_passthrough(chunks, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        "".join(chunks)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def report_prompt():
+    old, new = count_tokens(OLD_SYSTEM_PROMPT), count_tokens(NEW_SYSTEM_PROMPT)
+    method = "tiktoken o200k_base" if _get_encoding() is not None else "估算"
+    print(f"== 系统提示词（{method}）==")
+    print(f"  原提示词: {old} tokens，现提示词: {new} tokens")
+    print(f"  每轮请求节省 {old - new} 个提示词 token，每 100 万轮约 {old - new}M tokens")
+
+
+def main():
+    report_prompt()
+
+    if len(sys.argv) > 1:
+        streams = {os.path.basename(p): load_recorded(p) for p in sys.argv[1:]}
+    else:
+        print("\n== 修正结果 ==")
+        for name, (text, expected) in CASES.items():
+            results = {normalize(split_stream(text, 1, 6, seed))[0] for seed in range(50)}
+            results.add(normalize(list(text))[0])
+            ok = results == {expected}
+            print(f"  {name:<14} {'正确' if ok else '错误'}")
+        streams = {
+            "token-sized (1-6 chars)": split_stream(ANSWER_TEXT, 1, 6, seed=1),
+            "byte-split (1 char)": list(ANSWER_TEXT),
+            "large chunks (64-256 chars)": split_stream(ANSWER_TEXT, 64, 256, seed=2),
+        }
+
+    reference = None
+    for name, chunks in streams.items():
+        output, fixes, max_held = normalize(chunks)
+        elapsed = bench(chunks)
+        baseline = bench_passthrough(chunks)
+        print(f"\n== {name}: {len(chunks)} chunks ==")
+        print(f"  normalizer : {elapsed * 1e6 / len(chunks):8.3f} us/chunk（直接拼接 {baseline * 1e6 / len(chunks):.3f} us/chunk）")
+        print(f"  修正 {fixes} 处，最多暂存 {max_held} 个字符")
+        if reference is None:
+            reference = output
+        elif len(sys.argv) == 1:
+            print(f"  与其他切分方式输出一致: {output == reference}")
+
+
+if __name__ == "__main__":
+    main()
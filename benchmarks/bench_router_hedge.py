@@ -0,0 +1,154 @@
+"""多端点路由与对冲请求基准
+
+在本进程启动本地的假流式端点，验证：
+
+1. 故障转移：一个端点总是返回 500、一个端点正常，所有请求都应成功，且故障端点被熔断
+2. 对冲：两个端点的首 token 延迟呈长尾分布（大部分很快，少数很慢），比较关闭和
+   开启对冲时的 TTFT 分位数、实际对冲比例，以及被取消的上游流数量；另外检查只有一个
+   端点且没有备用模型时不发出对冲请求
+
+用法：
+    python benchmarks/bench_router_hedge.py
+    python benchmarks/bench_router_hedge.py --requests 200 --slow-ratio 0.1 --slow-ttft 3 --max-rate 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.router import ChatRouter  # noqa: E402
+
+
+def make_endpoint(fast_ttft, slow_ttft, slow_ratio, error_rate, seed):
+    rng = random.Random(seed)
+    stats = {"requests": 0, "completed": 0, "cancelled": 0}
+
+    async def chat(request):
+        await request.json()
+        stats["requests"] += 1
+        if rng.random() < error_rate:
+            return web.json_response({"error": {"message": "boom", "type": "server_error"}}, status=500)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            await asyncio.sleep(slow_ttft if rng.random() < slow_ratio else fast_ttft)
+            for word in ("hello", " ", "world"):
+                chunk = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                         "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            stats["completed"] += 1
+        except asyncio.CancelledError:
+            stats["cancelled"] += 1
+            raise
+        except ConnectionResetError:
+            # 客户端已关闭连接（对冲中落败的请求）
+            stats["cancelled"] += 1
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat)
+    return app, stats
+
+
+async def serve(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def endpoint(name, port):
+    return {"name": name, "base_url": f"http://127.0.0.1:{port}/v1", "api_key": "bench", "model_name": "m"}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run_requests(router, count):
+    ttfts = []
+    for _ in range(count):
+        start = time.perf_counter()
+        _, _, stream = await router.open_stream({"messages": [{"role": "user", "content": "hi"}]})
+        ttft = None
+        async for chunk in stream:
+            if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                ttft = time.perf_counter() - start
+        ttfts.append(ttft)
+    return ttfts
+
+
+async def bench_failover(args, port):
+    bad_app, bad_stats = make_endpoint(0.01, 0.01, 0, 1.0, 1)
+    good_app, good_stats = make_endpoint(0.02, 0.02, 0, 0.0, 2)
+    runners = [await serve(bad_app, port), await serve(good_app, port + 1)]
+    router = ChatRouter([endpoint("bad", port), endpoint("good", port + 1)], explore=0)
+    ttfts = await run_requests(router, 50)
+    print("== 故障转移 ==")
+    print(f"成功 {len(ttfts)}/50，故障端点收到 {bad_stats['requests']} 个请求，正常端点 {good_stats['requests']} 个")
+    for item in router.get_stats():
+        print(f"  {item}")
+    for runner in runners:
+        await runner.cleanup()
+
+
+async def bench_hedge(args, port):
+    print("\n== 对冲 ==")
+    print(f"首 token：{1 - args.slow_ratio:.0%} 为 {args.fast_ttft}s，{args.slow_ratio:.0%} 为 {args.slow_ttft}s")
+    hedge = {
+        "percentile": args.percentile, "min_delay": 0.05, "max_delay": args.slow_ttft,
+        "default_delay": args.fast_ttft * 3, "max_rate": args.max_rate, "burst": 3, "model": "",
+    }
+    for label, config, endpoints in (
+        ("关闭对冲", None, 2),
+        ("开启对冲", hedge, 2),
+        ("单端点无备用模型", hedge, 1),
+    ):
+        apps = [make_endpoint(args.fast_ttft, args.slow_ttft, args.slow_ratio, 0.0, args.seed + i) for i in range(endpoints)]
+        runners = [await serve(app, port + i) for i, (app, _) in enumerate(apps)]
+        router = ChatRouter([endpoint(f"tail{i}", port + i) for i in range(endpoints)], explore=0, hedge=config)
+        ttfts = await run_requests(router, args.requests)
+        await asyncio.sleep(0.2)  # 等待被取消的流在服务端结束
+        requests = sum(stats["requests"] for _, stats in apps)
+        cancelled = sum(stats["cancelled"] for _, stats in apps)
+        extra = requests - args.requests
+        print(
+            f"{label}: TTFT p50 {percentile(ttfts, 50) * 1000:.0f}ms  p95 {percentile(ttfts, 95) * 1000:.0f}ms  "
+            f"p99 {percentile(ttfts, 99) * 1000:.0f}ms  max {max(ttfts) * 1000:.0f}ms  "
+            f"上游请求 {requests}（对冲比例 {extra / args.requests:.1%}），取消的上游流 {cancelled}"
+        )
+        for runner in runners:
+            await runner.cleanup()
+
+
+async def main_async(args):
+    await bench_failover(args, args.port)
+    await bench_hedge(args, args.port + 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--fast-ttft", type=float, default=0.05)
+    parser.add_argument("--slow-ttft", type=float, default=1.5)
+    parser.add_argument("--slow-ratio", type=float, default=0.08)
+    parser.add_argument("--percentile", type=float, default=90)
+    parser.add_argument("--max-rate", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--port", type=int, default=9310)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""全文搜索基准
+
+生成合成的聊天数据库（默认 100 万条 steps），消息内容由中英文词随机组成，另有少量
+消息包含罕见词。先建到迁移 4，再执行迁移 5 并回填索引（测量回填速度和索引大小），
+然后对随机抽取的用户测量几类查询的延迟：
+
+- 常见词 / 罕见词 / 多个词：MATCH + 用户 rowid 范围
+- 两个字的中文词：trigram 无法索引，在用户 rowid 范围内用 LIKE 过滤
+- 对照：不按 rowid 分区（MATCH 全部文档后再按会话所属用户过滤），以及直接 LIKE 扫描 steps
+
+用法：
+    python benchmarks/bench_search.py                  # 100 万条 steps
+    python benchmarks/bench_search.py --steps 200000   # 更小的数据集
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_db_indexes import generate  # noqa: E402
+from migrate_db import connect, migrate  # noqa: E402
+from search_index import backfill, query  # noqa: E402
+
+WORDS = (
+    "路由 对冲 数据库 索引 缓存 流式 模型 端点 延迟 吞吐 配置 部署 日志 监控 权限 会话 标题 思考 "
+    "python sqlite chainlit hedging latency throughput cache stream token prompt deploy router "
+    "如何 为什么 可以 需要 问题 方案 代码 函数 错误 超时"
+).split()
+RARE_WORD = "unicornium"
+
+# 不按用户分区的对照：先 MATCH 全部文档再按会话所属用户过滤
+UNPARTITIONED_QUERY = """
+    SELECT si.rowid, snippet(search_index, -1, '[', ']', '…', 24), bm25(search_index) AS score
+    FROM search_index si JOIN threads t ON t.id = si.thread_id
+    WHERE search_index MATCH ? AND t."userId" = ?
+    ORDER BY score LIMIT 21
+"""
+LIKE_SCAN_QUERY = """
+    SELECT s.id FROM steps s JOIN threads t ON t.id = s."threadId"
+    WHERE t."userId" = ? AND s.output LIKE ?
+    ORDER BY s."createdAt" DESC LIMIT 21
+"""
+
+
+def fill_text(conn, seed):
+    """把 generate() 生成的固定文本替换为随机词组成的消息，约千分之一包含罕见词"""
+    rng = random.Random(seed)
+    rowids = [row[0] for row in conn.execute("SELECT rowid FROM steps")]
+    for start in range(0, len(rowids), 20000):
+        batch = []
+        for rowid in rowids[start:start + 20000]:
+            words = rng.choices(WORDS, k=rng.randint(10, 60))
+            if rng.random() < 0.001:
+                words.insert(rng.randrange(len(words)), RARE_WORD)
+            batch.append((" ".join(words), rowid))
+        conn.execute("BEGIN")
+        conn.executemany("UPDATE steps SET output = ? WHERE rowid = ?", batch)
+        conn.execute("COMMIT")
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"  {label:<28} p50 {statistics.median(samples):7.2f}ms  p95 {p95:7.2f}ms  max {samples[-1]:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--steps-per-thread", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=20, help="抽取的用户数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", default=None, help="数据库路径（默认使用临时文件）")
+    args = parser.parse_args()
+
+    tmp = None
+    db_file = args.db
+    if db_file is None:
+        tmp = tempfile.TemporaryDirectory()
+        db_file = os.path.join(tmp.name, "bench.db")
+
+    conn = connect(db_file)
+    migrate(conn, target=4, verbose=False)
+    print(f"生成 {args.steps} 条 steps...")
+    start = time.time()
+    generate(conn, args.steps, args.users, args.steps_per_thread, args.seed)
+    fill_text(conn, args.seed)
+    print(f"  生成耗时 {time.time() - start:.1f}s，数据库 {os.path.getsize(db_file) / 1e6:.0f} MB")
+
+    migrate(conn, verbose=False)
+    start = time.time()
+    rows = backfill(conn, batch=10000, pause_ms=0, verbose=False)
+    elapsed = time.time() - start
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    try:
+        index_bytes = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE 'search_index%'").fetchone()[0]
+    except sqlite3.OperationalError:  # 未编译 dbstat 虚拟表
+        index_bytes = None
+    print(f"回填 {rows} 行，耗时 {elapsed:.1f}s（{rows / elapsed:,.0f} rows/s），数据库 {os.path.getsize(db_file) / 1e6:.0f} MB"
+          + (f"，其中索引 {index_bytes / 1e6:.0f} MB" if index_bytes else ""))
+
+    rng = random.Random(args.seed)
+    users = rng.sample([row for row in conn.execute("SELECT id, identifier FROM users")], min(args.samples, args.users))
+    print(f"\n查询延迟（{len(users)} 个用户，每个用户约 {args.steps // args.users} 条 steps，返回 20 条）：")
+    cases = [
+        ("常见词 latency", "latency"),
+        ("罕见词 " + RARE_WORD, RARE_WORD),
+        ("多个词 hedging router", "hedging router"),
+        ("中文 3 字 数据库", "数据库"),
+        ("中文 2 字 路由（LIKE）", "路由"),
+        ("混合 路由 hedging", "路由 hedging"),
+    ]
+    for label, text in cases:
+        samples = []
+        for _, identifier in users:
+            samples += timed(lambda: query(conn, identifier, text, limit=20), 3)
+        report(label, samples)
+
+    print("\n对照：")
+    for label, text in (("不分区 MATCH latency", "latency"), ("不分区 MATCH " + RARE_WORD, RARE_WORD)):
+        samples = []
+        for user_id, _ in users[:5]:
+            samples += timed(lambda: conn.execute(UNPARTITIONED_QUERY, (f'"{text}"', user_id)).fetchall(), 1)
+        report(label, samples)
+    samples = []
+    for user_id, _ in users[:5]:
+        samples += timed(lambda: conn.execute(LIKE_SCAN_QUERY, (user_id, f"%{RARE_WORD}%")).fetchall(), 1)
+    report("LIKE 扫描 steps " + RARE_WORD, samples)
+
+    conn.close()
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
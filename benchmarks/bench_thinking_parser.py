@@ -0,0 +1,117 @@
+"""<think> 标签解析微基准
+
+对比旧的逐 chunk 正则方案（get_thinking_content + filter_content）与
+ThinkStreamParser 的耗时，并检查思考内容是否泄漏到回答中。
+
+用法：
+    python benchmarks/bench_thinking_parser.py                 # 使用内置的模拟流
+    python benchmarks/bench_thinking_parser.py stream.jsonl    # 使用录制的流
+
+录制文件每行一个 delta，例如 {"content": "..."} 或 {"reasoning_content": "..."}。
+"""
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import ThinkStreamParser, THINKING, get_thinking_content, filter_content  # noqa: E402
+
+THINK_TEXT = "嗯，用户想要一个 Python 脚本。先考虑 smtplib，再考虑定时任务 cron。" * 40
+ANSWER_TEXT = "下面是示例代码：\n\n```python\nimport smtplib\n```\n如需 <b>HTML</b> 邮件请修改 MIME 类型。" * 40
+
+
+def split_stream(text, min_size, max_size, seed):
+    """把文本切成随机长度的 chunk，模拟上游的 delta"""
+    rng = random.Random(seed)
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(min_size, max_size)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def builtin_streams():
+    text = f"<think>{THINK_TEXT}</think>{ANSWER_TEXT}"
+    return {
+        "token-sized (1-6 chars)": split_stream(text, 1, 6, seed=1),
+        "byte-split (1 char)": list(text),
+        "large chunks (64-256 chars)": split_stream(text, 64, 256, seed=2),
+    }
+
+
+def load_recorded(path):
+    deltas = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                data = json.loads(line)
+                deltas.append(SimpleNamespace(
+                    content=data.get("content"),
+                    reasoning_content=data.get("reasoning_content"),
+                ))
+    return deltas
+
+
+def run_legacy(deltas):
+    thinking, answer = [], []
+    for delta in deltas:
+        thinking_content = get_thinking_content(delta)
+        if thinking_content is not None:
+            thinking.append(thinking_content)
+        elif delta.content:
+            content = filter_content(delta.content)
+            if content:
+                answer.append(content)
+    return "".join(thinking), "".join(answer)
+
+
+def run_parser(deltas):
+    thinking, answer = [], []
+    parser = ThinkStreamParser()
+    for delta in deltas:
+        for kind, text in parser.feed_delta(delta):
+            (thinking if kind == THINKING else answer).append(text)
+    for kind, text in parser.flush():
+        (thinking if kind == THINKING else answer).append(text)
+    return "".join(thinking), "".join(answer)
+
+
+def bench(func, deltas, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(deltas)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    if len(sys.argv) > 1:
+        streams = {os.path.basename(p): load_recorded(p) for p in sys.argv[1:]}
+        expected = None
+    else:
+        streams = {
+            name: [SimpleNamespace(content=c, reasoning_content=None) for c in chunks]
+            for name, chunks in builtin_streams().items()
+        }
+        expected = (THINK_TEXT, ANSWER_TEXT)
+
+    for name, deltas in streams.items():
+        legacy_time, legacy_result = bench(run_legacy, deltas, repeat=20)
+        parser_time, parser_result = bench(run_parser, deltas, repeat=20)
+        print(f"\n== {name}: {len(deltas)} deltas ==")
+        print(f"  regex  : {legacy_time * 1e6 / len(deltas):8.3f} us/delta")
+        print(f"  parser : {parser_time * 1e6 / len(deltas):8.3f} us/delta")
+        if expected:
+            print(f"  regex  正确: {legacy_result == expected}")
+            print(f"  parser 正确: {parser_result == expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import chainlit as cl
-from chainlit.input_widget import Slider
+from chainlit.input_widget import Slider, Switch, Select, TextInput, NumberInput, Tags
 import os
+import json
 from dotenv import load_dotenv
 
+from .config_service import ConfigFile
+
 # 加载环境变量
 load_dotenv()
 
@@ -12,35 +15,398 @@ API_KEY = os.getenv("API_KEY", "")
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.7"))
 
+# 流式输出合并：时间窗口(毫秒)、缓冲字符数阈值、是否遇到换行立即发送
+STREAM_FLUSH_INTERVAL_MS = int(os.getenv("STREAM_FLUSH_INTERVAL_MS", "40"))
+STREAM_FLUSH_MAX_CHARS = int(os.getenv("STREAM_FLUSH_MAX_CHARS", "256"))
+STREAM_FLUSH_ON_NEWLINE = os.getenv("STREAM_FLUSH_ON_NEWLINE", "true").lower() == "true"
+STREAM_STATS_LOG = os.getenv("STREAM_STATS_LOG", "false").lower() == "true"
+
+# 回答流的 Markdown 修正（代码块标记换行、补空行等）：是否开启、最多暂存的字符数
+MARKDOWN_NORMALIZE = os.getenv("MARKDOWN_NORMALIZE", "true").lower() == "true"
+MARKDOWN_LOOKAHEAD_CHARS = int(os.getenv("MARKDOWN_LOOKAHEAD_CHARS", "32"))
+
+# 共享 OpenAI 客户端连接池：每个上游的最大连接数、保活连接数、保活时长(秒)
+OPENAI_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "200"))
+OPENAI_POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "50"))
+OPENAI_POOL_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_POOL_KEEPALIVE_EXPIRY", "60"))
+
+# Langflow 共享会话：连接数上限、空闲连接保留时间、单个流式事件的最大字节数
+LANGFLOW_MAX_CONNECTIONS = int(os.getenv("LANGFLOW_MAX_CONNECTIONS", "100"))
+LANGFLOW_MAX_CONNECTIONS_PER_HOST = int(os.getenv("LANGFLOW_MAX_CONNECTIONS_PER_HOST", "0"))
+LANGFLOW_KEEPALIVE_TIMEOUT = float(os.getenv("LANGFLOW_KEEPALIVE_TIMEOUT", "60"))
+LANGFLOW_CONNECT_TIMEOUT = float(os.getenv("LANGFLOW_CONNECT_TIMEOUT", "10"))
+LANGFLOW_MAX_EVENT_BYTES = int(os.getenv("LANGFLOW_MAX_EVENT_BYTES", str(1024 * 1024)))
+
+# 后台标题生成：并发数、超时(秒)、聊天流达到多少时让步、最长让步时间(秒)
+TITLE_QUEUE_CONCURRENCY = int(os.getenv("TITLE_QUEUE_CONCURRENCY", "2"))
+TITLE_TIMEOUT = float(os.getenv("TITLE_TIMEOUT", "20"))
+TITLE_DEFER_CHAT_STREAMS = int(os.getenv("TITLE_DEFER_CHAT_STREAMS", "8"))
+TITLE_MAX_DEFER = float(os.getenv("TITLE_MAX_DEFER", "30"))
+# 仅凭用户消息生成标题，与主回复并行，不等回复结束
+TITLE_FROM_USER_MESSAGE = os.getenv("TITLE_FROM_USER_MESSAGE", "true").lower() == "true"
+
+# 登录校验：用户数据库、bcrypt 线程数、校验结果缓存时间(秒)
+AUTH_DB_FILE = os.getenv("AUTH_DB_FILE", "users.db")
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "4"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+DEV_MODE = os.getenv("DEV_MODE", "false").lower() == "true"
+
+# 聊天记录数据库：路径、连接池大小、SQLite PRAGMA
+CHAT_DB_PATH = os.getenv("CHAT_DB_PATH", "mychat.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(64 * 1024)))
+# 步骤写回缓冲：合并同一步骤的多次更新，按时间(毫秒)或条数批量落库
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "200"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+# 归档会话文件所在目录（由 retention.py 写入，恢复会话时读取）
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# 回复缓存（可选）：只缓存温度不高于 RESPONSE_CACHE_MAX_TEMPERATURE 的请求
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "response_cache.db")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "512"))
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0"))
+
+# 上下文窗口：默认提示词 token 预算，可按模型覆盖，例如 {"deepseek-reasoner": 60000}
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "32000"))
+CONTEXT_MODEL_BUDGETS = json.loads(os.getenv("CONTEXT_MODEL_BUDGETS", "{}") or "{}")
+# 是否用滚动摘要代替被裁剪的早期消息（需要额外的模型调用）
+CONTEXT_SUMMARY = os.getenv("CONTEXT_SUMMARY", "false").lower() == "true"
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+
+# 延迟指标：/metrics 接口开关与路径，JSONL 追踪文件（为空则不写）
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# 访问 /metrics 需要的 Bearer token；为空时只允许本机访问
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_TRACE_FILE = os.getenv("METRICS_TRACE_FILE", "")
+
+# 聊天记录全文搜索接口：开关、路径、每页最多结果数、最大翻页偏移、参与排序的最近匹配数
+SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true").lower() == "true"
+SEARCH_PATH = os.getenv("SEARCH_PATH", "/api/search")
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "50"))
+SEARCH_MAX_OFFSET = int(os.getenv("SEARCH_MAX_OFFSET", "1000"))
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "1000"))
+
+# 多端点路由：同一逻辑模型的多个 OpenAI 兼容端点（JSON 列表），为空时只使用 API_BASE_URL；
+# config/models.json 中配置了 endpoints 时以文件为准
+# 例如 [{"name": "a", "base_url": "...", "api_key": "...", "model_name": "..."}]，省略的字段取上面的默认值
+MODEL_ENDPOINTS = json.loads(os.getenv("MODEL_ENDPOINTS", "[]") or "[]")
+# 统计窗口(请求数)、熔断条件、冷却时间(秒)、首 token 超时(秒)、探索概率
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "50"))
+ROUTER_ERROR_THRESHOLD = float(os.getenv("ROUTER_ERROR_THRESHOLD", "0.5"))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))
+ROUTER_MAX_COOLDOWN = float(os.getenv("ROUTER_MAX_COOLDOWN", "300"))
+ROUTER_FIRST_TOKEN_TIMEOUT = float(os.getenv("ROUTER_FIRST_TOKEN_TIMEOUT", "60"))
+ROUTER_EXPLORE = float(os.getenv("ROUTER_EXPLORE", "0.05"))
+# 对冲请求（默认关闭）：首 token 超过 TTFT 分位数（秒数限定在 MIN/MAX 之间）时再发一份请求；
+# 样本不足时使用默认截止时间；对冲比例不超过 HEDGE_MAX_RATE，HEDGE_MODEL 为空时使用端点自身的模型
+# （此时只有一个可用端点的请求不对冲，避免向同一个变慢的端点重复发送）
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "15"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "5"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", "3"))
+HEDGE_MODEL = os.getenv("HEDGE_MODEL", "")
+
+# 准入控制：每个端点的并发上限、每个用户每分钟的请求数(0 表示不限)与突发数、最长排队时间(秒)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_ENDPOINT_CONCURRENCY = int(os.getenv("ADMISSION_ENDPOINT_CONCURRENCY", "32"))
+ADMISSION_USER_RATE_PER_MIN = float(os.getenv("ADMISSION_USER_RATE_PER_MIN", "30"))
+ADMISSION_USER_BURST = int(os.getenv("ADMISSION_USER_BURST", "10"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+# 热加载配置文件所在目录，以及检查文件变化的最小间隔(秒)
+CONFIG_DIR = os.getenv("CONFIG_DIR", os.path.dirname(os.path.abspath(__file__)))
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", "2"))
+
 # 验证 API Key 配置
 if not API_KEY:
     print("⚠️ 警告: API_KEY 未配置，请在 .env 文件中设置")
 
-# 聊天设置配置 (只保留温度调节)
-CHAT_SETTINGS = [
-    Slider(
-        id="Temperature",
-        label="温度 (Temperature)",
-        initial=TEMPERATURE,
-        min=0,
-        max=1,
-        step=0.05,
-        description="控制输出的随机性，值越高输出越随机",
-    )
-]
+WIDGET_TYPES = {
+    "slider": Slider,
+    "switch": Switch,
+    "select": Select,
+    "text": TextInput,
+    "number": NumberInput,
+    "tags": Tags,
+}
+
+
+def _load_starters(data):
+    """校验 starters.json：{"starters": [{"label", "message", "icon"?}, ...]}"""
+    starters = []
+    for item in data["starters"]:
+        if not isinstance(item, dict) or not item.get("label") or not item.get("message"):
+            raise ValueError(f"starter 缺少 label 或 message: {item}")
+        starters.append(cl.Starter(**item))
+    return starters
+
+
+def _load_models(data):
+    """校验 models.json：模型名、默认温度和端点列表，省略的字段取环境变量
+
+    端点的 api_key 可以用 api_key_env 指定从哪个环境变量读取，避免把密钥写进文件。
+    """
+    if not isinstance(data, dict):
+        raise ValueError("顶层必须是对象")
+    model_name = data.get("model_name") or MODEL_NAME
+    temperature = float(data.get("temperature", TEMPERATURE))
+    if not 0 <= temperature <= 2:
+        raise ValueError(f"temperature 超出范围: {temperature}")
+
+    endpoints = []
+    for index, endpoint in enumerate(data.get("endpoints") or MODEL_ENDPOINTS):
+        if not isinstance(endpoint, dict):
+            raise ValueError(f"端点配置必须是对象: {endpoint}")
+        api_key = os.getenv(endpoint["api_key_env"], "") if endpoint.get("api_key_env") else endpoint.get("api_key")
+        endpoints.append({
+            "name": endpoint.get("name") or f"endpoint-{index}",
+            "base_url": endpoint.get("base_url") or API_BASE_URL,
+            "api_key": api_key or API_KEY,
+            "model_name": endpoint.get("model_name") or model_name,
+        })
+    if not endpoints:
+        endpoints = [{"name": "default", "base_url": API_BASE_URL, "api_key": API_KEY, "model_name": model_name}]
+    names = [endpoint["name"] for endpoint in endpoints]
+    if len(set(names)) != len(names):
+        raise ValueError(f"端点名称重复: {names}")
+    return {"model_name": model_name, "temperature": temperature, "endpoints": endpoints}
+
+
+def _load_chat_settings(data):
+    """校验 chat_settings.json：[{"type": "slider", "id": ..., ...}, ...]"""
+    widgets = []
+    for item in data:
+        params = dict(item)
+        widget_type = WIDGET_TYPES.get(params.pop("type", None))
+        if widget_type is None:
+            raise ValueError(f"未知的设置控件类型: {item}")
+        widgets.append(widget_type(**params))
+    ids = [widget.id for widget in widgets]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"设置控件 id 重复: {ids}")
+    return widgets
+
+
+def _default_chat_settings():
+    # 默认只有温度调节，初始值跟随 models.json
+    return [
+        Slider(
+            id="Temperature",
+            label="温度 (Temperature)",
+            initial=get_model_config()["temperature"],
+            min=0,
+            max=1,
+            step=0.05,
+            description="控制输出的随机性，值越高输出越随机",
+        )
+    ]
+
+
+# 启动器、模型/端点和聊天设置控件：进程内缓存，文件修改后自动重新加载
+STARTERS = ConfigFile(
+    os.path.join(CONFIG_DIR, "starters.json"), _load_starters, list, CONFIG_RELOAD_INTERVAL
+)
+MODELS = ConfigFile(
+    os.path.join(CONFIG_DIR, "models.json"), _load_models, lambda: _load_models({}), CONFIG_RELOAD_INTERVAL
+)
+CHAT_SETTINGS = ConfigFile(
+    os.path.join(CONFIG_DIR, "chat_settings.json"), _load_chat_settings, None, CONFIG_RELOAD_INTERVAL
+)
 
 
 async def get_chat_settings():
     """获取聊天设置"""
-    settings = await cl.ChatSettings(CHAT_SETTINGS).send()
+    settings = await cl.ChatSettings(CHAT_SETTINGS.get() or _default_chat_settings()).send()
     return settings
 
 
+def get_starters():
+    """获取对话启动器列表"""
+    return STARTERS.get()
+
+
 def get_model_config():
-    """获取模型配置（简化版：直接从环境变量读取）"""
+    """获取模型配置：第一个端点的地址和密钥、模型名和默认温度"""
+    models = MODELS.get()
+    primary = models["endpoints"][0]
+    return {
+        "base_url": primary["base_url"],
+        "api_key": primary["api_key"],
+        "model_name": models["model_name"],
+        "temperature": models["temperature"],
+    }
+
+
+def get_stream_config():
+    """获取流式输出合并配置"""
+    return {
+        "interval": STREAM_FLUSH_INTERVAL_MS / 1000,
+        "max_size": STREAM_FLUSH_MAX_CHARS,
+        "flush_on_newline": STREAM_FLUSH_ON_NEWLINE,
+    }
+
+
+def get_markdown_config():
+    """获取回答流 Markdown 修正配置"""
+    return {"lookahead": MARKDOWN_LOOKAHEAD_CHARS}
+
+
+def get_client_pool_config():
+    """获取共享客户端连接池配置"""
+    return {
+        "max_connections": OPENAI_POOL_MAX_CONNECTIONS,
+        "max_keepalive_connections": OPENAI_POOL_MAX_KEEPALIVE,
+        "keepalive_expiry": OPENAI_POOL_KEEPALIVE_EXPIRY,
+    }
+
+
+def get_langflow_pool_config():
+    """获取 Langflow 共享会话配置"""
+    return {
+        "max_connections": LANGFLOW_MAX_CONNECTIONS,
+        "max_connections_per_host": LANGFLOW_MAX_CONNECTIONS_PER_HOST,
+        "keepalive_timeout": LANGFLOW_KEEPALIVE_TIMEOUT,
+        "connect_timeout": LANGFLOW_CONNECT_TIMEOUT,
+        "max_event_bytes": LANGFLOW_MAX_EVENT_BYTES,
+    }
+
+
+def get_title_queue_config():
+    """获取后台标题生成队列配置"""
+    return {
+        "concurrency": TITLE_QUEUE_CONCURRENCY,
+        "timeout": TITLE_TIMEOUT,
+        "defer_threshold": TITLE_DEFER_CHAT_STREAMS,
+        "max_defer": TITLE_MAX_DEFER,
+    }
+
+
+def get_context_config(model_name):
+    """获取指定模型的上下文窗口配置"""
+    return {
+        "budget": int(CONTEXT_MODEL_BUDGETS.get(model_name, CONTEXT_TOKEN_BUDGET)),
+        "summary": CONTEXT_SUMMARY,
+        "summary_max_tokens": CONTEXT_SUMMARY_MAX_TOKENS,
+    }
+
+
+def get_auth_config():
+    """获取登录校验配置"""
+    return {
+        "db_file": AUTH_DB_FILE,
+        "workers": AUTH_WORKERS,
+        "cache_ttl": AUTH_CACHE_TTL,
+        "dev_mode": DEV_MODE,
+    }
+
+
+def get_data_layer_config():
+    """获取数据层配置"""
+    return {
+        "conninfo": f"sqlite+aiosqlite:///{CHAT_DB_PATH}",
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "write_behind": WRITE_BEHIND_ENABLED,
+        "write_behind_interval": WRITE_BEHIND_INTERVAL_MS / 1000,
+        "write_behind_max_batch": WRITE_BEHIND_MAX_BATCH,
+        "archive_dir": ARCHIVE_DIR,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": DB_BUSY_TIMEOUT_MS,
+            "mmap_size": DB_MMAP_SIZE,
+            "cache_size": -DB_CACHE_SIZE_KB,  # 负数表示 KB
+            "temp_store": "MEMORY",
+        },
+    }
+
+
+def get_response_cache_config():
+    """获取回复缓存配置"""
+    return {
+        "db_file": RESPONSE_CACHE_DB,
+        "ttl": RESPONSE_CACHE_TTL,
+        "max_bytes": int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+        "memory_entries": RESPONSE_CACHE_MEMORY_ENTRIES,
+    }
+
+
+def get_metrics_config():
+    """获取指标接口与追踪文件配置"""
+    return {
+        "enabled": METRICS_ENABLED,
+        "path": METRICS_PATH,
+        "token": METRICS_TOKEN,
+        "trace_file": METRICS_TRACE_FILE,
+    }
+
+
+def get_search_config():
+    """获取全文搜索接口配置"""
+    return {
+        "enabled": SEARCH_ENABLED,
+        "path": SEARCH_PATH,
+        "max_limit": SEARCH_MAX_LIMIT,
+        "max_offset": SEARCH_MAX_OFFSET,
+        "candidates": SEARCH_CANDIDATES,
+    }
+
+
+def get_model_endpoints():
+    """获取主对话模型的端点列表（至少一个）；配置未变化时返回同一个列表对象"""
+    return MODELS.get()["endpoints"]
+
+
+def get_router_config():
+    """获取多端点路由配置"""
+    return {
+        "window": ROUTER_WINDOW,
+        "error_threshold": ROUTER_ERROR_THRESHOLD,
+        "min_samples": ROUTER_MIN_SAMPLES,
+        "failure_threshold": ROUTER_FAILURE_THRESHOLD,
+        "cooldown": ROUTER_COOLDOWN,
+        "max_cooldown": ROUTER_MAX_COOLDOWN,
+        "first_token_timeout": ROUTER_FIRST_TOKEN_TIMEOUT,
+        "explore": ROUTER_EXPLORE,
+        "max_in_flight": ADMISSION_ENDPOINT_CONCURRENCY if ADMISSION_ENABLED else 0,
+    }
+
+
+def get_admission_config():
+    """获取准入控制配置（每个池的默认并发上限即每端点上限）"""
+    return {
+        "capacity": ADMISSION_ENDPOINT_CONCURRENCY,
+        "user_rate": ADMISSION_USER_RATE_PER_MIN,
+        "user_burst": ADMISSION_USER_BURST,
+        "queue_timeout": ADMISSION_QUEUE_TIMEOUT,
+    }
+
+
+def get_hedge_config():
+    """获取对冲请求配置，未开启时返回 None"""
+    if not HEDGE_ENABLED:
+        return None
     return {
-        "base_url": API_BASE_URL,
-        "api_key": API_KEY,
-        "model_name": MODEL_NAME,
-        "temperature": TEMPERATURE,
-    }
\ No newline at end of file
+        "percentile": HEDGE_PERCENTILE,
+        "min_delay": HEDGE_MIN_DELAY,
+        "max_delay": HEDGE_MAX_DELAY,
+        "default_delay": HEDGE_DEFAULT_DELAY,
+        "max_rate": HEDGE_MAX_RATE,
+        "burst": HEDGE_BURST,
+        "model": HEDGE_MODEL,
+    }
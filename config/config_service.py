@@ -0,0 +1,76 @@
+"""配置文件热加载
+
+ConfigFile 在内存中缓存一个 JSON 配置文件解析、校验后的结果。读取时最多每
+check_interval 秒检查一次文件的 mtime 和大小，变化时重新加载并校验，校验通过后
+整体替换；校验失败时继续使用旧配置。请求路径上只有偶尔的一次 stat，修改模型、
+端点或启动器也不需要重启服务。
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class ConfigFile:
+    """一个可热加载的 JSON 配置文件
+
+    Args:
+        path: 文件路径
+        loader: 把 json 解析结果转换为配置对象的函数，配置无效时抛出 ValueError / TypeError / KeyError
+        default: 文件不存在时返回默认配置的函数
+        check_interval: 两次检查文件是否变化的最小间隔（秒），0 表示每次读取都检查
+    """
+
+    def __init__(self, path, loader, default=None, check_interval=2.0):
+        self.path = path
+        self._loader = loader
+        self._default = default or (lambda: None)
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._state = (None, self._default())  # (文件签名, 配置对象)，整体替换保证读取方看到一致的配置
+        self._checked = 0.0
+        self.version = 0
+        self._started = False
+        self.reload()
+        self._started = True
+
+    def get(self):
+        """返回当前配置，必要时先检查文件是否变化"""
+        now = time.monotonic()
+        if now - self._checked >= self._check_interval:
+            self._checked = now
+            self.reload()
+        return self._state[1]
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        """文件有变化时重新加载，返回配置是否被替换"""
+        signature = self._signature()
+        if signature == self._state[0]:
+            return False
+        with self._lock:
+            if signature == self._state[0]:
+                return False
+            if signature is None:
+                value = self._default()
+            else:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        value = self._loader(json.load(f))
+                except (OSError, ValueError, TypeError, KeyError) as e:
+                    # 记住这个签名，文件再次修改前不重复报错
+                    self._state = (signature, self._state[1])
+                    print(f"❌ 配置文件 {self.path} 无效，继续使用旧配置: {e}", flush=True)
+                    return False
+            self._state = (signature, value)
+            self.version += 1
+            if self._started:
+                print(f"🔄 已重新加载配置文件 {self.path}", flush=True)
+            return True
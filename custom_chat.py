@@ -1,18 +1,163 @@
+import asyncio
+import hashlib
+import threading
+import weakref
 from langchain_openai import ChatOpenAI
-from typing import Iterator
-from langchain_core.messages import BaseMessage, AIMessageChunk
-from openai import OpenAI
+from typing import AsyncIterator, Iterator, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_core.runnables.config import get_config_list, get_executor_for_config
+from openai import AsyncOpenAI, OpenAI
+from pydantic import model_validator
 from langchain_core.messages import AIMessage
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# 按 (base_url, api_key 摘要) 复用客户端：同步客户端进程内共享，
+# 异步客户端的连接绑定事件循环，因此按事件循环分别缓存
+_sync_clients = {}
+_sync_clients_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+# 按上游共享的限流器：同一端点上的多个实例、多个批任务共用一个令牌桶
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _client_key(base_url, api_key):
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else ""
+    return (base_url or "").rstrip("/"), digest
+
+
+async def close_clients():
+    """关闭缓存的客户端及其连接池（进程退出时在事件循环上调用）
+
+    异步客户端只能在创建它的事件循环上关闭，其他（已结束的）事件循环的客户端只丢弃引用。
+    """
+    with _sync_clients_lock:
+        sync_clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    async_clients = list(_async_clients.pop(asyncio.get_running_loop(), {}).values())
+    _async_clients.clear()
+    for client in sync_clients:
+        try:
+            client.close()
+        except Exception as e:
+            print(f"❌ 关闭 OpenAI 客户端失败: {e}", flush=True)
+    for client in async_clients:
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"❌ 关闭 OpenAI 客户端失败: {e}", flush=True)
+
+
+def _to_message_dicts(messages):
+    """把 LangChain 消息转换为 OpenAI 格式"""
+    roles = {"human": "user", "ai": "assistant"}
+    return [{"role": roles.get(msg.type, msg.type), "content": msg.content} for msg in messages]
+
+
+class _ThinkWrapper:
+    """把 reasoning_content 包装成 <think>...</think>，只允许出现一次"""
+
+    __slots__ = ("in_think_tag", "think_closed")
+
+    def __init__(self):
+        self.in_think_tag = False
+        self.think_closed = False
+
+    def feed(self, delta):
+        """返回该 delta 对应的文本片段列表"""
+        reasoning_content = getattr(delta, "reasoning_content", None)
+        if reasoning_content:
+            # 如果已经关闭了 think，则忽略后续 reasoning_content
+            if self.think_closed:
+                return []
+            if not self.in_think_tag:
+                self.in_think_tag = True
+                return ["<think>\n", reasoning_content]
+            return [reasoning_content]
+
+        content = getattr(delta, "content", None)
+        if content:
+            if self.in_think_tag:
+                self.in_think_tag = False
+                self.think_closed = True
+                return ["\n</think>\n", content]
+            return [content]
+        return []
+
+    def close(self):
+        """流结束时 <think> 还没关闭则补一个"""
+        if self.in_think_tag:
+            self.in_think_tag = False
+            self.think_closed = True
+            return ["\n</think>\n"]
+        return []
+
+
+def _format_message(message):
+    content = ""
+    if hasattr(message, "reasoning_content") and message.reasoning_content:
+        content += "<think>\n\n" + message.reasoning_content + "\n</think>\n\n"
+    if hasattr(message, "content") and message.content:
+        content += message.content
+    return content
+
 
 class CustomChatOpenAI(ChatOpenAI):
-    """自定义的ChatOpenAI类，支持reasoning_content处理"""
+    """自定义的ChatOpenAI类，支持reasoning_content处理
+
+    batch/abatch 并发执行请求：并发数由 batch_concurrency（或 config 中的
+    max_concurrency）限制，每个请求都走 BaseChatModel 的调用流程（回调、tags、
+    metadata 照常生效）。设置 requests_per_second 后同一端点共享一个限流器。
+    """
+
+    batch_concurrency: int = 8
+    requests_per_second: Optional[float] = None
+
+    @model_validator(mode="after")
+    def _use_endpoint_rate_limiter(self):
+        # BaseChatModel 在每次请求前向 rate_limiter 申请令牌
+        if self.rate_limiter is None and self.requests_per_second:
+            self.rate_limiter = self._endpoint_rate_limiter()
+        return self
+
+    def _client_args(self):
+        api_key = self.openai_api_key.get_secret_value() if self.openai_api_key else None
+        return self.openai_api_base, api_key
 
     def _create_client(self) -> OpenAI:
-        return OpenAI(
-            base_url=self.openai_api_base,
-            api_key=self.openai_api_key.get_secret_value() if self.openai_api_key else None,
-        )
+        base_url, api_key = self._client_args()
+        key = _client_key(base_url, api_key)
+        # batch 在线程池中并发调用，加锁避免同一端点创建多个连接池
+        with _sync_clients_lock:
+            client = _sync_clients.get(key)
+            if client is None:
+                client = _sync_clients[key] = OpenAI(base_url=base_url, api_key=api_key)
+        return client
+
+    def _endpoint_rate_limiter(self):
+        if not self.requests_per_second:
+            return None
+        key = (_client_key(*self._client_args()), self.requests_per_second)
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.get(key)
+            if limiter is None:
+                limiter = _rate_limiters[key] = InMemoryRateLimiter(
+                    requests_per_second=self.requests_per_second,
+                    check_every_n_seconds=min(0.1, 0.5 / self.requests_per_second),
+                )
+        return limiter
+
+    def _create_async_client(self) -> AsyncOpenAI:
+        base_url, api_key = self._client_args()
+        key = _client_key(base_url, api_key)
+        clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+        client = clients.get(key)
+        if client is None:
+            client = clients[key] = AsyncOpenAI(base_url=base_url, api_key=api_key)
+        return client
 
     def _process_stream(
         self,
@@ -27,89 +172,173 @@ class CustomChatOpenAI(ChatOpenAI):
             **kwargs
         )
 
-        in_think_tag = False
-        think_closed = False
-
+        wrapper = _ThinkWrapper()
         for chunk in stream:
             if not chunk.choices:
                 continue
+            for text in wrapper.feed(chunk.choices[0].delta):
+                yield AIMessageChunk(content=text)
 
-            delta = chunk.choices[0].delta
-
-            if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                # 只允许出现一次 <think>...</think>
-                if not in_think_tag and not think_closed:
-                    yield AIMessageChunk(content="<think>\n")
-                    in_think_tag = True
-                if in_think_tag and not think_closed:
-                    yield AIMessageChunk(content=delta.reasoning_content)
-                # 如果已经关闭了 think，则忽略后续 reasoning_content
-
-            elif hasattr(delta, 'content') and delta.content:
-                if in_think_tag and not think_closed:
-                    yield AIMessageChunk(content="\n</think>\n")
-                    in_think_tag = False
-                    think_closed = True
-                yield AIMessageChunk(content=delta.content)
-
-        # 如果流结束时 <think> 还没关闭，补一个
-        if in_think_tag and not think_closed:
-            yield AIMessageChunk(content="\n</think>\n")
+        for text in wrapper.close():
+            yield AIMessageChunk(content=text)
 
     def stream(
         self,
         messages,
         **kwargs,
     ) -> Iterator[AIMessageChunk]:
-        message_dicts = [
-            {"role": "user" if msg.type == "human" else msg.type, "content": msg.content}
-            for msg in messages
-        ]
-        return self._process_stream(message_dicts, **kwargs)
+        return self._process_stream(_to_message_dicts(messages), **kwargs)
+
+    def _stream(
+        self,
+        messages,
+        stop=None,
+        run_manager=None,
+        **kwargs,
+    ) -> Iterator[ChatGenerationChunk]:
+        """同步流式输出：streaming=True 时 BaseChatModel.invoke 通过这里读取"""
+        if stop:
+            kwargs["stop"] = stop
+        for chunk in self._process_stream(_to_message_dicts(messages), **kwargs):
+            generation_chunk = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=generation_chunk)
+            yield generation_chunk
 
     def _generate(
         self,
         messages,
+        stop=None,
+        run_manager=None,
         **kwargs,
     ):
+        if stop:
+            kwargs["stop"] = stop
         client = self._create_client()
-        message_dicts = [
-            {"role": "user" if msg.type == "human" else msg.type, "content": msg.content}
-            for msg in messages
-        ]
         response = client.chat.completions.create(
             model=self.model_name,
-            messages=message_dicts,
+            messages=_to_message_dicts(messages),
             stream=False,
             **kwargs
         )
-        choice = response.choices[0]
-        content = ""
-        if hasattr(choice.message, "reasoning_content") and choice.message.reasoning_content:
-            content += "<think>\n\n" + choice.message.reasoning_content + "\n</think>\n\n"
-        if hasattr(choice.message, "content") and choice.message.content:
-            content += choice.message.content
-        message = AIMessage(content=content)
+        message = AIMessage(content=_format_message(response.choices[0].message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(
+        self,
+        messages,
+        stop=None,
+        run_manager=None,
+        **kwargs,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """原生异步流式输出：在事件循环上直接读取 AsyncOpenAI 的流，不占用线程"""
+        if stop:
+            kwargs["stop"] = stop
+        client = self._create_async_client()
+        stream = await client.chat.completions.create(
+            model=self.model_name,
+            messages=_to_message_dicts(messages),
+            stream=True,
+            **kwargs
+        )
+
+        wrapper = _ThinkWrapper()
+        async with stream:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                for text in wrapper.feed(chunk.choices[0].delta):
+                    generation_chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                    if run_manager:
+                        await run_manager.on_llm_new_token(text, chunk=generation_chunk)
+                    yield generation_chunk
+
+        for text in wrapper.close():
+            generation_chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=generation_chunk)
+            yield generation_chunk
+
+    async def _agenerate(
+        self,
+        messages,
+        stop=None,
+        run_manager=None,
+        **kwargs,
+    ):
+        if stop:
+            kwargs["stop"] = stop
+        client = self._create_async_client()
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=_to_message_dicts(messages),
+            stream=False,
+            **kwargs
+        )
+        message = AIMessage(content=_format_message(response.choices[0].message))
         return ChatResult(generations=[ChatGeneration(message=message)])
 
     def invoke(
         self,
         input,
+        config=None,
         **kwargs,
     ):
         if self.streaming:
             if isinstance(input, str):
                 messages = [{"role": "user", "content": input}]
             else:
-                messages = [
-                    {"role": "user" if msg.type == "human" else msg.type, "content": msg.content}
-                    for msg in input
-                ]
+                messages = _to_message_dicts(input)
             return self._process_stream(messages, **kwargs)
-        else:
-            if isinstance(input, str):
-                messages = [BaseMessage(content=input, type="human")]
-            else:
-                messages = input
-            result = self._generate(messages, **kwargs)
-            return result.generations[0].message
\ No newline at end of file
+        return super().invoke(input, config, **kwargs)
+
+    def batch(
+        self,
+        inputs,
+        config=None,
+        *,
+        return_exceptions=False,
+        **kwargs,
+    ):
+        """在线程池中并发执行多个请求，结果按输入顺序返回
+
+        与 Runnable.batch 相同，只是每个请求都走 BaseChatModel.invoke，streaming=True 时
+        也返回完整的消息而不是流。return_exceptions=True 时失败的请求在对应位置返回异常，
+        否则抛出第一个失败的异常。
+        """
+        if not inputs:
+            return []
+        configs = self._batch_configs(config, len(inputs))
+
+        def run(item, item_config):
+            if return_exceptions:
+                try:
+                    return BaseChatModel.invoke(self, item, item_config, **kwargs)
+                except Exception as e:
+                    return e
+            return BaseChatModel.invoke(self, item, item_config, **kwargs)
+
+        with get_executor_for_config(configs[0]) as executor:
+            return list(executor.map(run, inputs, configs))
+
+    async def abatch(
+        self,
+        inputs,
+        config=None,
+        *,
+        return_exceptions=False,
+        **kwargs,
+    ):
+        """在事件循环上并发执行多个请求（Runnable.abatch），结果按输入顺序返回"""
+        if not inputs:
+            return []
+        return await super().abatch(
+            inputs, self._batch_configs(config, len(inputs)), return_exceptions=return_exceptions, **kwargs
+        )
+
+    def _batch_configs(self, config, count):
+        """每个请求的 config，没有指定 max_concurrency 时使用 batch_concurrency"""
+        return [
+            item if item.get("max_concurrency") else {**item, "max_concurrency": max(1, self.batch_concurrency)}
+            for item in get_config_list(config, count)
+        ]
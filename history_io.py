@@ -0,0 +1,334 @@
+"""聊天记录的流式导出 / 导入
+
+导出：在一个只读事务（一致的快照）中按会话 id 做键集分页，逐个会话写出会话本身及其
+steps、elements、feedbacks，输出为 gzip 压缩的 JSONL。每次只在内存中保留一页会话和
+一批行，内存占用与数据库大小无关；导出期间应用可以照常写入（WAL 模式）。
+
+保留策略（retention.py）归档的会话只有会话本身留在数据库中，步骤、元素和反馈在
+ARCHIVE_DIR 下的归档文件里。默认只导出数据库中的内容；加 --include-archives 时读取
+归档文件，把归档的行与数据库中的行一起导出（相同 id 以数据库为准），导入后这些行
+回到目标库的表中，成为普通的聊天记录。归档文件逐个会话读入内存。
+
+导入：先把目标数据库迁移到最新版本，再按批次在事务中写入；已存在的行默认跳过，
+--replace 时按 id 就地更新（ON CONFLICT DO UPDATE，不删除旧行，全文索引的更新触发器照常执行）。用户按 identifier 合并，导入的会话会指向目标库中已有的同名用户。
+
+文件格式（每行一个 JSON 对象）：
+    {"type": "header", "format": 1, "schema_version": 3, "exported_at": "..."}
+    {"type": "users", "row": {...}}
+    {"type": "threads", "row": {...}}
+    {"type": "steps", "row": {...}}  ...该会话的 elements、feedbacks...
+    {"type": "footer", "counts": {"users": 1, "threads": 1, ...}}
+
+用法：
+    python history_io.py export -o backup.jsonl.gz               # 导出 mychat.db
+    python history_io.py export path/to/db -o backup.jsonl.gz --user alice
+    python history_io.py export -o full.jsonl.gz --include-archives   # 连同归档的会话内容
+    python history_io.py import backup.jsonl.gz                  # 导入到 mychat.db
+    python history_io.py import backup.jsonl.gz path/to/db --replace
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+from migrate_db import DEFAULT_DB_FILE, connect, get_version, migrate
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不报告内存峰值
+    resource = None
+
+FORMAT_VERSION = 1
+DEFAULT_ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+TABLES = ("users", "threads", "steps", "elements", "feedbacks")
+
+THREAD_PAGE_QUERY = 'SELECT * FROM threads WHERE id > ? {user_filter} ORDER BY id LIMIT ?'
+STEPS_QUERY = 'SELECT * FROM steps WHERE "threadId" = ? ORDER BY "createdAt"'
+ELEMENTS_QUERY = 'SELECT * FROM elements WHERE "threadId" = ?'
+FEEDBACKS_QUERY = (
+    'SELECT f.* FROM steps s JOIN feedbacks f ON f."forId" = s.id WHERE s."threadId" = ?'
+)
+ARCHIVE_PATH_QUERY = 'SELECT "path" FROM archived_threads WHERE "threadId" = ?'
+ROW_IDS_QUERIES = {
+    "steps": 'SELECT id FROM steps WHERE "threadId" = ?',
+    "elements": 'SELECT id FROM elements WHERE "threadId" = ?',
+    "feedbacks": 'SELECT f.id FROM steps s JOIN feedbacks f ON f."forId" = s.id WHERE s."threadId" = ?',
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Progress:
+    """按表计数，定期打印进度，结束时报告 rows/s"""
+
+    def __init__(self, label, interval=5.0):
+        self.label = label
+        self.counts = dict.fromkeys(TABLES, 0)
+        self.start = time.perf_counter()
+        self._interval = interval
+        self._next = self.start + interval
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def add(self, table, count=1):
+        self.counts[table] += count
+        now = time.perf_counter()
+        if now >= self._next:
+            self._next = now + self._interval
+            elapsed = now - self.start
+            print(f"  {self.label}中: {self.total} 行, {self.total / elapsed:,.0f} rows/s", flush=True)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        details = ", ".join(f"{table} {count}" for table, count in self.counts.items())
+        print(f"✅ {self.label}完成: {self.total} 行（{details}）")
+        print(
+            f"   耗时 {elapsed:.1f}s, {self.total / max(elapsed, 1e-9):,.0f} rows/s, 内存峰值 {peak_rss_mb()} MB"
+        )
+
+
+def _rows(cursor, batch_size):
+    """逐批读取游标，转换为 dict"""
+    columns = [column[0] for column in cursor.description]
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        for row in batch:
+            yield dict(zip(columns, row))
+
+
+def _archived_rows(conn, thread_id, archive_dir):
+    """读取会话的归档文件，返回 {表名: 不在数据库中的行}；会话没有归档时返回 None"""
+    row = conn.execute(ARCHIVE_PATH_QUERY, (thread_id,)).fetchone()
+    if row is None:
+        return None
+    # 导入 utils 包会加载 chainlit，内存占用大幅增加，只在需要读取归档时导入
+    from utils.archive import read_archive
+
+    record = read_archive(os.path.join(archive_dir, row[0]))
+    result = {}
+    for table, query in ROW_IDS_QUERIES.items():
+        # 保留策略分批删除期间，同一行可能同时在归档和数据库中
+        ids = {id_ for (id_,) in conn.execute(query, (thread_id,))}
+        result[table] = [item for item in record[table] if item["id"] not in ids]
+    return result
+
+
+def export_history(db_file, output, user=None, page_size=500, batch_size=1000, level=6, archive_dir=None):
+    """把数据库导出为 gzip 压缩的 JSONL，返回各表行数
+
+    Args:
+        archive_dir: 归档文件目录；为 None 时不导出归档的会话内容（只导出会话本身）
+    """
+    progress = Progress("导出")
+    archived_threads = 0
+    # 只读打开，并在一个事务中完成全部读取：整个导出看到的是同一个快照
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, isolation_level=None)
+    conn.execute("BEGIN")
+    try:
+        with gzip.open(output, "wt", encoding="utf-8", compresslevel=level) as f:
+            def write(record_type, row):
+                f.write(json.dumps({"type": record_type, "row": row}, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+                progress.add(record_type)
+
+            header = {
+                "type": "header",
+                "format": FORMAT_VERSION,
+                "schema_version": get_version(conn),
+                "exported_at": datetime.now(timezone.utc).isoformat(),
+                "user": user,
+                "include_archives": archive_dir is not None,
+            }
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+
+            if user:
+                cursor = conn.execute("SELECT * FROM users WHERE identifier = ?", (user,))
+            else:
+                cursor = conn.execute("SELECT * FROM users ORDER BY id")
+            for row in _rows(cursor, batch_size):
+                write("users", row)
+
+            user_filter, params = ("", ())
+            if user:
+                user_filter, params = ('AND "userIdentifier" = ?', (user,))
+            page_query = THREAD_PAGE_QUERY.format(user_filter=user_filter)
+            has_archives = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_threads'"
+            ).fetchone() is not None
+            last_id = ""
+            while True:
+                threads = list(_rows(conn.execute(page_query, (last_id, *params, page_size)), page_size))
+                if not threads:
+                    break
+                last_id = threads[-1]["id"]
+                for thread in threads:
+                    write("threads", thread)
+                    archived = None
+                    if has_archives:
+                        if archive_dir is None:
+                            archived_threads += conn.execute(ARCHIVE_PATH_QUERY, (thread["id"],)).fetchone() is not None
+                        else:
+                            archived = _archived_rows(conn, thread["id"], archive_dir)
+                    for table, query in (("steps", STEPS_QUERY), ("elements", ELEMENTS_QUERY), ("feedbacks", FEEDBACKS_QUERY)):
+                        # 归档的行都早于数据库中的行，先写出
+                        for row in (archived or {}).get(table, ()):
+                            write(table, row)
+                        for row in _rows(conn.execute(query, (thread["id"],)), batch_size):
+                            write(table, row)
+
+            f.write(json.dumps({"type": "footer", "counts": progress.counts}) + "\n")
+    finally:
+        conn.execute("COMMIT")
+        conn.close()
+    progress.report()
+    if archived_threads:
+        print(f"⚠️ {archived_threads} 个会话已归档，只导出了会话本身；加 --include-archives 可连同归档内容导出")
+    return progress.counts
+
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _insert_sql(table, names, replace):
+    """按列构造插入语句：默认跳过已存在的行，replace 时按 id 更新其余列
+
+    不用 INSERT OR REPLACE：它先删除冲突的行再插入，而 recursive_triggers 默认关闭时删除
+    触发器不会执行，全文索引中会留下旧文档。
+    """
+    quoted = ", ".join(f'"{name}"' for name in names)
+    placeholders = ", ".join("?" for _ in names)
+    sql = f"INSERT INTO {table} ({quoted}) VALUES ({placeholders}) ON CONFLICT(id) DO "
+    updates = [f'"{name}" = excluded."{name}"' for name in names if name != "id"]
+    if replace and updates:
+        return sql + "UPDATE SET " + ", ".join(updates)
+    return sql + "NOTHING"
+
+
+def import_history(input_file, db_file, batch_size=5000, replace=False):
+    """把导出文件写入数据库（不存在时创建），返回各表行数"""
+    progress = Progress("导入")
+    conn = connect(db_file)
+    migrate(conn, verbose=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    columns = {table: set(_table_columns(conn, table)) for table in TABLES}
+    user_ids = {}  # 导出文件中的 userId -> 目标库中同 identifier 用户的 id
+    pending = {table: {} for table in TABLES}  # table -> {列元组: [行, ...]}
+    pending_count = 0
+    footer = None
+
+    def flush():
+        nonlocal pending_count
+        if not pending_count:
+            return
+        conn.execute("BEGIN")
+        try:
+            # 按依赖顺序写入，同一批中的会话先于其步骤
+            for table in TABLES:
+                for names, rows in pending[table].items():
+                    conn.executemany(_insert_sql(table, names, replace), rows)
+                    progress.add(table, len(rows))
+                pending[table].clear()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        pending_count = 0
+
+    try:
+        with gzip.open(input_file, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("type") != "header" or header.get("format") != FORMAT_VERSION:
+                raise ValueError(f"不支持的导出文件格式: {header}")
+
+            for line in f:
+                record = json.loads(line)
+                table = record["type"]
+                if table == "footer":
+                    footer = record
+                    break
+                if table not in pending:
+                    raise ValueError(f"未知的记录类型: {table}")
+                row = record["row"]
+
+                if table == "users":
+                    existing = conn.execute(
+                        "SELECT id FROM users WHERE identifier = ?", (row["identifier"],)
+                    ).fetchone()
+                    if existing and existing[0] != row["id"]:
+                        user_ids[row["id"]] = existing[0]
+                        continue
+                elif table == "threads" and row.get("userId") in user_ids:
+                    row["userId"] = user_ids[row["userId"]]
+
+                # 只写入目标表中存在的列（兼容不同版本的表结构）
+                names = tuple(name for name in row if name in columns[table])
+                pending[table].setdefault(names, []).append(tuple(row[name] for name in names))
+                pending_count += 1
+                if pending_count >= batch_size:
+                    flush()
+            flush()
+    finally:
+        conn.close()
+
+    if footer is None:
+        print("⚠️ 导出文件不完整（缺少结尾记录），已导入读取到的部分", flush=True)
+    elif footer["counts"] != {table: progress.counts[table] + (0 if table != "users" else len(user_ids)) for table in TABLES}:
+        print(f"⚠️ 导入行数与导出时不一致: 导出 {footer['counts']}", flush=True)
+    progress.report()
+    return progress.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="导出为 gzip 压缩的 JSONL")
+    export_parser.add_argument("db_file", nargs="?", default=DEFAULT_DB_FILE)
+    export_parser.add_argument("-o", "--output", required=True)
+    export_parser.add_argument("--user", default=None, help="只导出指定用户（identifier）的会话")
+    export_parser.add_argument("--page-size", type=int, default=500, help="每页读取的会话数")
+    export_parser.add_argument("--level", type=int, default=6, help="gzip 压缩级别 1-9")
+    export_parser.add_argument(
+        "--include-archives", action="store_true",
+        help="连同保留策略归档的步骤、元素和反馈一起导出（默认只导出数据库中的内容，归档的会话只有会话本身）",
+    )
+    export_parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="归档文件目录（默认 ARCHIVE_DIR 或 archive）")
+
+    import_parser = commands.add_parser("import", help="从导出文件导入")
+    import_parser.add_argument("input_file")
+    import_parser.add_argument("db_file", nargs="?", default=DEFAULT_DB_FILE)
+    import_parser.add_argument("--batch", type=int, default=5000, help="每个事务写入的行数")
+    import_parser.add_argument("--replace", action="store_true", help="按 id 更新已存在的行（默认跳过）")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        if not os.path.exists(args.db_file):
+            parser.error(f"数据库 '{args.db_file}' 不存在")
+        print(f"正在导出 '{args.db_file}' 到 '{args.output}'...")
+        export_history(
+            args.db_file, args.output, user=args.user, page_size=args.page_size, level=args.level,
+            archive_dir=args.archive_dir if args.include_archives else None,
+        )
+    else:
+        print(f"正在把 '{args.input_file}' 导入到 '{args.db_file}'...")
+        import_history(args.input_file, args.db_file, batch_size=args.batch, replace=args.replace)
+
+
+if __name__ == "__main__":
+    main()
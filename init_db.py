@@ -1,104 +1,25 @@
-"""初始化 Chainlit 聊天数据库表（完整版）"""
-import sqlite3
+"""初始化 Chainlit 聊天数据库表（完整版）
+
+表结构和索引由 migrate_db.py 中的版本化迁移维护。已有数据库会被就地升级、
+保留数据；加上 --reset 参数才会删除旧数据库重新创建。
+"""
 import os
+import sys
+
+from migrate_db import DEFAULT_DB_FILE, connect, migrate
 
-db_file = "mychat.db"
+db_file = DEFAULT_DB_FILE
 
-# 如果存在旧数据库，先删除
-if os.path.exists(db_file):
+# 只有显式指定 --reset 时才删除旧数据库
+if "--reset" in sys.argv and os.path.exists(db_file):
     os.remove(db_file)
     print(f"已删除旧数据库 '{db_file}'")
 
 print(f"正在初始化 Chainlit 数据库 '{db_file}'...")
 
-conn = sqlite3.connect(db_file)
-cursor = conn.cursor()
-
-# 创建 Chainlit SQLAlchemy 数据层所需的表（完整字段版本）
-tables = [
-    '''
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        identifier TEXT UNIQUE NOT NULL,
-        "createdAt" TEXT,
-        metadata TEXT
-    )
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS threads (
-        id TEXT PRIMARY KEY,
-        "createdAt" TEXT,
-        name TEXT,
-        "userId" TEXT,
-        "userIdentifier" TEXT,
-        tags TEXT,
-        metadata TEXT,
-        FOREIGN KEY ("userId") REFERENCES users(id)
-    )
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS steps (
-        id TEXT PRIMARY KEY,
-        "threadId" TEXT,
-        "parentId" TEXT,
-        "createdAt" TEXT,
-        "start" TEXT,
-        "end" TEXT,
-        name TEXT,
-        type TEXT,
-        input TEXT,
-        output TEXT,
-        streaming INTEGER,
-        "isError" INTEGER,
-        "waitForAnswer" INTEGER,
-        "defaultOpen" INTEGER,
-        "showInput" TEXT,
-        metadata TEXT,
-        generation TEXT,
-        language TEXT,
-        tags TEXT,
-        FOREIGN KEY ("threadId") REFERENCES threads(id)
-    )
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS elements (
-        id TEXT PRIMARY KEY,
-        "threadId" TEXT,
-        "stepId" TEXT,
-        name TEXT,
-        type TEXT,
-        display TEXT,
-        size TEXT,
-        language TEXT,
-        page TEXT,
-        url TEXT,
-        path TEXT,
-        mime TEXT,
-        "objectKey" TEXT,
-        "forId" TEXT,
-        "chainlitKey" TEXT,
-        props TEXT,
-        FOREIGN KEY ("threadId") REFERENCES threads(id),
-        FOREIGN KEY ("stepId") REFERENCES steps(id)
-    )
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS feedbacks (
-        id TEXT PRIMARY KEY,
-        "stepId" TEXT,
-        "forId" TEXT,
-        value INTEGER,
-        comment TEXT,
-        FOREIGN KEY ("stepId") REFERENCES steps(id)
-    )
-    '''
-]
-
-for table_sql in tables:
-    cursor.execute(table_sql)
-    
-conn.commit()
+conn = connect(db_file)
+version = migrate(conn)
 conn.close()
 
-print(f"✅ 数据库 '{db_file}' 初始化完成！")
+print(f"✅ 数据库 '{db_file}' 初始化完成！当前版本: {version}")
 print("   已创建表: users, threads, steps, elements, feedbacks")
@@ -0,0 +1,103 @@
+"""本地模拟的 Langflow 流式服务（NDJSON）
+
+按 Langflow /api/v1/run/{flow_id}?stream=true 的格式返回 add_message、token、end 事件，
+事件之间用空行分隔；思考内容以 <think>...</think> 的形式放在 token 中。
+
+用法：
+    python loadtest/mock_langflow.py --port 9200 --ttft 0.3 --rate 50
+    # 然后让 LangflowChat.py 指向它：LANGFLOW_BASE_URL=http://127.0.0.1:9200 FLOW_ID=mock
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+from mock_openai import WORDS
+
+
+def _event(event, data):
+    return (json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n\n").encode("utf-8")
+
+
+def make_app(tokens=200, thinking_tokens=60, rate=50.0, ttft=0.3, jitter=0.0, error_rate=0.0, seed=None):
+    """构造模拟服务，参数含义与 mock_openai.make_app 相同"""
+    rng = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "completed": 0, "cancelled": 0}
+
+    async def run_flow(request):
+        await request.read()
+        stats["requests"] += 1
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response({"detail": "mock flow error"}, status=500)
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        message_id = f"mock-{stats['requests']}"
+        await response.write(_event("add_message", {"id": message_id, "text": "", "sender": "Machine"}))
+        await asyncio.sleep(ttft * (1 + rng.uniform(-jitter, jitter)) if jitter else ttft)
+
+        chunks = []
+        if thinking_tokens:
+            chunks.append("<think>")
+            chunks.extend(WORDS[i % len(WORDS)] for i in range(thinking_tokens))
+            chunks.append("</think>")
+        chunks.extend(WORDS[(i * 7) % len(WORDS)] for i in range(tokens))
+
+        try:
+            start = time.perf_counter()
+            for i, chunk in enumerate(chunks):
+                await response.write(_event("token", {"chunk": chunk, "id": message_id}))
+                if rate:
+                    ahead = start + (i + 1) / rate - time.perf_counter()
+                    if ahead > 0.001:
+                        await asyncio.sleep(ahead)
+            await response.write(_event("end", {"result": {"message": {"text": "".join(chunks)}}}))
+            await response.write_eof()
+            stats["completed"] += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            stats["cancelled"] += 1
+            raise
+        return response
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/api/v1/run/{flow_id}", run_flow)
+    app.router.add_get("/stats", get_stats)
+    app["stats"] = stats
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--thinking-tokens", type=int, default=60)
+    parser.add_argument("--rate", type=float, default=50.0, help="每个流的 token/s，0 表示不限速")
+    parser.add_argument("--ttft", type=float, default=0.3, help="首 token 延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = make_app(
+        tokens=args.tokens,
+        thinking_tokens=args.thinking_tokens,
+        rate=args.rate,
+        ttft=args.ttft,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"模拟 Langflow 服务: http://{args.host}:{args.port} (flow 任意)", flush=True)
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""本地模拟的 OpenAI 兼容流式服务
+
+支持三种输出：
+- reasoning：先输出 reasoning_content（DeepSeek 风格），再输出 content
+- think：思考内容放在 content 的 <think>...</think> 中
+- plain：只有回答
+
+首 token 延迟、token 速率、抖动和错误率都可配置，非流式请求（标题生成、摘要）
+返回一个固定的短回复。
+
+用法：
+    python loadtest/mock_openai.py --port 9100 --mode reasoning --ttft 0.3 --rate 50
+    # 然后让应用指向它：API_BASE_URL=http://127.0.0.1:9100/v1 API_KEY=mock
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+WORDS = ["用户", "希望", "我们", "首先", "考虑", "然后", "代码", "示例", "the", "model", "stream", "token", "，", "。"]
+
+
+def _chunk(model, delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def make_app(mode="reasoning", tokens=200, thinking_tokens=60, rate=50.0, ttft=0.3, jitter=0.0, error_rate=0.0, seed=None):
+    """构造模拟服务
+
+    Args:
+        mode: reasoning / think / plain
+        tokens: 每个回复的回答 token 数
+        thinking_tokens: 每个回复的思考 token 数（plain 模式忽略）
+        rate: 每个流的 token 速率（token/s，0 表示不限速）
+        ttft: 首 token 之前的延迟（秒）
+        jitter: 首 token 延迟的随机抖动比例（0.2 表示 ±20%）
+        error_rate: 返回 500 的请求比例
+    """
+    rng = random.Random(seed)
+    stats = {"requests": 0, "streams": 0, "errors": 0, "completed": 0, "cancelled": 0}
+
+    async def chat_completions(request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        stats["requests"] += 1
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response({"error": {"message": "mock upstream error", "type": "server_error"}}, status=500)
+
+        delay = ttft * (1 + rng.uniform(-jitter, jitter)) if jitter else ttft
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "🧪 Mock Load Test Title"},
+                }],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+            })
+
+        stats["streams"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await asyncio.sleep(delay)
+
+        deltas = []
+        think_count = 0 if mode == "plain" else thinking_tokens
+        if mode == "think" and think_count:
+            deltas.append({"content": "<think>"})
+        for i in range(think_count):
+            word = WORDS[i % len(WORDS)]
+            deltas.append({"reasoning_content": word} if mode == "reasoning" else {"content": word})
+        if mode == "think" and think_count:
+            deltas.append({"content": "</think>"})
+        deltas.extend({"content": WORDS[(i * 7) % len(WORDS)]} for i in range(tokens))
+
+        try:
+            start = time.perf_counter()
+            for i, delta in enumerate(deltas):
+                await response.write(f"data: {json.dumps(_chunk(model, delta), ensure_ascii=False)}\n\n".encode("utf-8"))
+                if rate:
+                    # 按计划时间发送，避免 sleep 精度导致整体速率偏低
+                    ahead = start + (i + 1) / rate - time.perf_counter()
+                    if ahead > 0.001:
+                        await asyncio.sleep(ahead)
+            await response.write(f"data: {json.dumps(_chunk(model, {}, 'stop'))}\n\n".encode("utf-8"))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            stats["completed"] += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            # 客户端中途断开（例如用户点击停止）
+            stats["cancelled"] += 1
+            raise
+        return response
+
+    async def list_models(request):
+        return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", list_models)
+    app.router.add_get("/stats", get_stats)
+    app["stats"] = stats
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--mode", choices=["reasoning", "think", "plain"], default="reasoning")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--thinking-tokens", type=int, default=60)
+    parser.add_argument("--rate", type=float, default=50.0, help="每个流的 token/s，0 表示不限速")
+    parser.add_argument("--ttft", type=float, default=0.3, help="首 token 延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = make_app(
+        mode=args.mode,
+        tokens=args.tokens,
+        thinking_tokens=args.thinking_tokens,
+        rate=args.rate,
+        ttft=args.ttft,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"模拟 OpenAI 服务: http://{args.host}:{args.port}/v1 (mode={args.mode})", flush=True)
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
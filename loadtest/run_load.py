@@ -0,0 +1,324 @@
+"""端到端压测：模拟 N 个已登录用户通过 Chainlit websocket 聊天
+
+每个模拟用户：POST /login 拿到认证 cookie → 建立 socket.io 连接 → 发送消息，
+记录发送到第一个 stream_token（TTFT）、到第一个回答 token（TTFA）和到 task_end
+的时间。超时、中途断线或收到错误消息的回复计为丢失的流。
+
+指定 --server-pid 时同时采样服务进程的 CPU 时间和 RSS，按会话数折算。
+
+用法：
+    # 1. 启动模拟上游和应用
+    python loadtest/mock_openai.py --port 9100 &
+    # 所有模拟用户使用同一个账号，需关闭用户限速
+    API_BASE_URL=http://127.0.0.1:9100/v1 API_KEY=mock ADMISSION_USER_RATE_PER_MIN=0 chainlit run main.py --headless --port 8000 &
+    # 2. 压测
+    python loadtest/run_load.py --users 50 --messages 3 --server-pid $(pgrep -f "chainlit run main.py")
+    # 保存为基线，之后的改动与基线对比
+    python loadtest/run_load.py --users 50 --json baseline.json
+    python loadtest/run_load.py --users 50 --baseline baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+import aiohttp
+import socketio
+
+try:
+    import psutil
+except ImportError:  # 没有 psutil 时在 Linux 上直接读取 /proc
+    psutil = None
+
+
+class ProcessSampler:
+    """采样进程的 CPU 时间（秒）和 RSS（字节）"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._process = psutil.Process(pid) if psutil else None
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def sample(self):
+        if self._process is not None:
+            cpu = self._process.cpu_times()
+            return cpu.user + cpu.system, self._process.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / self._ticks
+        with open(f"/proc/{self.pid}/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class SimulatedUser:
+    """一个模拟用户（一个 websocket 会话）"""
+
+    def __init__(self, index, args, results):
+        self.index = index
+        self.args = args
+        self.results = results
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self._steps = {}  # step id -> type
+        self._pending = None  # 当前等待回复的请求
+        self._register_handlers()
+
+    def _register_handlers(self):
+        sio = self.sio
+
+        @sio.on("stream_start")
+        async def on_stream_start(step):
+            self._steps[step["id"]] = step.get("type")
+
+        @sio.on("new_message")
+        async def on_new_message(step):
+            self._steps[step["id"]] = step.get("type")
+            if self._pending and step.get("isError"):
+                self._pending["error"] = step.get("output")
+
+        @sio.on("stream_token")
+        async def on_stream_token(data):
+            pending = self._pending
+            if not pending:
+                return
+            now = time.perf_counter()
+            pending["tokens"] += 1
+            if pending["ttft"] is None:
+                pending["ttft"] = now - pending["sent"]
+            if pending["ttfa"] is None and self._steps.get(data["id"]) == "assistant_message":
+                pending["ttfa"] = now - pending["sent"]
+
+        @sio.on("task_end")
+        async def on_task_end(*_):
+            if self._pending and self._pending["sent"] is not None:
+                self._pending["done"].set()
+
+        @sio.on("disconnect")
+        async def on_disconnect(*_):
+            if self._pending:
+                self._pending["error"] = self._pending.get("error") or "disconnected"
+                self._pending["done"].set()
+
+    async def login(self, http):
+        async with http.post(
+            f"{self.args.url}/login",
+            data={"username": self.args.username, "password": self.args.password},
+        ) as response:
+            if response.status != 200:
+                raise RuntimeError(f"登录失败: {response.status} {await response.text()}")
+            # 直接读取响应中的 cookie：默认的 CookieJar 不接受来自 IP 地址的 cookie
+            return "; ".join(f"{key}={morsel.value}" for key, morsel in response.cookies.items())
+
+    async def run(self):
+        results = self.results
+        try:
+            async with aiohttp.ClientSession() as http:
+                cookie = await self.login(http)
+            await self.sio.connect(
+                self.args.url,
+                headers={"Cookie": cookie},
+                auth={
+                    "clientType": "webapp",
+                    "sessionId": str(uuid.uuid4()),
+                    "threadId": None,
+                    "userEnv": "{}",
+                    "chatProfile": None,
+                },
+                transports=["websocket"],
+                socketio_path="/ws/socket.io",
+                wait_timeout=self.args.timeout,
+            )
+            await self.sio.emit("connection_successful")
+            results["sessions"] += 1
+            # 等待 on_chat_start 完成
+            await asyncio.sleep(0.5)
+
+            for turn in range(self.args.messages):
+                await self.send(f"[user {self.index} turn {turn}] {self.args.prompt}")
+                if self.args.think_time:
+                    await asyncio.sleep(self.args.think_time)
+        except Exception as e:
+            results["session_errors"] += 1
+            if results["session_errors"] <= 5:
+                print(f"会话 {self.index} 失败: {e}", flush=True)
+        finally:
+            if self.sio.connected:
+                await self.sio.disconnect()
+
+    async def send(self, content):
+        pending = {"sent": None, "ttft": None, "ttfa": None, "tokens": 0, "error": None, "done": asyncio.Event()}
+        self._pending = pending
+        message = {
+            "id": str(uuid.uuid4()),
+            "threadId": "",
+            "name": self.args.username,
+            "type": "user_message",
+            "output": content,
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+        }
+        pending["sent"] = time.perf_counter()
+        await self.sio.emit("client_message", {"message": message, "fileReferences": None})
+        try:
+            await asyncio.wait_for(pending["done"].wait(), self.args.timeout)
+        except asyncio.TimeoutError:
+            pending["error"] = "timeout"
+        duration = time.perf_counter() - pending["sent"]
+        self._pending = None
+
+        results = self.results
+        results["messages"] += 1
+        if pending["error"] or pending["tokens"] == 0:
+            results["dropped"] += 1
+            results["drop_reasons"][pending["error"] or "no tokens"] = (
+                results["drop_reasons"].get(pending["error"] or "no tokens", 0) + 1
+            )
+            return
+        results["completed"] += 1
+        results["tokens"] += pending["tokens"]
+        results["ttft"].append(pending["ttft"])
+        if pending["ttfa"] is not None:
+            results["ttfa"].append(pending["ttfa"])
+        results["duration"].append(duration)
+
+
+async def sample_loop(sampler, samples, stop):
+    while not stop.is_set():
+        samples.append(sampler.sample())
+        try:
+            await asyncio.wait_for(stop.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+    samples.append(sampler.sample())
+
+
+async def run(args):
+    results = {
+        "sessions": 0,
+        "session_errors": 0,
+        "messages": 0,
+        "completed": 0,
+        "dropped": 0,
+        "drop_reasons": {},
+        "tokens": 0,
+        "ttft": [],
+        "ttfa": [],
+        "duration": [],
+    }
+    sampler = ProcessSampler(args.server_pid) if args.server_pid else None
+    samples = []
+    stop = asyncio.Event()
+    sampler_task = asyncio.create_task(sample_loop(sampler, samples, stop)) if sampler else None
+
+    users = [SimulatedUser(i, args, results) for i in range(args.users)]
+    start = time.perf_counter()
+    tasks = []
+    for user in users:
+        tasks.append(asyncio.create_task(user.run()))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.users)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    if sampler_task:
+        stop.set()
+        await sampler_task
+    return summarize(args, results, samples, elapsed)
+
+
+def summarize(args, results, samples, elapsed):
+    def ms(values, p):
+        value = percentile(values, p)
+        return round(value * 1000, 1) if value is not None else None
+
+    summary = {
+        "users": args.users,
+        "messages_per_user": args.messages,
+        "elapsed_s": round(elapsed, 2),
+        "sessions": results["sessions"],
+        "session_errors": results["session_errors"],
+        "messages": results["messages"],
+        "completed": results["completed"],
+        "dropped": results["dropped"],
+        "drop_reasons": results["drop_reasons"],
+        "tokens_received": results["tokens"],
+        "messages_per_s": round(results["completed"] / elapsed, 2) if elapsed else None,
+    }
+    for name in ("ttft", "ttfa", "duration"):
+        for p in (50, 95, 99):
+            summary[f"{name}_p{p}_ms"] = ms(results[name], p)
+        summary[f"{name}_mean_ms"] = (
+            round(statistics.fmean(results[name]) * 1000, 1) if results[name] else None
+        )
+
+    if samples:
+        cpu = samples[-1][0] - samples[0][0]
+        rss_base = samples[0][1]
+        rss_peak = max(rss for _, rss in samples)
+        sessions = max(1, results["sessions"])
+        summary.update({
+            "server_cpu_s": round(cpu, 2),
+            "server_cpu_pct": round(cpu / elapsed * 100, 1) if elapsed else None,
+            "server_cpu_ms_per_session": round(cpu / sessions * 1000, 1),
+            "server_cpu_ms_per_message": round(cpu / max(1, results["completed"]) * 1000, 2),
+            "server_rss_base_mb": round(rss_base / 2**20, 1),
+            "server_rss_peak_mb": round(rss_peak / 2**20, 1),
+            "server_rss_kb_per_session": round((rss_peak - rss_base) / sessions / 1024, 1),
+        })
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    width = max(len(key) for key in summary)
+    print()
+    for key, value in summary.items():
+        line = f"{key:<{width}}  {value}"
+        if baseline and isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)):
+            old = baseline[key]
+            if old:
+                line += f"    (基线 {old}, {(value - old) / old * 100:+.1f}%)"
+            else:
+                line += f"    (基线 {old})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20, help="并发的模拟用户数")
+    parser.add_argument("--messages", type=int, default=3, help="每个用户发送的消息数")
+    parser.add_argument("--ramp", type=float, default=2.0, help="在多少秒内逐步建立全部会话")
+    parser.add_argument("--think-time", type=float, default=0.5, help="两条消息之间的间隔（秒）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单条回复的超时（秒）")
+    parser.add_argument("--prompt", default="写一个发送邮件的 Python 脚本")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--server-pid", type=int, default=None, help="Chainlit 服务进程 PID，用于采样 CPU/RSS")
+    parser.add_argument("--json", default=None, help="把结果写入 JSON 文件（可作为基线）")
+    parser.add_argument("--baseline", default=None, help="与之前保存的 JSON 结果对比")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
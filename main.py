@@ -1,22 +1,89 @@
 import os
+import sys
 import time
-import json
-import sqlite3
-import bcrypt
-from openai import AsyncOpenAI
-from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+import asyncio
+from contextlib import nullcontext
 import chainlit as cl
 from dotenv import load_dotenv
-from utils import get_thinking_content, filter_content
-from config.chat_settings import get_chat_settings, get_model_config
+from utils import (
+    ThinkStreamParser,
+    THINKING,
+    TokenCoalescer,
+    MarkdownStreamNormalizer,
+    TitleQueue,
+    CredentialVerifier,
+    ContextWindow,
+    ResponseCache,
+    make_cache_key,
+    replay_segments,
+    summarize_history,
+    get_openai_client,
+    close_openai_clients,
+    get_shared_data_layer,
+    close_shared_data_layer,
+    RequestTrace,
+    TITLE_LATENCY,
+    install_metrics_endpoint,
+    install_search_endpoint,
+    close_metrics,
+    ChatRouter,
+    AdmissionController,
+    AdmissionRejected,
+)
+from config.chat_settings import (
+    get_chat_settings,
+    get_model_config,
+    get_stream_config,
+    get_markdown_config,
+    get_context_config,
+    get_title_queue_config,
+    get_auth_config,
+    get_response_cache_config,
+    get_model_endpoints,
+    get_starters,
+    get_admission_config,
+    get_router_config,
+    get_hedge_config,
+    STREAM_STATS_LOG,
+    MARKDOWN_NORMALIZE,
+    TITLE_FROM_USER_MESSAGE,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_TEMPERATURE,
+    ADMISSION_ENABLED,
+    ADMISSION_ENDPOINT_CONCURRENCY,
+)
 
 # 加载环境变量
 load_dotenv()
 
+# 代码块前的空行等格式问题由 MarkdownStreamNormalizer 在输出时修正，不再写进提示词
+SYSTEM_PROMPT = "You are a helpful assistant."
 
-async def generate_chat_title(client, model_config, user_message: str, assistant_response: str):
+# 后台标题生成队列（进程内共享）
+title_queue = TitleQueue(**get_title_queue_config())
+
+# 回复缓存（可选，进程内共享）
+response_cache = ResponseCache(**get_response_cache_config()) if RESPONSE_CACHE_ENABLED else None
+
+# 登录校验（线程池 + 短时缓存，进程内共享）
+credential_verifier = CredentialVerifier(**get_auth_config())
+
+# 主对话模型的多端点路由（按 TTFT 选择端点，首 token 前失败自动切换，可选对冲请求）
+chat_router = ChatRouter(get_model_endpoints(), **get_router_config(), hedge=get_hedge_config())
+
+# 上游调用的准入控制（用户限速、并发上限、按用户轮转的排队）
+admission = AdmissionController(**get_admission_config()) if ADMISSION_ENABLED else None
+
+# 在 Chainlit 服务上挂载 /metrics（Prometheus 文本格式）
+install_metrics_endpoint()
+
+# 聊天记录全文搜索接口（只搜索当前登录用户的会话）
+install_search_endpoint(get_shared_data_layer())
+
+
+def get_title_model(client, model_config):
     """
-    调用模型生成简短的对话标题。
+    选择用于标题生成等辅助任务的模型，返回 (client, model, max_tokens)。
     优先尝试使用环境变量中配置的独立 '标题模型' (TITLE_MODEL_...)。
     如果没有配置，则回退使用传入的主对话模型。
     """
@@ -32,35 +99,88 @@ async def generate_chat_title(client, model_config, user_message: str, assistant
     # 如果是专用的小模型，这个值大一点也没关系，因为它不会输出废话
     target_max_tokens = 1024 
 
-    # 2. 如果配置了独立模型，则使用独立客户端
+    # 2. 如果配置了独立模型，则使用独立客户端（进程内共享，复用连接池）
     if title_api_key and title_base_url and title_model_name:
         # print(f"DEBUG: 使用独立的标题生成模型: {title_model_name}", flush=True)
         try:
-            target_client = AsyncOpenAI(api_key=title_api_key, base_url=title_base_url)
+            target_client = get_openai_client(title_base_url, title_api_key)
             target_model = title_model_name
             target_max_tokens = 200 # 专用模型通常不需要思考，200够了
         except Exception as e:
             print(f"❌ 初始化独立标题模型客户端失败: {e}，回退到主模型", flush=True)
             target_client = client
 
+    return target_client, target_model, target_max_tokens
+
+
+def get_user_key():
+    """准入控制使用的用户标识：登录用户名，未登录时为会话 ID"""
+    session = cl.context.session
+    return session.user.identifier if session.user else session.id
+
+
+async def acquire_chat_slot():
+    """申请聊天名额，排队期间在界面上显示排队位置"""
+    if not admission:
+        return None
+    admission.set_capacity("chat", ADMISSION_ENDPOINT_CONCURRENCY * len(chat_router.endpoints))
+    notice = None
+
+    async def on_wait(position):
+        nonlocal notice
+        text = f"⏳ 当前请求较多，正在排队，前面还有 {position} 个请求…"
+        if notice is None:
+            notice = cl.Message(content=text)
+            await notice.send()
+        else:
+            notice.content = text
+            await notice.update()
+
+    try:
+        return await admission.acquire("chat", get_user_key(), on_wait)
+    finally:
+        if notice is not None:
+            await notice.remove()
+
+
+async def auxiliary_slot():
+    """标题、摘要等辅助调用的名额，不计入用户速率"""
+    if not admission:
+        return nullcontext()
+    return await admission.acquire("title", get_user_key(), charge=False)
+
+
+async def generate_chat_title(client, model_config, user_message: str, assistant_response: str = ""):
+    """
+    调用模型生成简短的对话标题。
+    assistant_response 为空时仅根据用户消息生成（与主回复并行执行）。
+    """
+    target_client, target_model, target_max_tokens = get_title_model(client, model_config)
+
     # print(f"DEBUG: 正在生成标题... 模型: {target_model}, 用户输入长度: {len(user_message)}", flush=True)
     
+    title_input = f"用户: {user_message[:100]}"
+    if assistant_response:
+        title_input += f"\n助手: {assistant_response[:100]}"
+
+    title_start = time.perf_counter()
     try:
-        response = await target_client.chat.completions.create(
-            model=target_model,
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a title generator. Summarize a concise ENGLISH title based on the user query and assistant response. Requirements:\n1. Max 5 words\n2. Use only key terms\n3. No punctuation\n4. Prefix with a relevant emoji"
-                },
-                {
-                    "role": "user", 
-                    "content": f"用户: {user_message[:100]}\n助手: {assistant_response[:100]}"
-                }
-            ],
-            temperature=0.7,
-            max_tokens=target_max_tokens,
-        )
+        async with await auxiliary_slot():
+            response = await target_client.chat.completions.create(
+                model=target_model,
+                messages=[
+                    {
+                        "role": "system", 
+                        "content": "You are a title generator. Summarize a concise ENGLISH title based on the user query and assistant response. Requirements:\n1. Max 5 words\n2. Use only key terms\n3. No punctuation\n4. Prefix with a relevant emoji"
+                    },
+                    {
+                        "role": "user", 
+                        "content": title_input
+                    }
+                ],
+                temperature=0.7,
+                max_tokens=target_max_tokens,
+            )
         
         # print(f"DEBUG: 模型响应对象: {response}", flush=True)
         title = response.choices[0].message.content.strip()
@@ -68,60 +188,129 @@ async def generate_chat_title(client, model_config, user_message: str, assistant
         title = title.strip('"\'""''').split('\n')[0] 
         
         # print(f"DEBUG: 生成的标题: {title}", flush=True)
+        TITLE_LATENCY.observe(time.perf_counter() - title_start, model=target_model, status="ok" if title else "empty")
         return title
     except Exception as e:
+        TITLE_LATENCY.observe(time.perf_counter() - title_start, model=target_model, status="error")
         print(f"❌ 生成标题失败: {e}", flush=True)
         # import traceback
         # traceback.print_exc()
         return None
 
 
-def authenticate_user(username: str, password: str):
-    """验证用户凭据（使用数据库）"""
-    db_file = "users.db"
-    
-    # 如果数据库不存在，检查开发模式
-    if not os.path.exists(db_file):
-        if os.getenv("DEV_MODE", "false").lower() == "true":
-            if (username, password) == ("admin", "admin"):
-                return cl.User(
-                    identifier="admin", 
-                    metadata={"role": "admin", "provider": "credentials"}
-                )
-        return None
-    
+def submit_title_job(client, model_config, user_message: str, assistant_response: str = ""):
+    """把标题生成和数据库更新放入后台队列，不阻塞当前消息"""
+    thread_id = cl.context.session.thread_id
+    if not thread_id:
+        print("❌ 无法更新标题: thread_id 缺失", flush=True)
+        return
+
+    async def job():
+        title = await generate_chat_title(client, model_config, user_message, assistant_response)
+        if not title:
+            return False
+
+        data_layer = get_data_layer()
+        if not data_layer:
+            print("❌ 无法更新标题: data_layer 缺失", flush=True)
+            return False
+
+        await data_layer.update_thread(thread_id=thread_id, name=title)
+        # 发送 Toast 提示告知用户（不写入对话记录，也不会插入正在进行的回复中）
+        await cl.context.emitter.send_toast(f"📝 Conversation title updated: {title}")
+        return True
+
+    title_queue.submit(thread_id, job)
+
+
+async def stream_segments(stream):
+    """把上游的流式响应解析为 (类型, 文本) 片段，提前关闭时同时关闭上游流"""
+    parser = ThinkStreamParser()  # 每个响应一个解析器，处理跨 chunk 的 <think> 标签
     try:
-        conn = sqlite3.connect(db_file)
-        c = conn.cursor()
-        c.execute("SELECT password_hash, role FROM users WHERE username = ?", (username,))
-        user = c.fetchone()
-        conn.close()
-
-        if user:
-            stored_password_hash, role = user
-            if bcrypt.checkpw(password.encode("utf-8"), stored_password_hash):
-                return cl.User(
-                    identifier=username, 
-                    metadata={"role": role, "provider": "credentials"}
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            for segment in parser.feed_delta(chunk.choices[0].delta):
+                yield segment
+        for segment in parser.flush():
+            yield segment
+    finally:
+        await stream.aclose()
+
+
+def build_chat_messages(client, model_config):
+    """按 token 预算构造本轮请求的消息列表，必要时在后台更新滚动摘要"""
+    context_config = get_context_config(model_config["model_name"])
+    history = cl.chat_context.get()
+    summary = cl.user_session.get("history_summary") if context_config["summary"] else None
+    messages, report = ContextWindow(context_config["budget"]).build(SYSTEM_PROMPT, history, summary)
+
+    if report["trimmed_messages"]:
+        print(
+            f"✂️ 上下文裁剪: {report['trimmed_messages']} 条消息 / {report['trimmed_tokens']} tokens，"
+            f"本次提示词 {report['prompt_tokens']} tokens",
+            flush=True,
+        )
+        if context_config["summary"]:
+            schedule_history_summary(client, model_config, history[:report["trimmed_messages"]])
+    return messages, report
+
+
+def schedule_history_summary(client, model_config, trimmed):
+    """在后台把被裁剪的消息合并进滚动摘要，下一轮请求开始使用"""
+    summary = cl.user_session.get("history_summary") or {"covered": 0, "text": ""}
+    if len(trimmed) <= summary["covered"] or cl.user_session.get("history_summary_pending"):
+        return
+    cl.user_session.set("history_summary_pending", True)
+    context_config = get_context_config(model_config["model_name"])
+
+    async def update_summary():
+        try:
+            target_client, target_model, _ = get_title_model(client, model_config)
+            async with await auxiliary_slot():
+                text = await summarize_history(
+                    target_client,
+                    target_model,
+                    context_config["summary_max_tokens"],
+                    trimmed[summary["covered"]:],
+                    summary["text"],
                 )
+            if text:
+                cl.user_session.set("history_summary", {"covered": len(trimmed), "text": text})
+        except Exception as e:
+            print(f"❌ 生成历史摘要失败: {e}", flush=True)
+        finally:
+            cl.user_session.set("history_summary_pending", False)
+
+    asyncio.create_task(update_summary())
+
+
+async def authenticate_user(username: str, password: str):
+    """验证用户凭据（使用数据库，bcrypt 在线程池中执行）"""
+    try:
+        role = await credential_verifier.verify(username, password)
     except Exception as e:
         print(f"认证错误: {e}")
-    
+        return None
+
+    if role:
+        return cl.User(
+            identifier=username, 
+            metadata={"role": role, "provider": "credentials"}
+        )
     return None
 
 
 @cl.data_layer
 def get_data_layer():
-    return SQLAlchemyDataLayer(
-        conninfo="sqlite+aiosqlite:///mychat.db",
-        storage_provider=None
-    )
+    # 进程内唯一实例：重复调用不会再创建新的引擎和连接池
+    return get_shared_data_layer()
 
 
 @cl.password_auth_callback
-def auth_callback(username: str, password: str):
+async def auth_callback(username: str, password: str):
     """Chainlit 认证回调"""
-    return authenticate_user(username, password)
+    return await authenticate_user(username, password)
 
 
 @cl.on_chat_resume
@@ -129,10 +318,7 @@ async def on_chat_resume(thread):
     await get_chat_settings()
     model_config = get_model_config()
     
-    client = AsyncOpenAI(
-        api_key=model_config["api_key"],
-        base_url=model_config["base_url"]
-    )
+    client = get_openai_client(model_config["base_url"], model_config["api_key"])
     cl.user_session.set("client", client)
     cl.user_session.set("model_config", model_config)
     # cl.user_session.set("title_generated", True)  # DEBUG: 注释掉以便测试标题生成
@@ -141,105 +327,177 @@ async def on_chat_resume(thread):
 @cl.on_message
 async def on_message(msg: cl.Message):
 
-    client = cl.user_session.get("client")
-    model_config = cl.user_session.get("model_config")
-    
-    if not client or not model_config:
+    if not cl.user_session.get("client") or not cl.user_session.get("model_config"):
         await cl.Message(content="会话初始化失败，请刷新页面重试。").send()
         return
-    
+
+    # 模型和端点配置可热加载：每条消息使用最新配置，只保留用户调整过的温度
+    model_config = get_model_config()
+    temperature = cl.user_session.get("temperature")
+    if temperature is not None:
+        model_config["temperature"] = temperature
+    client = get_openai_client(model_config["base_url"], model_config["api_key"])
+
     start = time.time()
+    permit = None
+    cancel_handled = False
+    cl.user_session.set("cancel_reason", None)
+    # 记录首 token、首个回答 token、token/s 等延迟指标
+    trace = RequestTrace("openai", model_config["model_name"])
     is_first_message = not cl.user_session.get("title_generated", False)
-    
+
+    # 首次消息：仅凭用户消息在后台并行生成标题，不增加首条回复的延迟
+    if is_first_message and TITLE_FROM_USER_MESSAGE:
+        submit_title_job(client, model_config, msg.content)
+        cl.user_session.set("title_generated", True)
+        is_first_message = False
+
     try:
-        stream = await client.chat.completions.create(
-            model=model_config["model_name"],
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant. STOP! Read this carefully: When providing code blocks, you MUST ensure there is a blank line before the opening triple backticks (```). Never start a code block directly after a sentence without a newline."},
-                *cl.chat_context.to_openai(),
-            ],
-            stream=True,
-            temperature=model_config["temperature"],
-        )
+        # 标题任务优先级低于聊天，聊天流较多时会让步
+        async with title_queue.chat_stream():
+            messages, report = build_chat_messages(client, model_config)
+            trace.extra["prompt_tokens"] = report["prompt_tokens"]
 
-        thinking = False
-        final_answer = cl.Message(content="")
-        thinking_step = None
-        full_response = ""  # 收集完整回复用于生成标题
-        
-        async for chunk in stream:
-            delta = chunk.choices[0].delta
-            thinking_content = get_thinking_content(delta)
-            
-            if thinking_content is not None:
-                if not thinking_step:
-                    thinking_step = cl.Step(name="Thinking")
-                    await thinking_step.__aenter__()
-                thinking = True
-                await thinking_step.stream_token(thinking_content)
-            elif delta.content:
+            # 端点列表来自可热加载的配置，未变化时不做任何事
+            chat_router.set_endpoints(get_model_endpoints())
+
+            # 回复缓存：命中时按正常流式路径回放，不请求上游。缓存键使用实际生成回复的模型，
+            # 查询时依次尝试本次可能使用的各端点模型（对冲到备用模型得到的回复不会当作主模型的回复）
+            use_cache = bool(response_cache) and model_config["temperature"] <= RESPONSE_CACHE_MAX_TEMPERATURE
+            cached = None
+            if use_cache:
+                cache_models = dict.fromkeys(endpoint.model_name for endpoint in chat_router.endpoints)
+                cached = await response_cache.get_first(
+                    [make_cache_key(name, model_config["temperature"], messages) for name in cache_models]
+                )
+
+            if cached:
+                stats = response_cache.get_stats()
+                print(f"♻️ 命中回复缓存，命中率 {stats['hit_ratio']:.1%}，累计节省 {stats['bytes_saved']} 字节", flush=True)
+                trace.backend = "cache"
+                segments = replay_segments(*cached)
+            else:
+                # 准入控制：超出速率或排队超时时抛出 AdmissionRejected，名额在回复结束后释放
+                permit = await acquire_chat_slot()
+                endpoint, model_name, stream = await chat_router.open_stream(
+                    {"messages": messages, "temperature": model_config["temperature"]}
+                )
+                trace.model = model_name
+                trace.extra["endpoint"] = endpoint.name
+                segments = stream_segments(stream)
+
+            thinking = False
+            final_answer = cl.Message(content="")
+            thinking_step = None
+            thinking_stream = None
+            full_response = ""  # 收集完整回复用于生成标题
+            thinking_parts = []  # 收集思考内容用于写入缓存
+            # 合并 token 后再推送，减少 websocket 帧数
+            stream_config = get_stream_config()
+            answer_stream = TokenCoalescer(final_answer.stream_token, **stream_config)
+            # 修正代码块标记等 Markdown 格式，只暂存少量可能构成标记的字符
+            markdown = MarkdownStreamNormalizer(**get_markdown_config()) if MARKDOWN_NORMALIZE else None
+            frames_saved = 0
+
+            async def close_thinking_step():
+                nonlocal thinking, frames_saved
+                frames_saved += (await thinking_stream.close())["frames_saved"]
+                thought_for = round(time.time() - start)
+                thinking_step.name = f"Thought for {thought_for}s"
+                await thinking_step.update()
+                await thinking_step.__aexit__(None, None, None)
+                thinking = False
+
+            async def emit(kind, text):
+                nonlocal thinking, thinking_step, thinking_stream, full_response
+                trace.on_token(kind)
+                if kind == THINKING:
+                    if not thinking_step:
+                        thinking_step = cl.Step(name="Thinking")
+                        await thinking_step.__aenter__()
+                        thinking_stream = TokenCoalescer(thinking_step.stream_token, **stream_config)
+                    thinking = True
+                    thinking_parts.append(text)
+                    await thinking_stream.push(text)
+                else:
+                    if thinking and thinking_step:
+                        await close_thinking_step()
+
+                    if markdown:
+                        text = markdown.feed(text)
+                    full_response += text
+                    await answer_stream.push(text)
+
+            async def flush_markdown():
+                nonlocal full_response
+                if markdown:
+                    text = markdown.flush()
+                    full_response += text
+                    await answer_stream.push(text)
+                    trace.extra["markdown_fixes"] = markdown.fixes
+
+            try:
+                async for kind, text in segments:
+                    await emit(kind, text)
+            except asyncio.CancelledError:
+                # 用户点击停止或断开连接：立即断开上游连接，保存已经输出的部分
+                cancel_handled = True
+                await segments.aclose()
                 if thinking and thinking_step:
-                    thought_for = round(time.time() - start)
-                    thinking_step.name = f"Thought for {thought_for}s"
-                    await thinking_step.update()
-                    await thinking_step.__aexit__(None, None, None)
-                    thinking = False
-                
-                content = filter_content(delta.content)
-                if content:
-                    full_response += content
-                    await final_answer.stream_token(content)
-
-        await final_answer.send()
-        
-        # 首次消息：生成对话标题
-        # 首次消息：生成对话标题
+                    await close_thinking_step()
+                await flush_markdown()
+                await answer_stream.close()
+                if full_response:
+                    await final_answer.send()
+                record = trace.cancel(cl.user_session.get("cancel_reason") or "stop")
+                print(
+                    f"🛑 回复已取消: 已输出 {record['tokens'] + record['thinking_tokens']} 个片段，"
+                    f"估计节省 {record['tokens_saved_estimate']} 个",
+                    flush=True,
+                )
+                raise
+
+            # 流结束时思考步骤仍未关闭（只有思考没有回答）
+            if thinking and thinking_step:
+                await close_thinking_step()
+
+            await flush_markdown()
+            frames_saved += (await answer_stream.close())["frames_saved"]
+            if STREAM_STATS_LOG:
+                print(f"📦 本次响应合并节省 websocket 帧数: {frames_saved}", flush=True)
+            await final_answer.send()
+            trace.finish()
+
+            if use_cache and not cached and full_response:
+                cache_key = make_cache_key(model_name, model_config["temperature"], messages)
+                await response_cache.set(cache_key, "".join(thinking_parts), full_response)
+
+        # 首次消息：回复完成后在后台生成对话标题
         if is_first_message and full_response:
-            # print("DEBUG: 检测到首条消息，准备更新标题...", flush=True)
-            # 异步非阻塞生成标题，避免卡顿
-            # 但为了简单起见，先阻塞调用确认功能正常
-            try:
-                title = await generate_chat_title(client, model_config, msg.content, full_response)
-                # print(f"DEBUG: generate_chat_title 返回: {title}", flush=True)
-                
-                if title:
-                    thread_id = cl.context.session.thread_id
-                    # print(f"DEBUG: 获取到 thread_id: {thread_id}", flush=True)
-                    
-                    data_layer = get_data_layer()
-                    if data_layer and thread_id:
-                        try:
-                            # 尝试更新
-                            await data_layer.update_thread(thread_id=thread_id, name=title)
-                            # print(f"✅ 成功调用 update_thread，新标题: {title}", flush=True)
-                            
-                            # 发送 Toast 提示告知用户
-                            await cl.Message(content=f"📝 Conversation title updated: {title}").send()
-                        except Exception as e:
-                            print(f"❌ 更新标题数据库失败: {e}", flush=True)
-                    else:
-                        print("❌ 无法更新标题: data_layer 或 thread_id 缺失", flush=True)
-            except Exception as e:
-                 print(f"❌ 侧边栏标题逻辑外层异常: {e}", flush=True)
-                 import traceback
-                 traceback.print_exc()
+            submit_title_job(client, model_config, msg.content, full_response)
             cl.user_session.set("title_generated", True)
-        
+
+    except asyncio.CancelledError:
+        # 排队或等待首 token 时被取消，上游请求已由准入控制和路由器清理
+        if not cancel_handled:
+            trace.cancel(cl.user_session.get("cancel_reason") or "stop")
+        raise
+    except AdmissionRejected as e:
+        trace.finish("shed")
+        await cl.Message(content=f"⚠️ {e}").send()
     except Exception as e:
+        trace.finish("error")
         error_msg = f"请求出错: {str(e)}"
         await cl.Message(content=error_msg).send()
+    finally:
+        if permit:
+            permit.release()
 
 
 @cl.set_starters
 async def set_starters():
-    config_path = os.path.join(os.path.dirname(__file__), 'config', 'starters.json')
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            return [cl.Starter(**starter) for starter in config['starters']]
-    except Exception as e:
-        print(f"加载 starters 配置失败: {e}")
-        return []
+    # 启动器配置缓存在内存中，config/starters.json 修改后自动重新加载
+    return get_starters()
 
 
 @cl.on_chat_start
@@ -247,10 +505,7 @@ async def start_chat():
     await get_chat_settings()
     model_config = get_model_config()
     
-    client = AsyncOpenAI(
-        api_key=model_config["api_key"],
-        base_url=model_config["base_url"]
-    )
+    client = get_openai_client(model_config["base_url"], model_config["api_key"])
     
     cl.user_session.set("client", client)
     cl.user_session.set("model_config", model_config)
@@ -263,4 +518,36 @@ async def on_settings_update(settings):
     model_config = get_model_config()
     # 使用用户调整后的温度
     model_config["temperature"] = settings.get("Temperature", model_config["temperature"])
-    cl.user_session.set("model_config", model_config)
\ No newline at end of file
+    cl.user_session.set("temperature", model_config["temperature"])
+    cl.user_session.set("model_config", model_config)
+
+
+@cl.on_stop
+async def on_stop():
+    """用户点击停止：Chainlit 会取消正在执行的 on_message，这里只记录取消原因"""
+    cl.user_session.set("cancel_reason", "stop")
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    """用户关闭页面或断开连接：取消仍在进行的回复，释放上游连接和并发名额"""
+    task = cl.context.session.current_task
+    if task and not task.done():
+        cl.user_session.set("cancel_reason", "disconnect")
+        task.cancel()
+
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+    """进程退出时取消后台任务并关闭共享的 HTTP 连接池"""
+    await title_queue.shutdown()
+    await close_openai_clients()
+    # CustomChatOpenAI 缓存的客户端：只有加载过 custom_chat 的进程才需要关闭
+    custom_chat = sys.modules.get("custom_chat")
+    if custom_chat:
+        await custom_chat.close_clients()
+    await close_shared_data_layer()
+    credential_verifier.shutdown()
+    if response_cache:
+        response_cache.close()
+    close_metrics()
\ No newline at end of file
@@ -0,0 +1,327 @@
+"""Chainlit 聊天数据库的版本化迁移工具
+
+在原数据库上就地升级表结构，不删除任何数据。当前版本号保存在
+PRAGMA user_version 中，每个迁移只执行一次；迁移中的语句都是幂等的，
+重复执行也不会出错。
+
+用法：
+    python migrate_db.py                 # 升级 mychat.db 到最新版本
+    python migrate_db.py path/to/db      # 升级指定数据库
+    python migrate_db.py --status        # 查看当前版本和待执行的迁移
+    python migrate_db.py --to 1          # 只升级到指定版本
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+DEFAULT_DB_FILE = os.getenv("CHAT_DB_PATH", "mychat.db")
+
+# Chainlit SQLAlchemy 数据层所需的表（完整字段版本）
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        identifier TEXT UNIQUE NOT NULL,
+        "createdAt" TEXT,
+        metadata TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS threads (
+        id TEXT PRIMARY KEY,
+        "createdAt" TEXT,
+        name TEXT,
+        "userId" TEXT,
+        "userIdentifier" TEXT,
+        tags TEXT,
+        metadata TEXT,
+        FOREIGN KEY ("userId") REFERENCES users(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS steps (
+        id TEXT PRIMARY KEY,
+        "threadId" TEXT,
+        "parentId" TEXT,
+        "createdAt" TEXT,
+        "start" TEXT,
+        "end" TEXT,
+        name TEXT,
+        type TEXT,
+        input TEXT,
+        output TEXT,
+        streaming INTEGER,
+        "isError" INTEGER,
+        "waitForAnswer" INTEGER,
+        "defaultOpen" INTEGER,
+        "showInput" TEXT,
+        metadata TEXT,
+        generation TEXT,
+        language TEXT,
+        tags TEXT,
+        FOREIGN KEY ("threadId") REFERENCES threads(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS elements (
+        id TEXT PRIMARY KEY,
+        "threadId" TEXT,
+        "stepId" TEXT,
+        name TEXT,
+        type TEXT,
+        display TEXT,
+        size TEXT,
+        language TEXT,
+        page TEXT,
+        url TEXT,
+        path TEXT,
+        mime TEXT,
+        "objectKey" TEXT,
+        "forId" TEXT,
+        "chainlitKey" TEXT,
+        props TEXT,
+        FOREIGN KEY ("threadId") REFERENCES threads(id),
+        FOREIGN KEY ("stepId") REFERENCES steps(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS feedbacks (
+        id TEXT PRIMARY KEY,
+        "stepId" TEXT,
+        "forId" TEXT,
+        value INTEGER,
+        comment TEXT,
+        FOREIGN KEY ("stepId") REFERENCES steps(id)
+    )
+    '''
+]
+
+# 侧边栏按 userId 列出会话、恢复会话按 threadId 读取步骤等常用查询的索引
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_threads_user_created ON threads ("userId", "createdAt")',
+    'CREATE INDEX IF NOT EXISTS idx_steps_thread_created ON steps ("threadId", "createdAt")',
+    'CREATE INDEX IF NOT EXISTS idx_elements_thread ON elements ("threadId")',
+    'CREATE INDEX IF NOT EXISTS idx_feedbacks_for ON feedbacks ("forId")',
+    # 更新统计信息，让查询规划器使用新索引
+    'ANALYZE',
+]
+
+# Chainlit 2.x 的 StepDict 新增的列；缺少这些列时步骤写入会失败
+STEP_COLUMNS = {
+    "autoCollapse": "INTEGER",
+    "command": "TEXT",
+    "modes": "TEXT",
+    "icon": "TEXT",
+}
+
+
+def add_step_columns(conn):
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(steps)")}
+    for name, column_type in STEP_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE steps ADD COLUMN "{name}" {column_type}')
+
+
+# 已归档的会话：步骤、元素和反馈移到 ARCHIVE_DIR 下的压缩文件中，会话本身仍保留在 threads 表
+ARCHIVE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS archived_threads (
+        "threadId" TEXT PRIMARY KEY,
+        "path" TEXT NOT NULL,
+        "archivedAt" TEXT NOT NULL,
+        "steps" INTEGER NOT NULL DEFAULT 0,
+        "bytes" INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+]
+
+# 全文搜索：用户消息、助手回答和会话标题写入 FTS5 索引（trigram 分词，中文也能按子串搜索）。
+# 文档的 rowid 高位是所属用户在 users 表中的 rowid，低 40 位是步骤的 rowid（会话标题额外置第 39 位），
+# 按用户搜索时用 rowid 范围限定，只在该用户自己的文档中匹配和排序。
+# 索引由触发器维护；建索引之前已有的数据由 search_index.py backfill 分批回填。
+SEARCH_STEP_TYPES = "('user_message', 'assistant_message')"
+_THREAD_OWNER = 'COALESCE((SELECT u.rowid FROM threads t JOIN users u ON u.id = t."userId" WHERE t.id = {thread}), 0)'
+_USER_OWNER = "COALESCE((SELECT rowid FROM users WHERE id = {user}), 0)"
+_STEP_BODY = "COALESCE({step}.input, '') || char(10) || COALESCE({step}.output, '')"
+
+
+def _step_doc(step):
+    """步骤文档的 (rowid, thread_id, step_id, title, body) 表达式"""
+    owner = _THREAD_OWNER.format(thread=f'{step}."threadId"')
+    return f'({owner} << 40) | {step}.rowid, {step}."threadId", {step}.id, NULL, {_STEP_BODY.format(step=step)}'
+
+
+def _thread_doc_rowid(thread):
+    owner = _USER_OWNER.format(user=f'{thread}."userId"')
+    return f"({owner} << 40) | (1 << 39) | {thread}.rowid"
+
+
+SEARCH_TABLES = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        thread_id UNINDEXED,
+        step_id UNINDEXED,
+        title,
+        body,
+        tokenize = 'trigram'
+    )
+    """,
+    # 回填进度：rowid 不大于 "end" 的旧数据需要回填，"position" 之前的已完成
+    """
+    CREATE TABLE IF NOT EXISTS search_backfill (
+        name TEXT PRIMARY KEY,
+        "position" INTEGER NOT NULL,
+        "end" INTEGER NOT NULL
+    )
+    """,
+    """
+    INSERT OR IGNORE INTO search_backfill (name, "position", "end")
+    VALUES ('steps', 0, (SELECT COALESCE(MAX(rowid), 0) FROM steps)),
+           ('threads', 0, (SELECT COALESCE(MAX(rowid), 0) FROM threads))
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS search_steps_insert AFTER INSERT ON steps
+    WHEN new.type IN {SEARCH_STEP_TYPES}
+    BEGIN
+        INSERT OR REPLACE INTO search_index (rowid, thread_id, step_id, title, body) VALUES ({_step_doc("new")});
+    END
+    """,
+    # 写回缓冲以 upsert 更新步骤，流式输出期间同一步骤会被重新索引多次
+    f"""
+    CREATE TRIGGER IF NOT EXISTS search_steps_update AFTER UPDATE OF input, output, type, "threadId" ON steps
+    BEGIN
+        DELETE FROM search_index
+        WHERE rowid = ({_THREAD_OWNER.format(thread='old."threadId"')} << 40) | old.rowid;
+        INSERT OR REPLACE INTO search_index (rowid, thread_id, step_id, title, body)
+        SELECT {_step_doc("new")} WHERE new.type IN {SEARCH_STEP_TYPES};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS search_steps_delete AFTER DELETE ON steps
+    BEGIN
+        DELETE FROM search_index
+        WHERE rowid = ({_THREAD_OWNER.format(thread='old."threadId"')} << 40) | old.rowid;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS search_threads_insert AFTER INSERT ON threads
+    WHEN new.name IS NOT NULL
+    BEGIN
+        INSERT OR REPLACE INTO search_index (rowid, thread_id, step_id, title, body)
+        VALUES ({_thread_doc_rowid("new")}, new.id, NULL, new.name, '');
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS search_threads_update AFTER UPDATE OF name, "userId" ON threads
+    BEGIN
+        DELETE FROM search_index WHERE rowid = {_thread_doc_rowid("old")};
+        INSERT OR REPLACE INTO search_index (rowid, thread_id, step_id, title, body)
+        SELECT {_thread_doc_rowid("new")}, new.id, NULL, new.name, '' WHERE new.name IS NOT NULL;
+    END
+    """,
+    # 会话的 userId 在步骤写入之后才设置（或被修改）时，把它的步骤移到新用户的 rowid 范围
+    f"""
+    CREATE TRIGGER IF NOT EXISTS search_threads_owner AFTER UPDATE OF "userId" ON threads
+    WHEN new."userId" IS NOT old."userId"
+    BEGIN
+        DELETE FROM search_index
+        WHERE rowid BETWEEN ({_USER_OWNER.format(user='old."userId"')} << 40)
+                        AND ({_USER_OWNER.format(user='old."userId"')} << 40) | ((1 << 39) - 1)
+          AND thread_id = old.id;
+        INSERT OR REPLACE INTO search_index (rowid, thread_id, step_id, title, body)
+        SELECT {_step_doc("s")} FROM steps s WHERE s."threadId" = new.id AND s.type IN {SEARCH_STEP_TYPES};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS search_threads_delete AFTER DELETE ON threads
+    BEGIN
+        DELETE FROM search_index WHERE rowid = {_thread_doc_rowid("old")};
+    END
+    """,
+]
+
+# (版本号, 说明, 语句列表)；语句可以是 SQL 字符串，也可以是接收连接的函数
+MIGRATIONS = [
+    (1, "基础表结构", TABLES),
+    (2, "常用查询索引", INDEXES),
+    (3, "steps 表补充 Chainlit 2.x 字段", [add_step_columns]),
+    (4, "会话归档记录", ARCHIVE_TABLES),
+    (5, "全文搜索索引", SEARCH_TABLES),
+]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def migrate(conn, target=None, verbose=True):
+    """把数据库升级到 target 版本（默认最新），返回升级后的版本号
+
+    每个迁移在单独的事务中执行，失败时回滚该迁移并抛出异常。
+    """
+    current = get_version(conn)
+    if current == 0:
+        # 新数据库在建表前开启增量 VACUUM，保留策略清理后可以分片回收空间；
+        # 已有数据库需要用 retention.py --enable-incremental-vacuum 转换一次
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    for version, description, statements in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        start = time.time()
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        current = version
+        if verbose:
+            print(f"  ✅ 迁移 {version}: {description} ({time.time() - start:.2f}s)")
+    return current
+
+
+def connect(db_file):
+    # isolation_level=None：由 migrate() 自己控制事务
+    return sqlite3.connect(db_file, isolation_level=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="升级 Chainlit 聊天数据库表结构")
+    parser.add_argument("db_file", nargs="?", default=DEFAULT_DB_FILE)
+    parser.add_argument("--status", action="store_true", help="只显示当前版本和待执行的迁移")
+    parser.add_argument("--to", type=int, default=None, help="升级到指定版本")
+    args = parser.parse_args()
+
+    conn = connect(args.db_file)
+    try:
+        current = get_version(conn)
+        pending = [m for m in MIGRATIONS if m[0] > current and (args.to is None or m[0] <= args.to)]
+        print(f"数据库 '{args.db_file}' 当前版本: {current}，最新版本: {latest_version()}")
+        if args.status:
+            for version, description, _ in pending:
+                print(f"  待执行 {version}: {description}")
+            return
+        if not pending:
+            print("已是最新版本，无需迁移。")
+            return
+        version = migrate(conn, target=args.to)
+        print(f"✅ 迁移完成，当前版本: {version}")
+        if version >= 5 and conn.execute('SELECT 1 FROM search_backfill WHERE "position" < "end"').fetchone():
+            print("提示: 已有的聊天记录需要回填全文索引，请运行 python search_index.py backfill")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""聊天记录的保留策略、归档与空间回收
+
+按 config/retention.json 中的策略（全局默认值 + 按用户覆盖）处理 mychat.db：
+
+- archive_after_days：最后一条消息早于 N 天的会话归档，步骤、元素和反馈移到
+  ARCHIVE_DIR 下的压缩只读文件中，会话仍显示在侧边栏，恢复时从归档文件读取
+- drop_thinking_after_days：早于 N 天的 Thinking 步骤只保留占位文字，清除思考内容
+- 0 或不设置表示不处理；users 中按用户 identifier 覆盖默认策略的部分字段
+
+所有写入都在很短的事务中分片执行（每片约 --slice-ms），片与片之间让出写锁，
+服务运行时也可以执行。归档文件在获取写锁之前读取、写入并 fsync；写事务中先核对会话
+没有变化并记录归档文件，再按 id 分批删除已归档的行（删除完成之前恢复会话时以数据库中的
+行为准，不会重复显示）。删除的数据留下的空闲页由增量 VACUUM 同样分片回收。
+
+归档的消息不在全文索引中，搜索只能按会话标题找到归档的会话；history_io.py 导出时
+默认也不包含归档内容，需要加 --include-archives。
+
+配置示例见 config/retention.example.json。
+
+用法：
+    python retention.py                          # 执行一次（适合放在 cron 中）
+    python retention.py --dry-run                # 只统计将要处理的会话和步骤
+    python retention.py --vacuum-only            # 只回收空闲页
+    python retention.py --enable-incremental-vacuum   # 旧数据库一次性转换（完整 VACUUM，需停服）
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from migrate_db import DEFAULT_DB_FILE, connect, migrate
+from utils.archive import ARCHIVE_FORMAT, archive_path, merge_archive, read_archive, write_archive
+
+DEFAULT_POLICY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "retention.json")
+DEFAULT_ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+POLICY_KEYS = ("archive_after_days", "drop_thinking_after_days")
+
+# 与 main.py / LangflowChat.py 中思考步骤的名称一致
+THINKING_FILTER = '(name = \'Thinking\' OR name LIKE \'Thought for %\')'
+THINKING_PLACEHOLDER = "（思考过程已按保留策略清理）"
+# 每个删除动作最多删除的行数；步骤的删除会触发全文索引更新，约 0.1ms / 行
+DELETE_BATCH = 200
+
+THREAD_PAGE_QUERY = '''
+    SELECT
+        t.id,
+        t."userIdentifier",
+        COALESCE((SELECT MAX(s."createdAt") FROM steps s WHERE s."threadId" = t.id), t."createdAt") AS last_active,
+        EXISTS (SELECT 1 FROM steps s WHERE s."threadId" = t.id) AS has_steps,
+        EXISTS (SELECT 1 FROM archived_threads a WHERE a."threadId" = t.id) AS archived
+    FROM threads t
+    WHERE t.id > ?
+    ORDER BY t.id
+    LIMIT ?
+'''
+
+# 会话内容的指纹：写归档文件之后、删除行之前再次核对，期间有新消息、流式更新或反馈时跳过本次归档
+ARCHIVE_FINGERPRINT_QUERY = '''
+    SELECT
+        (SELECT COUNT(*) || '|' || COALESCE(MAX("createdAt"), '') || '|' || COALESCE(MAX("end"), '') || '|'
+                || (TOTAL(length(input)) + TOTAL(length(output)))
+         FROM steps WHERE "threadId" = :id),
+        (SELECT COUNT(*) FROM elements WHERE "threadId" = :id),
+        (SELECT COUNT(*) || '|' || TOTAL(f.value) || '|' || TOTAL(length(f.comment))
+         FROM steps s JOIN feedbacks f ON f."forId" = s.id WHERE s."threadId" = :id),
+        (SELECT "path" FROM archived_threads WHERE "threadId" = :id)
+'''
+
+
+class Policies:
+    """全局默认策略与按用户覆盖的策略"""
+
+    def __init__(self, default=None, users=None):
+        self.default = self._validate(default or {})
+        self.users = {identifier: {**self.default, **self._validate(policy)} for identifier, policy in (users or {}).items()}
+
+    @staticmethod
+    def _validate(policy):
+        for key, value in policy.items():
+            if key not in POLICY_KEYS:
+                raise ValueError(f"未知的策略字段: {key}")
+            if value is not None and (not isinstance(value, (int, float)) or value < 0):
+                raise ValueError(f"{key} 必须是非负数: {value}")
+        return dict(policy)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("default"), data.get("users"))
+
+    def cutoffs(self, identifier, now):
+        """返回该用户的 (归档截止时间, 清理思考截止时间)，不处理时为 None"""
+        policy = self.users.get(identifier, self.default)
+        return tuple(
+            (now - timedelta(days=policy[key])).strftime("%Y-%m-%dT%H:%M:%S") if policy.get(key) else None
+            for key in POLICY_KEYS
+        )
+
+
+def _rows(conn, query, params):
+    cursor = conn.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+class RetentionJob:
+    """执行保留策略：读取候选会话和写归档文件不持有写锁，删除行和清理在限时的小事务中完成
+
+    Args:
+        conn: isolation_level=None 的 sqlite3 连接
+        archive_dir: 归档文件目录
+        slice_ms: 每个写事务的时间上限（毫秒）
+        pause_ms: 两个写事务之间让出写锁的时间（毫秒）
+        page_size: 每次读取的会话数
+        dry_run: 只统计，不写入
+    """
+
+    def __init__(self, conn, archive_dir, slice_ms=50, pause_ms=50, page_size=200, dry_run=False):
+        self.conn = conn
+        self.archive_dir = archive_dir
+        self.slice = slice_ms / 1000
+        self.pause = pause_ms / 1000
+        self.page_size = page_size
+        self.dry_run = dry_run
+        self._garbage = []  # 当前写事务提交后删除的归档文件
+        self.stats = {
+            "threads_archived": 0,
+            "threads_skipped": 0,
+            "steps_archived": 0,
+            "archive_bytes": 0,
+            "thinking_cleared": 0,
+            "slices": 0,
+            "max_slice_ms": 0.0,
+        }
+
+    def run(self, policies, now=None):
+        now = now or datetime.now(timezone.utc)
+        last_id = ""
+        while True:
+            threads = _rows(self.conn, THREAD_PAGE_QUERY, (last_id, self.page_size))
+            if not threads:
+                break
+            last_id = threads[-1]["id"]
+            actions = []
+            for thread in threads:
+                archive_before, thinking_before = policies.cutoffs(thread["userIdentifier"], now)
+                # 已归档且恢复后没有新步骤的会话无需再次归档
+                if archive_before and (thread["last_active"] or "") < archive_before and (thread["has_steps"] or not thread["archived"]):
+                    prepared = self.prepare_archive(thread["id"], thinking_before)
+                    if prepared:
+                        actions.append((self.commit_archive, prepared))
+                        actions.extend((self.delete_archived_rows, prepared, batch) for batch in prepared["batches"])
+                elif thinking_before and thread["has_steps"]:
+                    actions.append((self.clear_thinking, thread["id"], thinking_before))
+            self._run_slices(actions)
+        return self.stats
+
+    def _run_slices(self, actions):
+        """在多个限时事务中执行 actions，每个事务至少执行一个"""
+        index = 0
+        while index < len(actions):
+            first = index
+            start = time.perf_counter()
+            if not self.dry_run:
+                self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                while index < len(actions) and (time.perf_counter() - start) < self.slice:
+                    func, *args = actions[index]
+                    func(*args)
+                    index += 1
+                if not self.dry_run:
+                    self.conn.execute("COMMIT")
+            except BaseException:
+                if not self.dry_run:
+                    self.conn.execute("ROLLBACK")
+                # 本片及之后尚未提交的新归档文件没有被引用，删除；已有的归档文件仍被引用，保留
+                self._garbage = [args[0]["path"] for func, *args in actions[first:] if func == self.commit_archive]
+                self._remove_garbage()
+                raise
+            self._observe_slice(time.perf_counter() - start)
+            self._remove_garbage()
+            if not self.dry_run:
+                time.sleep(self.pause)
+
+    def _observe_slice(self, seconds):
+        self.stats["slices"] += 1
+        self.stats["max_slice_ms"] = max(self.stats["max_slice_ms"], round(seconds * 1000, 1))
+
+    def clear_thinking(self, thread_id, before):
+        params = (thread_id, before, THINKING_PLACEHOLDER)
+        where = f'"threadId" = ? AND "createdAt" < ? AND {THINKING_FILTER} AND output IS NOT ? AND output != \'\''
+        if self.dry_run:
+            count = self.conn.execute(f"SELECT COUNT(*) FROM steps WHERE {where}", params).fetchone()[0]
+        else:
+            count = self.conn.execute(f"UPDATE steps SET output = ? WHERE {where}", (THINKING_PLACEHOLDER, *params)).rowcount
+        self.stats["thinking_cleared"] += count
+
+    def prepare_archive(self, thread_id, thinking_before):
+        """不持有写锁：读取会话内容，与已有的归档合并后写入新的归档文件并 fsync
+
+        返回 commit_archive 需要的信息；dry_run 时只统计，返回 None。
+        """
+        # 只读事务：步骤、元素、反馈和指纹来自同一个快照
+        self.conn.execute("BEGIN")
+        try:
+            steps = _rows(self.conn, 'SELECT * FROM steps WHERE "threadId" = ? ORDER BY "createdAt"', (thread_id,))
+            elements = _rows(self.conn, 'SELECT * FROM elements WHERE "threadId" = ?', (thread_id,))
+            feedbacks = _rows(
+                self.conn,
+                'SELECT f.* FROM steps s JOIN feedbacks f ON f."forId" = s.id WHERE s."threadId" = ?',
+                (thread_id,),
+            )
+            fingerprint = self.conn.execute(ARCHIVE_FINGERPRINT_QUERY, {"id": thread_id}).fetchone()
+        finally:
+            self.conn.execute("COMMIT")
+
+        cleared = 0
+        if thinking_before:
+            for step in steps:
+                if (
+                    (step["name"] == "Thinking" or (step["name"] or "").startswith("Thought for "))
+                    and (step["createdAt"] or "") < thinking_before
+                    and step["output"]
+                    and step["output"] != THINKING_PLACEHOLDER
+                ):
+                    step["output"] = THINKING_PLACEHOLDER
+                    cleared += 1
+        if self.dry_run:
+            self.stats["threads_archived"] += 1
+            self.stats["steps_archived"] += len(steps)
+            self.stats["thinking_cleared"] += cleared
+            return None
+
+        archived_at = datetime.now(timezone.utc)
+        record = {
+            "format": ARCHIVE_FORMAT,
+            "threadId": thread_id,
+            "archivedAt": archived_at.isoformat(),
+            "steps": steps,
+            "elements": elements,
+            "feedbacks": feedbacks,
+        }
+        previous_path = fingerprint[-1]
+        if previous_path:
+            # 会话恢复后又有新消息：与已有的归档合并
+            record = merge_archive(read_archive(os.path.join(self.archive_dir, previous_path)), record)
+        relative_path = archive_path(thread_id, archived_at.strftime("%Y%m%dT%H%M%S%f"))
+        size = write_archive(os.path.join(self.archive_dir, relative_path), record)
+        return {
+            "thread_id": thread_id,
+            "fingerprint": fingerprint,
+            "path": relative_path,
+            "archived_at": record["archivedAt"],
+            "rows": len(record["steps"]),
+            "steps": len(steps),
+            "cleared": cleared,
+            "size": size,
+            "committed": False,
+            # 按 id 删除本次归档的行：核对之后才写入的新行不受影响
+            "batches": [
+                (table, ids[start:start + DELETE_BATCH])
+                for table, ids in (
+                    ("feedbacks", [row["id"] for row in feedbacks]),
+                    ("elements", [row["id"] for row in elements]),
+                    ("steps", [row["id"] for row in steps]),
+                )
+                for start in range(0, len(ids), DELETE_BATCH)
+            ],
+        }
+
+    def commit_archive(self, prepared):
+        """在写事务中：会话没有变化时记录归档文件（之后由 delete_archived_rows 分批删除行），否则放弃本次归档"""
+        thread_id = prepared["thread_id"]
+        fingerprint = self.conn.execute(ARCHIVE_FINGERPRINT_QUERY, {"id": thread_id}).fetchone()
+        if fingerprint != prepared["fingerprint"]:
+            self.stats["threads_skipped"] += 1
+            self._garbage.append(prepared["path"])
+            return
+
+        self.conn.execute(
+            'INSERT OR REPLACE INTO archived_threads ("threadId", "path", "archivedAt", "steps", "bytes") '
+            'VALUES (?, ?, ?, ?, ?)',
+            (thread_id, prepared["path"], prepared["archived_at"], prepared["rows"], prepared["size"]),
+        )
+        previous_path = fingerprint[-1]
+        if previous_path:
+            self._garbage.append(previous_path)
+        prepared["committed"] = True
+        self.stats["threads_archived"] += 1
+        self.stats["steps_archived"] += prepared["steps"]
+        self.stats["thinking_cleared"] += prepared["cleared"]
+        self.stats["archive_bytes"] += prepared["size"]
+
+    def delete_archived_rows(self, prepared, batch):
+        """删除一批已写入归档文件的行"""
+        if not prepared["committed"]:
+            return
+        table, ids = batch
+        placeholders = ", ".join("?" for _ in ids)
+        self.conn.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+
+    def _remove_garbage(self):
+        for relative_path in self._garbage:
+            try:
+                os.remove(os.path.join(self.archive_dir, relative_path))
+            except FileNotFoundError:
+                pass
+        self._garbage.clear()
+
+    def vacuum(self, budget_seconds, pages=256):
+        """分片执行增量 VACUUM，每片不超过 slice_ms，总时长不超过 budget_seconds，返回回收的页数"""
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("⚠️ 数据库未开启增量 VACUUM，跳过空间回收（可用 --enable-incremental-vacuum 转换）")
+            return 0
+        freed = 0
+        deadline = time.perf_counter() + budget_seconds
+        while time.perf_counter() < deadline:
+            free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            start = time.perf_counter()
+            # sqlite3 的 execute 只执行 PRAGMA 的第一步（回收一页），executescript 才会执行完
+            self.conn.executescript(f"PRAGMA incremental_vacuum({min(pages, free)})")
+            elapsed = time.perf_counter() - start
+            freed += free - self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            self._observe_slice(elapsed)
+            # 按实际耗时调整每片回收的页数，使每片接近 slice_ms
+            if elapsed < self.slice / 2:
+                pages *= 2
+            elif elapsed > self.slice:
+                pages = max(16, pages // 2)
+            time.sleep(self.pause)
+        # 非阻塞地把 WAL 写回主库，文件随之缩小
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return freed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_file", nargs="?", default=DEFAULT_DB_FILE)
+    parser.add_argument("--policy", default=DEFAULT_POLICY_FILE, help="策略文件（默认 config/retention.json）")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="归档文件目录（默认 ARCHIVE_DIR）")
+    parser.add_argument("--slice-ms", type=float, default=50, help="每个写事务的时间上限（毫秒）")
+    parser.add_argument("--pause-ms", type=float, default=50, help="写事务之间的间隔（毫秒）")
+    parser.add_argument("--vacuum-seconds", type=float, default=60, help="增量 VACUUM 的总时长上限（秒）")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不修改数据库")
+    parser.add_argument("--vacuum-only", action="store_true", help="只回收空闲页")
+    parser.add_argument(
+        "--enable-incremental-vacuum", action="store_true", help="把旧数据库转换为增量 VACUUM 模式（完整 VACUUM，需停服）"
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_file):
+        parser.error(f"数据库 '{args.db_file}' 不存在")
+    conn = connect(args.db_file)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    try:
+        if args.enable_incremental_vacuum:
+            start = time.time()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            print(f"✅ 已开启增量 VACUUM ({time.time() - start:.1f}s)")
+            return
+
+        migrate(conn, verbose=False)
+        job = RetentionJob(conn, args.archive_dir, slice_ms=args.slice_ms, pause_ms=args.pause_ms, dry_run=args.dry_run)
+        if not args.vacuum_only:
+            if not os.path.exists(args.policy):
+                parser.error(f"策略文件 '{args.policy}' 不存在（参考 config/retention.example.json）")
+            try:
+                policies = Policies.load(args.policy)
+            except (ValueError, TypeError, AttributeError) as e:
+                parser.error(f"策略文件无效: {e}")
+            start = time.time()
+            stats = job.run(policies)
+            label = "将" if args.dry_run else "已"
+            print(
+                f"✅ {label}归档 {stats['threads_archived']} 个会话（{stats['steps_archived']} 个步骤，"
+                f"归档文件 {stats['archive_bytes'] / 1e6:.1f} MB），{label}清理 {stats['thinking_cleared']} 个思考步骤，"
+                f"耗时 {time.time() - start:.1f}s"
+            )
+            if stats["threads_skipped"]:
+                print(f"   {stats['threads_skipped']} 个会话在归档期间有新的写入，已跳过，下次运行时再处理")
+        if not args.dry_run:
+            start = time.time()
+            pages = job.vacuum(args.vacuum_seconds)
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            print(
+                f"✅ 回收 {pages} 页（{pages * page_size / 1e6:.1f} MB），剩余空闲页 {remaining}，耗时 {time.time() - start:.1f}s"
+            )
+        print(f"   写事务 {job.stats['slices']} 个，最长 {job.stats['max_slice_ms']} ms")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""全文搜索索引的回填与查询
+
+迁移 5 创建 search_index 后，新写入的消息和会话标题由触发器实时索引；迁移之前已有的
+数据由本工具按 rowid 分批回填。每批在一个短事务中完成并记录进度，服务运行时也可以
+执行，中断后再次运行会从上次的位置继续。
+
+用法：
+    python search_index.py backfill                  # 回填 mychat.db
+    python search_index.py backfill --batch 2000
+    python search_index.py status                    # 查看回填进度
+    python search_index.py check                     # 检查重复或失效的索引文档
+    python search_index.py query alice "对冲请求"     # 以用户 alice 的身份搜索
+    python search_index.py rebuild                   # 清空后重新回填全部数据
+"""
+import argparse
+import os
+import time
+
+from migrate_db import DEFAULT_DB_FILE, SEARCH_STEP_TYPES, connect, migrate
+from utils.search import build_search, format_results, parse_terms
+
+BACKFILL_QUERIES = {
+    "steps": f"""
+        INSERT OR REPLACE INTO search_index (rowid, thread_id, step_id, title, body)
+        SELECT (COALESCE(u.rowid, 0) << 40) | s.rowid, s."threadId", s.id, NULL,
+               COALESCE(s.input, '') || char(10) || COALESCE(s.output, '')
+        FROM steps s
+        LEFT JOIN threads t ON t.id = s."threadId"
+        LEFT JOIN users u ON u.id = t."userId"
+        WHERE s.rowid > ? AND s.rowid <= ? AND s.type IN {SEARCH_STEP_TYPES}
+    """,
+    "threads": """
+        INSERT OR REPLACE INTO search_index (rowid, thread_id, step_id, title, body)
+        SELECT (COALESCE(u.rowid, 0) << 40) | (1 << 39) | t.rowid, t.id, NULL, t.name, ''
+        FROM threads t
+        LEFT JOIN users u ON u.id = t."userId"
+        WHERE t.rowid > ? AND t.rowid <= ? AND t.name IS NOT NULL
+    """,
+}
+
+
+def backfill(conn, batch=5000, pause_ms=20, verbose=True):
+    """分批回填迁移之前的数据，返回处理的 rowid 数"""
+    total = 0
+    start = time.perf_counter()
+    for name, query in BACKFILL_QUERIES.items():
+        position, end = conn.execute(
+            'SELECT "position", "end" FROM search_backfill WHERE name = ?', (name,)
+        ).fetchone()
+        while position < end:
+            upto = min(position + batch, end)
+            # 与触发器在同一把写锁下执行：已被触发器索引过的行会被相同内容覆盖
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(query, (position, upto))
+                conn.execute('UPDATE search_backfill SET "position" = ? WHERE name = ?', (upto, name))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            total += upto - position
+            position = upto
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print(f"\r  {name}: {position}/{end}，{total / max(elapsed, 1e-9):,.0f} rows/s", end="", flush=True)
+            time.sleep(pause_ms / 1000)
+        if verbose and end:
+            print()
+    return total
+
+
+def status(conn):
+    for name, position, end in conn.execute('SELECT name, "position", "end" FROM search_backfill ORDER BY name'):
+        state = "已完成" if position >= end else f"{position}/{end}"
+        print(f"  {name}: {state}")
+    print(f"  索引文档数: {conn.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]}")
+
+
+CHECK_QUERIES = {
+    "重复的步骤文档": """
+        SELECT COUNT(*) FROM (
+            SELECT step_id FROM search_index WHERE step_id IS NOT NULL GROUP BY step_id HAVING COUNT(*) > 1
+        )
+    """,
+    "重复的会话标题文档": """
+        SELECT COUNT(*) FROM (
+            SELECT thread_id FROM search_index WHERE step_id IS NULL GROUP BY thread_id HAVING COUNT(*) > 1
+        )
+    """,
+    "步骤已删除的文档": """
+        SELECT COUNT(*) FROM search_index si
+        WHERE si.step_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM steps s WHERE s.id = si.step_id)
+    """,
+    "会话已删除的标题文档": """
+        SELECT COUNT(*) FROM search_index si
+        WHERE si.step_id IS NULL AND NOT EXISTS (SELECT 1 FROM threads t WHERE t.id = si.thread_id)
+    """,
+}
+
+
+def check(conn):
+    """检查索引中每个步骤、每个会话标题是否只有一个文档，返回 {检查项: 问题数}"""
+    return {name: conn.execute(sql).fetchone()[0] for name, sql in CHECK_QUERIES.items()}
+
+
+def query(conn, identifier, text, limit=10, offset=0):
+    owner = conn.execute("SELECT rowid FROM users WHERE identifier = ?", (identifier,)).fetchone()
+    if owner is None:
+        return {"results": [], "next_offset": None}
+    terms = parse_terms(text)
+    sql, params = build_search(terms, owner[0], limit, offset)
+    cursor = conn.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    return format_results([dict(zip(columns, row)) for row in cursor], terms, limit, offset)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command in ("backfill", "rebuild"):
+        sub = commands.add_parser(command)
+        sub.add_argument("db_file", nargs="?", default=DEFAULT_DB_FILE)
+        sub.add_argument("--batch", type=int, default=5000, help="每个事务回填的 rowid 数")
+        sub.add_argument("--pause-ms", type=float, default=20, help="事务之间的间隔（毫秒）")
+    for command in ("status", "check"):
+        commands.add_parser(command).add_argument("db_file", nargs="?", default=DEFAULT_DB_FILE)
+    query_parser = commands.add_parser("query")
+    query_parser.add_argument("identifier")
+    query_parser.add_argument("text")
+    query_parser.add_argument("--db", dest="db_file", default=DEFAULT_DB_FILE)
+    query_parser.add_argument("--limit", type=int, default=10)
+    query_parser.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_file):
+        parser.error(f"数据库 '{args.db_file}' 不存在")
+    conn = connect(args.db_file)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    try:
+        migrate(conn, verbose=False)
+        if args.command == "rebuild":
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM search_index")
+            conn.execute(
+                'UPDATE search_backfill SET "position" = 0, "end" = '
+                "(SELECT COALESCE(MAX(rowid), 0) FROM steps) WHERE name = 'steps'"
+            )
+            conn.execute(
+                'UPDATE search_backfill SET "position" = 0, "end" = '
+                "(SELECT COALESCE(MAX(rowid), 0) FROM threads) WHERE name = 'threads'"
+            )
+            conn.execute("COMMIT")
+        if args.command in ("backfill", "rebuild"):
+            start = time.time()
+            rows = backfill(conn, batch=args.batch, pause_ms=args.pause_ms)
+            print(f"✅ 回填完成，处理 {rows} 行，耗时 {time.time() - start:.1f}s")
+        elif args.command == "status":
+            status(conn)
+        elif args.command == "check":
+            problems = check(conn)
+            for name, count in problems.items():
+                print(f"  {name}: {count}")
+            if any(problems.values()):
+                print("⚠️ 索引与数据不一致，可运行 python search_index.py rebuild 重建")
+                raise SystemExit(1)
+            print("✅ 索引与数据一致")
+        else:
+            start = time.perf_counter()
+            result = query(conn, args.identifier, args.text, limit=args.limit, offset=args.offset)
+            for item in result["results"]:
+                print(f"[{item['score']:.2f}] {item['thread_name']} ({item['type']}, {item['created_at']})")
+                print(f"    {item['snippet']}")
+            print(f"共 {len(result['results'])} 条，下一页 offset={result['next_offset']}，"
+                  f"耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,61 @@
-from .thinking_utils import get_thinking_content, filter_content
+from .thinking_utils import (
+    get_thinking_content,
+    filter_content,
+    ThinkStreamParser,
+    THINKING,
+    ANSWER,
+)
+from .stream_coalescer import TokenCoalescer
+from .markdown_stream import MarkdownStreamNormalizer
+from .title_queue import TitleQueue
+from .context_window import ContextWindow, count_tokens, summarize_history
+from .auth import CredentialVerifier
+from .data_layer import get_shared_data_layer, close_shared_data_layer
+from .response_cache import ResponseCache, make_cache_key, replay_segments
+from .client_pool import get_openai_client, close_openai_clients, get_client_pool_stats
+from .langflow_client import get_langflow_session, close_langflow_session, iter_ndjson_events
+from .langflow_tokens import LangflowTokenPipeline, decode_escapes
+from .metrics import RequestTrace, TITLE_LATENCY, install_metrics_endpoint, close_metrics
+from .metrics import registry as metrics_registry
+from .router import ChatRouter
+from .admission import AdmissionController, AdmissionRejected
+from .search import HistorySearch, SearchError, install_search_endpoint
 
-__all__ = ['get_thinking_content', 'filter_content']
\ No newline at end of file
+__all__ = [
+    'get_thinking_content',
+    'filter_content',
+    'ThinkStreamParser',
+    'THINKING',
+    'ANSWER',
+    'TokenCoalescer',
+    'MarkdownStreamNormalizer',
+    'TitleQueue',
+    'ContextWindow',
+    'count_tokens',
+    'summarize_history',
+    'CredentialVerifier',
+    'get_shared_data_layer',
+    'close_shared_data_layer',
+    'ResponseCache',
+    'make_cache_key',
+    'replay_segments',
+    'get_openai_client',
+    'close_openai_clients',
+    'get_client_pool_stats',
+    'get_langflow_session',
+    'close_langflow_session',
+    'iter_ndjson_events',
+    'LangflowTokenPipeline',
+    'decode_escapes',
+    'RequestTrace',
+    'TITLE_LATENCY',
+    'metrics_registry',
+    'install_metrics_endpoint',
+    'close_metrics',
+    'ChatRouter',
+    'AdmissionController',
+    'AdmissionRejected',
+    'HistorySearch',
+    'SearchError',
+    'install_search_endpoint',
+]
\ No newline at end of file
@@ -0,0 +1,288 @@
+"""上游调用的准入控制
+
+聊天和标题请求在发往上游之前先经过 AdmissionController：
+
+- 每个用户一个令牌桶，发送过于频繁的请求直接拒绝并提示多久后重试
+- 每个池（聊天、标题）有并发上限，聊天池的上限为每端点上限 × 端点数
+- 池满时进入公平队列：按用户轮转放行，一个用户连发多条不会挤占其他用户
+- 排队位置变化时回调调用方，用于在界面上显示“前面还有 N 个请求”
+- 排队超过 queue_timeout 的请求被拒绝，而不是开始流式输出后再超时
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from .metrics import registry
+
+ADMISSION_REQUESTS = registry.counter(
+    "admission_requests_total", "准入结果：admitted / queued / rejected_rate / shed_timeout", ("pool", "outcome")
+)
+ADMISSION_WAIT = registry.histogram("admission_wait_seconds", "排队等待时间", ("pool",))
+
+
+class AdmissionRejected(Exception):
+    """请求未被放行
+
+    Attributes:
+        reason: "rate"（超出用户速率）或 "timeout"（排队超时）
+        retry_after: 建议的重试等待时间（秒）
+    """
+
+    def __init__(self, reason, retry_after=0.0):
+        self.reason = reason
+        self.retry_after = retry_after
+        if reason == "rate":
+            message = f"发送过于频繁，请 {retry_after:.0f} 秒后再试"
+        else:
+            message = "服务繁忙，排队超时，请稍后重试"
+        super().__init__(message)
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多 burst 个"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """取一个令牌，返回 0 表示成功，否则返回需要等待的秒数"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class Permit:
+    """占用的并发名额，release 可重复调用"""
+
+    __slots__ = ("_pool", "_released")
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._pool.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class _Waiter:
+    __slots__ = ("user", "future", "changed", "position")
+
+    def __init__(self, user):
+        self.user = user
+        self.future = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Event()
+        self.position = None
+
+
+class _Pool:
+    """一个并发池及其按用户轮转的等待队列"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self.queues = OrderedDict()  # user -> deque[_Waiter]，顺序即轮转顺序
+        self.waiting = 0
+
+    def enqueue(self, waiter):
+        self.queues.setdefault(waiter.user, deque()).append(waiter)
+        self.waiting += 1
+        self.update_positions()
+
+    def remove(self, waiter):
+        queue = self.queues.get(waiter.user)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[waiter.user]
+            self.update_positions()
+
+    def release(self):
+        self.in_use -= 1
+        self.grant()
+
+    def grant(self):
+        """有空闲名额时按用户轮转放行等待者"""
+        granted = False
+        while self.in_use < self.capacity and self.queues:
+            user, queue = next(iter(self.queues.items()))
+            waiter = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self.queues.move_to_end(user)  # 该用户的下一个请求排到本轮最后
+            else:
+                del self.queues[user]
+            if waiter.future.done():  # 已取消
+                continue
+            self.in_use += 1
+            waiter.future.set_result(Permit(self))
+            granted = True
+        if granted:
+            self.update_positions()
+
+    def update_positions(self):
+        """按实际放行顺序（每轮每个用户一个）重新计算排队位置"""
+        position = 0
+        rounds = [iter(queue) for queue in self.queues.values()]
+        while rounds:
+            remaining = []
+            for queue in rounds:
+                waiter = next(queue, None)
+                if waiter is None:
+                    continue
+                if waiter.position != position:
+                    waiter.position = position
+                    waiter.changed.set()
+                position += 1
+                remaining.append(queue)
+            rounds = remaining
+
+
+class AdmissionController:
+    """上游调用的准入控制
+
+    Args:
+        capacity: 每个池的默认并发上限
+        user_rate: 每个用户每分钟可发起的请求数，0 表示不限
+        user_burst: 令牌桶容量（允许的突发请求数）
+        queue_timeout: 最长排队时间（秒），超过后拒绝
+    """
+
+    def __init__(self, capacity=32, user_rate=30.0, user_burst=10, queue_timeout=30.0):
+        self._capacity = capacity
+        self._user_rate = user_rate / 60
+        self._user_burst = user_burst
+        self._queue_timeout = queue_timeout
+        self._pools = {}
+        self._buckets = {}
+        registry.gauge(
+            "admission_in_use", "占用的并发名额",
+            lambda: {(("pool", name),): pool.in_use for name, pool in self._pools.items()},
+        )
+        registry.gauge(
+            "admission_queue_depth", "排队中的请求数",
+            lambda: {(("pool", name),): pool.waiting for name, pool in self._pools.items()},
+        )
+
+    def _pool(self, name):
+        pool = self._pools.get(name)
+        if pool is None:
+            pool = self._pools[name] = _Pool(name, self._capacity)
+        return pool
+
+    def set_capacity(self, name, capacity):
+        """调整池的并发上限（例如端点数量变化时），上限变大时立即放行等待者"""
+        pool = self._pool(name)
+        if capacity != pool.capacity:
+            pool.capacity = capacity
+            pool.grant()
+
+    def _check_rate(self, user):
+        if not self._user_rate:
+            return
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # 回收已经补满的桶，它们与新建的桶等价
+                self._buckets = {key: b for key, b in self._buckets.items() if not b.is_full()}
+            bucket = self._buckets[user] = TokenBucket(self._user_rate, self._user_burst)
+        retry_after = bucket.take()
+        if retry_after:
+            raise AdmissionRejected("rate", retry_after)
+
+    async def acquire(self, name, user, on_wait=None, charge=True):
+        """申请一个并发名额，返回 Permit（用完后 release 或 async with）
+
+        Args:
+            name: 池名称
+            user: 用户标识，用于速率限制和公平轮转
+            on_wait: 排队位置变化时调用的异步函数 on_wait(position)，position 从 0 开始
+            charge: 是否计入用户的速率限制（后台任务传 False）
+
+        Raises:
+            AdmissionRejected: 超出用户速率或排队超时
+        """
+        pool = self._pool(name)
+        if charge:
+            try:
+                self._check_rate(user)
+            except AdmissionRejected:
+                ADMISSION_REQUESTS.inc(pool=name, outcome="rejected_rate")
+                raise
+
+        if pool.in_use < pool.capacity and not pool.queues:
+            pool.in_use += 1
+            ADMISSION_REQUESTS.inc(pool=name, outcome="admitted")
+            return Permit(pool)
+
+        ADMISSION_REQUESTS.inc(pool=name, outcome="queued")
+        waiter = _Waiter(user)
+        pool.enqueue(waiter)
+        start = time.monotonic()
+        deadline = start + self._queue_timeout
+        try:
+            while not waiter.future.done():
+                if waiter.changed.is_set():
+                    waiter.changed.clear()
+                    if on_wait:
+                        await on_wait(waiter.position)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                changed = asyncio.ensure_future(waiter.changed.wait())
+                try:
+                    await asyncio.wait((waiter.future, changed), timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+        except BaseException:
+            self._abandon(pool, waiter)
+            raise
+
+        ADMISSION_WAIT.observe(time.monotonic() - start, pool=name)
+        if not waiter.future.done():
+            self._abandon(pool, waiter)
+            ADMISSION_REQUESTS.inc(pool=name, outcome="shed_timeout")
+            raise AdmissionRejected("timeout")
+        return waiter.future.result()
+
+    @staticmethod
+    def _abandon(pool, waiter):
+        if waiter.future.done():
+            # 名额已经分配但调用方不再需要（被取消），归还给下一个等待者
+            if not waiter.future.cancelled():
+                waiter.future.result().release()
+        else:
+            waiter.future.cancel()
+            pool.remove(waiter)
+
+    def get_stats(self):
+        return {
+            name: {"capacity": pool.capacity, "in_use": pool.in_use, "waiting": pool.waiting, "users": len(pool.queues)}
+            for name, pool in self._pools.items()
+        }
@@ -0,0 +1,115 @@
+"""会话归档文件
+
+保留策略（retention.py）把长期不活跃会话的步骤、元素和反馈移出 mychat.db，写入
+ARCHIVE_DIR 下每个会话一个的 gzip 压缩 JSON 文件（只读）。会话本身留在 threads
+表中，侧边栏照常显示；恢复会话时数据层读取归档文件，把归档的内容拼接在数据库中
+的步骤之前。
+
+文件内容：
+    {"format": 1, "threadId": "...", "archivedAt": "...",
+     "steps": [...], "elements": [...], "feedbacks": [...]}
+其中每一行与数据库中的列一一对应（与 history_io.py 导出的行相同）。
+"""
+
+import gzip
+import json
+import os
+
+ARCHIVE_FORMAT = 1
+
+
+def archive_path(thread_id, stamp):
+    """会话归档文件相对 ARCHIVE_DIR 的路径，按 id 前两位分目录，避免单个目录文件过多
+
+    文件名带归档时间 stamp：再次归档（合并）时写入新文件，数据库提交之前已有的归档文件保持不变。
+    """
+    return os.path.join(thread_id[:2], f"{thread_id}.{stamp}.json.gz")
+
+
+def write_archive(path, record):
+    """原子地写入归档文件（先写临时文件再替换），写完后设为只读，返回文件大小"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def read_archive(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        record = json.load(f)
+    if record.get("format") != ARCHIVE_FORMAT:
+        raise ValueError(f"不支持的归档文件格式: {path}")
+    return record
+
+
+def merge_archive(previous, record):
+    """会话归档后又有新的步骤时，再次归档需要与已有的归档合并（相同 id 以新的为准）"""
+    merged = dict(record)
+    for key in ("steps", "elements", "feedbacks"):
+        ids = {row["id"] for row in record[key]}
+        merged[key] = [row for row in previous[key] if row["id"] not in ids] + record[key]
+    return merged
+
+
+def archived_thread_items(record):
+    """把归档文件转换为 ThreadDict 中的 steps 和 elements（与 SQLAlchemyDataLayer 读取数据库时一致）"""
+    feedbacks = {row["forId"]: row for row in record["feedbacks"]}
+    steps = []
+    for row in record["steps"]:
+        feedback = feedbacks.get(row["id"])
+        if feedback is not None and feedback.get("value") is not None:
+            feedback = {
+                "forId": row["id"],
+                "id": feedback["id"],
+                "value": feedback["value"],
+                "comment": feedback.get("comment"),
+            }
+        else:
+            feedback = None
+        steps.append({
+            "id": row["id"],
+            "name": row["name"],
+            "type": row["type"],
+            "threadId": row["threadId"],
+            "parentId": row.get("parentId"),
+            "streaming": row.get("streaming", False),
+            "waitForAnswer": row.get("waitForAnswer"),
+            "isError": row.get("isError"),
+            "metadata": row["metadata"] if row.get("metadata") is not None else {},
+            "tags": row.get("tags"),
+            "input": row.get("input", "") if row.get("showInput") not in (None, "false") else "",
+            "output": row.get("output", ""),
+            "createdAt": row.get("createdAt"),
+            "start": row.get("start"),
+            "end": row.get("end"),
+            "generation": row.get("generation"),
+            "showInput": row.get("showInput"),
+            "language": row.get("language"),
+            "feedback": feedback,
+        })
+    elements = [
+        {
+            "id": row["id"],
+            "threadId": row["threadId"],
+            "type": row.get("type"),
+            "chainlitKey": row.get("chainlitKey"),
+            "url": row.get("url"),
+            "objectKey": row.get("objectKey"),
+            "name": row.get("name"),
+            "display": row.get("display"),
+            "size": row.get("size"),
+            "language": row.get("language"),
+            "page": row.get("page"),
+            "props": row.get("props") or "{}",
+            "forId": row.get("forId"),
+            "mime": row.get("mime"),
+        }
+        for row in record["elements"]
+    ]
+    return steps, elements
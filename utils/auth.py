@@ -0,0 +1,128 @@
+"""异步、带缓存的用户凭据校验
+
+bcrypt 校验本身就很慢（100~300ms），直接在回调里同步执行会卡住事件循环，
+登录高峰时所有正在进行的流式输出都会停顿。CredentialVerifier：
+
+- 在有上限的线程池中执行数据库查询和 bcrypt 校验
+- 每个工作线程复用一个只读的 users.db 连接
+- 校验成功后在短时间内缓存结果，缓存中只保存带密钥的哈希，不保存密码
+"""
+
+import asyncio
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class CredentialVerifier:
+    """用户凭据校验器
+
+    Args:
+        db_file: 用户数据库路径
+        workers: 执行 bcrypt 的线程数
+        cache_ttl: 校验成功结果的缓存时间（秒），0 表示不缓存
+        cache_size: 最多缓存的用户数
+        dev_mode: 数据库不存在时是否允许 admin/admin 登录
+    """
+
+    def __init__(self, db_file="users.db", workers=4, cache_ttl=300, cache_size=10000, dev_mode=False):
+        self._db_file = db_file
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+        self._local = threading.local()
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        self._cache = OrderedDict()  # username -> (摘要, role, 过期时间)
+        # 进程内随机密钥，缓存中的摘要无法离线还原密码
+        self._cache_key = os.urandom(32)
+        self._dev_mode = dev_mode
+        self.stats = {"cache_hits": 0, "bcrypt_checks": 0, "failures": 0}
+        # 计数同时在事件循环和工作线程中更新
+        self._stats_lock = threading.Lock()
+
+    async def verify(self, username: str, password: str):
+        """校验用户名和密码，成功返回角色，失败返回 None"""
+        if not os.path.exists(self._db_file):
+            # 如果数据库不存在，检查开发模式
+            if self._dev_mode and (username, password) == ("admin", "admin"):
+                return "admin"
+            return None
+
+        digest = self._digest(username, password)
+        cached = self._cache.get(username)
+        if cached and cached[2] > time.monotonic() and hmac.compare_digest(cached[0], digest):
+            self._cache.move_to_end(username)
+            self._count("cache_hits")
+            return cached[1]
+
+        loop = asyncio.get_running_loop()
+        role = await loop.run_in_executor(self._executor, self._check, username, password)
+        if role is None:
+            self._count("failures")
+            self._cache.pop(username, None)
+        elif self._cache_ttl > 0:
+            self._cache[username] = (digest, role, time.monotonic() + self._cache_ttl)
+            self._cache.move_to_end(username)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return role
+
+    def invalidate(self, username=None):
+        """清除缓存（修改密码或角色后调用）"""
+        if username is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(username, None)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _digest(self, username, password):
+        message = f"{username}\0{password}".encode("utf-8")
+        return hmac.new(self._cache_key, message, hashlib.sha256).digest()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 只读模式打开，每个工作线程一个连接
+            conn = sqlite3.connect(f"file:{self._db_file}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def _check(self, username, password):
+        """在工作线程中执行：查询用户并校验密码"""
+        try:
+            c = self._connection().cursor()
+            c.execute("SELECT password_hash, role FROM users WHERE username = ?", (username,))
+            user = c.fetchone()
+        except sqlite3.Error as e:
+            print(f"认证错误: {e}")
+            # 连接可能已失效（例如数据库被替换），关闭后下次重新打开
+            conn = getattr(self._local, "conn", None)
+            self._local.conn = None
+            if conn is not None:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            return None
+
+        if not user:
+            return None
+        stored_password_hash, role = user
+        if isinstance(stored_password_hash, str):
+            stored_password_hash = stored_password_hash.encode("utf-8")
+        self._count("bcrypt_checks")
+        if bcrypt.checkpw(password.encode("utf-8"), stored_password_hash):
+            return role
+        return None
@@ -0,0 +1,112 @@
+"""进程级共享的 AsyncOpenAI 客户端池
+
+每个 AsyncOpenAI 都持有独立的 httpx 连接池，按会话创建会导致大量空闲连接池
+和重复的 TLS 握手。这里按 (base_url, api_key) 缓存客户端，同一个上游只保留
+一个连接池。
+"""
+
+import hashlib
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from config.chat_settings import get_client_pool_config
+
+from .metrics import registry
+
+_clients = {}  # key -> (AsyncOpenAI, 统计信息)
+
+
+def _client_key(base_url, api_key):
+    # 不在键和统计信息中保存明文 api_key
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+    return (base_url.rstrip("/") if base_url else "", digest)
+
+
+class _CountingHttpxClient(DefaultAsyncHttpxClient):
+    """统计请求数和等待响应头的请求数
+
+    在 send 外层计数，in_flight 在 finally 中减一：连接失败、读取超时或请求被取消时
+    也不会残留计数（httpx 的 response 事件钩子在这些情况下不会调用）。
+    """
+
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self._pool_stats = stats
+
+    async def send(self, request, **kwargs):
+        stats = self._pool_stats
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        try:
+            response = await super().send(request, **kwargs)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+        if response.status_code >= 400:
+            stats["errors"] += 1
+        return response
+
+
+def _build_client(base_url, api_key, stats):
+    pool_config = get_client_pool_config()
+    http_client = _CountingHttpxClient(
+        stats,
+        limits=httpx.Limits(
+            max_connections=pool_config["max_connections"],
+            max_keepalive_connections=pool_config["max_keepalive_connections"],
+            keepalive_expiry=pool_config["keepalive_expiry"],
+        ),
+    )
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+
+def get_openai_client(base_url, api_key):
+    """获取 (base_url, api_key) 对应的共享客户端，不存在时创建"""
+    key = _client_key(base_url, api_key)
+    entry = _clients.get(key)
+    if entry is None:
+        stats = {"requests": 0, "in_flight": 0, "errors": 0}
+        entry = (_build_client(base_url, api_key, stats), stats)
+        _clients[key] = entry
+    return entry[0]
+
+
+async def close_openai_clients():
+    """关闭所有客户端及其连接池（进程退出时调用）"""
+    entries = list(_clients.values())
+    _clients.clear()
+    for client, _ in entries:
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"❌ 关闭 OpenAI 客户端失败: {e}", flush=True)
+
+
+def get_client_pool_stats():
+    """返回每个上游连接池的统计信息"""
+    result = []
+    for (base_url, key_digest), (client, stats) in _clients.items():
+        item = {"base_url": base_url, "key": key_digest, **stats}
+        # httpx / httpcore 未公开连接池信息，这里尽力读取，版本变化时只是缺少这两项
+        pool = getattr(getattr(getattr(client, "_client", None), "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            try:
+                item["idle_connections"] = sum(1 for c in connections if c.is_idle())
+                item["connections"] = len(connections)
+            except Exception:
+                item.pop("idle_connections", None)
+        result.append(item)
+    return result
+
+
+def _pool_gauge(field):
+    return lambda: {(("base_url", base_url),): stats[field] for (base_url, _), (_, stats) in _clients.items()}
+
+
+registry.gauge("openai_pool_in_flight", "等待上游响应头的请求数", _pool_gauge("in_flight"))
+registry.gauge("openai_pool_requests", "发往上游的请求总数", _pool_gauge("requests"))
+registry.gauge("openai_pool_errors", "上游返回 4xx/5xx 或请求失败（连接错误、超时）的次数", _pool_gauge("errors"))
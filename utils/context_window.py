@@ -0,0 +1,142 @@
+"""按 token 预算裁剪对话上下文
+
+每轮都把完整历史发给模型会让请求体积、预填充延迟和费用无限增长，最终触发
+上下文长度错误。ContextWindow 在预算内保留系统提示词和最近的消息，
+更早的消息可以用一段滚动摘要代替。
+"""
+
+from .thinking_utils import filter_content
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，未安装时使用估算
+    tiktoken = None
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:  # 离线环境无法下载词表
+            print(f"⚠️ 加载 tiktoken 词表失败，改用估算: {e}", flush=True)
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """计算文本的 token 数
+
+    安装了 tiktoken 时精确计算；否则按 ASCII 约 4 字符 / token、
+    其他字符（中文等）约 1 字符 / token 估算。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def message_role(message):
+    """与 cl.chat_context.to_openai() 相同的角色映射"""
+    if message.type == "assistant_message":
+        return "assistant"
+    if message.type == "user_message":
+        return "user"
+    return "system"
+
+
+def message_tokens(message):
+    """返回消息的 token 数，结果缓存在消息对象上，内容不变时不重复计算"""
+    content = message.content or ""
+    cached = getattr(message, "_context_tokens", None)
+    if cached is not None and cached[0] == content:
+        return cached[1]
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    message._context_tokens = (content, tokens)
+    return tokens
+
+
+class ContextWindow:
+    """在 token 预算内构造发送给模型的消息列表
+
+    Args:
+        budget: 提示词 token 预算（系统提示词 + 摘要 + 历史消息）
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+
+    def build(self, system_prompt, messages, summary=None):
+        """构造消息列表
+
+        Args:
+            system_prompt: 系统提示词，始终保留
+            messages: Chainlit 消息列表（cl.chat_context.get()），按时间顺序
+            summary: 可选的滚动摘要 {"covered": 已覆盖的最早消息数, "text": 摘要}
+
+        Returns:
+            tuple[list[dict], dict]: OpenAI 格式的消息列表和裁剪报告
+        """
+        used = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        counts = [message_tokens(m) for m in messages]
+
+        # 从最新的消息向前保留，最新一条消息（本轮用户输入）总是保留
+        keep_from = len(messages)
+        for index in range(len(messages) - 1, -1, -1):
+            if keep_from < len(messages) and used + counts[index] > self.budget:
+                break
+            used += counts[index]
+            keep_from = index
+        # 不以孤立的助手回复开头
+        while keep_from < len(messages) - 1 and message_role(messages[keep_from]) == "assistant":
+            used -= counts[keep_from]
+            keep_from += 1
+
+        result = [{"role": "system", "content": system_prompt}]
+        summary_used = False
+        if keep_from > 0 and summary and 0 < summary["covered"] <= keep_from:
+            summary_text = f"Summary of the earlier conversation:\n{summary['text']}"
+            summary_tokens = count_tokens(summary_text) + MESSAGE_OVERHEAD_TOKENS
+            if used + summary_tokens <= self.budget:
+                result.append({"role": "system", "content": summary_text})
+                used += summary_tokens
+                summary_used = True
+
+        result.extend(
+            {"role": message_role(m), "content": m.content} for m in messages[keep_from:]
+        )
+        report = {
+            "prompt_tokens": used,
+            "trimmed_messages": keep_from,
+            "trimmed_tokens": sum(counts[:keep_from]),
+            "summary_used": summary_used,
+        }
+        return result, report
+
+
+async def summarize_history(client, model_name, max_tokens, messages, previous_summary=""):
+    """把较早的消息压缩成一段摘要（滚动摘要：在上一次摘要基础上追加）"""
+    transcript = "\n".join(f"{message_role(m)}: {m.content}" for m in messages)
+    if previous_summary:
+        transcript = f"Previous summary:\n{previous_summary}\n\nNew messages:\n{transcript}"
+    response = await client.chat.completions.create(
+        model=model_name,
+        messages=[
+            {
+                "role": "system",
+                "content": "Summarize the conversation below so it can replace the original messages as context. Keep facts, decisions, code identifiers and open questions. Be concise. Answer in the conversation's language.",
+            },
+            {"role": "user", "content": transcript},
+        ],
+        temperature=0.3,
+        max_tokens=max_tokens,
+    )
+    return filter_content(response.choices[0].message.content).strip()
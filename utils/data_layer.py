@@ -0,0 +1,354 @@
+"""进程内共享、针对 SQLite 调优的 SQLAlchemy 数据层
+
+- 每个进程只创建一个数据层（一个引擎、一个连接池）
+- 每个新连接都设置 WAL、synchronous=NORMAL、busy_timeout、mmap/cache_size 等 PRAGMA
+- 写操作先用 BEGIN IMMEDIATE 获取写锁，记录写入耗时和等待写锁的时间
+- 步骤（消息、Thinking）的创建/更新先进入写回缓冲区，合并后批量落库
+- 恢复已归档的会话时从归档文件读取被移出数据库的步骤和元素
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+from chainlit.data.utils import queue_until_user_message
+from chainlit.logger import logger
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from config.chat_settings import get_data_layer_config
+
+from .archive import archived_thread_items, read_archive
+from .metrics import DB_LATENCY, registry
+from .write_behind import WriteBehindBuffer
+
+WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class LatencyStats:
+    """简单的耗时统计：次数、总耗时、最大耗时（秒）"""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class TunedSQLAlchemyDataLayer(SQLAlchemyDataLayer):
+    """在 SQLAlchemyDataLayer 基础上调优连接池和 SQLite PRAGMA，并统计写入耗时"""
+
+    def __init__(
+        self,
+        conninfo,
+        pragmas=None,
+        pool_size=5,
+        max_overflow=5,
+        pool_timeout=30,
+        write_behind=True,
+        write_behind_interval=0.2,
+        write_behind_max_batch=200,
+        archive_dir=None,
+        **kwargs,
+    ):
+        super().__init__(conninfo=conninfo, **kwargs)
+        # 父类创建引擎时不支持连接池参数，替换为调优后的引擎（此时尚未建立任何连接）
+        self.engine = create_async_engine(
+            conninfo,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+        )
+        self.async_session = sessionmaker(bind=self.engine, expire_on_commit=False, class_=AsyncSession)
+        self._pragmas = pragmas or {}
+        self.archive_dir = archive_dir
+        event.listen(self.engine.sync_engine, "connect", self._apply_pragmas)
+
+        self.write_latency = LatencyStats()
+        self.lock_wait = LatencyStats()
+        self.read_latency = LatencyStats()
+        self.lock_errors = 0
+
+        self.step_buffer = None
+        if write_behind:
+            self.step_buffer = WriteBehindBuffer(
+                self._write_step_batch,
+                interval=write_behind_interval,
+                max_batch=write_behind_max_batch,
+            )
+
+    def _apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in self._pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    async def execute_sql(self, query, parameters):
+        if not query.lstrip().upper().startswith(WRITE_VERBS):
+            start = time.perf_counter()
+            try:
+                return await super().execute_sql(query, parameters)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.read_latency.observe(elapsed)
+                DB_LATENCY.observe(elapsed, operation="read")
+
+        start = time.perf_counter()
+        async with self.async_session() as session:
+            try:
+                connection = await session.connection()
+                # 先拿写锁：等待时间即锁竞争时间，之后的写入不会再因锁失败
+                lock_start = time.perf_counter()
+                await connection.exec_driver_sql("BEGIN IMMEDIATE")
+                self._observe_lock_wait(time.perf_counter() - lock_start)
+
+                result = await session.execute(text(query), parameters)
+                await session.commit()
+                if result.returns_rows:
+                    return self.clean_result([dict(row._mapping) for row in result.fetchall()])
+                return result.rowcount
+            except SQLAlchemyError as e:
+                await session.rollback()
+                if "database is locked" in str(e):
+                    self.lock_errors += 1
+                logger.warning(f"An error occurred: {e}")
+                return None
+            except Exception as e:
+                await session.rollback()
+                logger.warning(f"An unexpected error occurred: {e}")
+                return None
+            finally:
+                self._observe_write(time.perf_counter() - start, "write")
+
+    async def execute_batch(self, statements):
+        """在一个事务中执行多条写语句，成功返回 True"""
+        start = time.perf_counter()
+        async with self.async_session() as session:
+            try:
+                connection = await session.connection()
+                lock_start = time.perf_counter()
+                await connection.exec_driver_sql("BEGIN IMMEDIATE")
+                self._observe_lock_wait(time.perf_counter() - lock_start)
+                for query, parameters in statements:
+                    await session.execute(text(query), parameters)
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                if "database is locked" in str(e):
+                    self.lock_errors += 1
+                logger.warning(f"Batch write failed: {e}")
+                return False
+            finally:
+                self._observe_write(time.perf_counter() - start, "batch_write")
+
+    def _observe_lock_wait(self, seconds):
+        self.lock_wait.observe(seconds)
+        DB_LATENCY.observe(seconds, operation="lock_wait")
+
+    def _observe_write(self, seconds, operation):
+        self.write_latency.observe(seconds)
+        DB_LATENCY.observe(seconds, operation=operation)
+
+    ###### 步骤写回 ######
+    @queue_until_user_message()
+    async def create_step(self, step_dict):
+        if self.step_buffer is None:
+            return await super().create_step(step_dict)
+        self.step_buffer.put(step_dict["id"], dict(step_dict), _merge_step)
+
+    @queue_until_user_message()
+    async def update_step(self, step_dict):
+        if self.step_buffer is None:
+            return await super().update_step(step_dict)
+        self.step_buffer.put(step_dict["id"], dict(step_dict), _merge_step)
+
+    @queue_until_user_message()
+    async def delete_step(self, step_id):
+        if self.step_buffer is not None:
+            self.step_buffer.discard(step_id)
+            await self.flush_writes()
+        return await super().delete_step(step_id)
+
+    async def get_step(self, step_id):
+        await self.flush_writes()
+        return await super().get_step(step_id)
+
+    async def get_all_user_threads(self, user_id=None, thread_id=None):
+        # 读取会话（列表、恢复）之前先落库，保证读到最新的步骤
+        await self.flush_writes()
+        return await super().get_all_user_threads(user_id=user_id, thread_id=thread_id)
+
+    async def delete_thread(self, thread_id):
+        await self.flush_writes()
+        archived = await self._get_archive_path(thread_id)
+        result = await super().delete_thread(thread_id)
+        if archived:
+            await self.execute_sql('DELETE FROM archived_threads WHERE "threadId" = :id', {"id": thread_id})
+            try:
+                os.remove(archived)
+            except OSError as e:
+                logger.warning(f"Failed to remove archive {archived}: {e}")
+        return result
+
+    ###### 归档会话 ######
+    async def get_thread(self, thread_id):
+        thread = await super().get_thread(thread_id)
+        if not thread:
+            return thread
+        archived = await self._get_archive_path(thread_id)
+        if archived:
+            try:
+                record = await asyncio.to_thread(read_archive, archived)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to read archive {archived}: {e}")
+                return thread
+            # 归档的内容都早于数据库中（恢复后新增）的步骤；保留策略分批删除期间
+            # 同一行可能同时在归档和数据库中，以数据库为准
+            steps, elements = archived_thread_items(record)
+            step_ids = {step["id"] for step in thread["steps"]}
+            element_ids = {element["id"] for element in thread["elements"] or []}
+            thread["steps"] = [step for step in steps if step["id"] not in step_ids] + thread["steps"]
+            thread["elements"] = [element for element in elements if element["id"] not in element_ids] + (
+                thread["elements"] or []
+            )
+        return thread
+
+    async def _get_archive_path(self, thread_id):
+        if not self.archive_dir:
+            return None
+        rows = await self.execute_sql(
+            'SELECT "path" FROM archived_threads WHERE "threadId" = :id', {"id": thread_id}
+        )
+        if not rows:
+            return None
+        return os.path.join(self.archive_dir, rows[0]["path"])
+
+    async def flush_writes(self):
+        """立即写入缓冲区中的步骤"""
+        if self.step_buffer is not None:
+            # 缓冲区为空时也要等待正在进行的批量写入完成
+            await self.step_buffer.flush()
+
+    async def _write_step_batch(self, steps):
+        now = await self.get_current_timestamp()
+        statements = [
+            (
+                'INSERT INTO threads ("id", "createdAt", "metadata") VALUES (:id, :createdAt, :metadata) '
+                'ON CONFLICT ("id") DO NOTHING',
+                {"id": thread_id, "createdAt": now, "metadata": "{}"},
+            )
+            for thread_id in dict.fromkeys(s["threadId"] for s in steps if s.get("threadId"))
+        ]
+        statements.extend(_step_upsert(step) for step in steps)
+        if not await self.execute_batch(statements):
+            # 批量事务失败时逐条重试，避免一条坏数据拖累整批
+            for query, parameters in statements:
+                await self.execute_sql(query, parameters)
+
+    async def close(self):
+        if self.step_buffer is not None:
+            await self.step_buffer.close()
+        await super().close()
+
+    def get_stats(self):
+        pool = self.engine.sync_engine.pool
+        return {
+            "write_latency": self.write_latency.to_dict(),
+            "lock_wait": self.lock_wait.to_dict(),
+            "read_latency": self.read_latency.to_dict(),
+            "lock_errors": self.lock_errors,
+            "pool": pool.status(),
+            "write_behind": self.step_buffer.get_stats() if self.step_buffer else None,
+        }
+
+
+def _merge_step(previous, step_dict):
+    """合并同一步骤的多次写入：后写入的非空字段覆盖之前的值"""
+    merged = dict(previous)
+    merged.update((key, value) for key, value in step_dict.items() if value is not None)
+    return merged
+
+
+def _step_upsert(step_dict):
+    """构造单个步骤的 upsert 语句（与 SQLAlchemyDataLayer.create_step 一致）"""
+    step_dict = dict(step_dict)
+    step_dict["showInput"] = (
+        str(step_dict.get("showInput", "")).lower() if "showInput" in step_dict else None
+    )
+    parameters = {
+        key: value
+        for key, value in step_dict.items()
+        if value is not None and not (isinstance(value, dict) and not value)
+    }
+    parameters["metadata"] = json.dumps(step_dict.get("metadata", {}))
+    parameters["generation"] = json.dumps(step_dict.get("generation", {}))
+    columns = ", ".join(f'"{key}"' for key in parameters.keys())
+    values = ", ".join(f":{key}" for key in parameters.keys())
+    updates = ", ".join(f'"{key}" = :{key}' for key in parameters.keys() if key != "id")
+    query = f"""
+        INSERT INTO steps ({columns})
+        VALUES ({values})
+        ON CONFLICT (id) DO UPDATE
+        SET {updates};
+    """
+    return query, parameters
+
+
+_data_layer = None
+
+
+def get_shared_data_layer():
+    """返回进程内唯一的数据层实例"""
+    global _data_layer
+    if _data_layer is None:
+        config = get_data_layer_config()
+        _data_layer = TunedSQLAlchemyDataLayer(
+            conninfo=config["conninfo"],
+            pragmas=config["pragmas"],
+            pool_size=config["pool_size"],
+            max_overflow=config["max_overflow"],
+            pool_timeout=config["pool_timeout"],
+            write_behind=config["write_behind"],
+            write_behind_interval=config["write_behind_interval"],
+            write_behind_max_batch=config["write_behind_max_batch"],
+            archive_dir=config["archive_dir"],
+            storage_provider=None,
+        )
+    return _data_layer
+
+
+async def close_shared_data_layer():
+    """关闭数据层连接池（进程退出时调用）"""
+    global _data_layer
+    if _data_layer is not None:
+        layer, _data_layer = _data_layer, None
+        await layer.close()
+
+
+def _write_behind_depth():
+    if _data_layer is None or _data_layer.step_buffer is None:
+        return 0
+    return _data_layer.step_buffer.depth
+
+
+registry.gauge("db_write_behind_depth", "写回缓冲区中等待落库的步骤数", _write_behind_depth)
+registry.gauge("db_lock_errors", "写入时遇到 database is locked 的次数", lambda: _data_layer.lock_errors if _data_layer else 0)
@@ -0,0 +1,102 @@
+"""Langflow 后端的共享 HTTP 会话与 NDJSON 事件读取
+
+- 进程内共享一个 aiohttp.ClientSession，复用 TCP/TLS 连接，限制连接数
+- iter_ndjson_events 按字节缓冲读取响应体：事件被拆分到多次读取时也能正确拼接，
+  超长事件会被丢弃而不是让整个流失败，解析 JSON 之前先做廉价的预检查
+"""
+
+import json
+
+import aiohttp
+
+from config.chat_settings import get_langflow_pool_config
+
+_session = None
+
+
+def get_langflow_session():
+    """返回进程内共享的 aiohttp 会话（需在事件循环中调用）"""
+    global _session
+    if _session is None or _session.closed:
+        config = get_langflow_pool_config()
+        connector = aiohttp.TCPConnector(
+            limit=config["max_connections"],
+            limit_per_host=config["max_connections_per_host"],
+            keepalive_timeout=config["keepalive_timeout"],
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=config["connect_timeout"]),
+        )
+    return _session
+
+
+async def close_langflow_session():
+    """关闭共享会话（进程退出时调用）"""
+    global _session
+    if _session is not None:
+        session, _session = _session, None
+        await session.close()
+
+
+async def iter_ndjson_events(content, max_event_bytes=1024 * 1024, read_size=64 * 1024):
+    """从 aiohttp 响应体中逐个读取 NDJSON 事件
+
+    Args:
+        content: aiohttp.StreamReader（response.content）
+        max_event_bytes: 单个事件的最大字节数，超过的事件会被丢弃
+        read_size: 每次读取的最大字节数
+
+    Yields:
+        dict: 解析后的事件
+    """
+    buffer = b""
+    oversized = False  # 正在丢弃一个超长事件，直到遇到下一个换行
+    while True:
+        data = await content.read(read_size)
+        if not data:
+            break
+        if oversized:
+            # 丢弃超长事件的剩余部分，直到遇到换行
+            end = data.find(b"\n")
+            if end == -1:
+                continue
+            data = data[end + 1:]
+            oversized = False
+        buffer += data
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = buffer[start:end]
+            start = end + 1
+            if len(line) > max_event_bytes:
+                print(f"⚠️ 丢弃超长事件（超过 {max_event_bytes} 字节）", flush=True)
+                continue
+            event = _parse_line(line)
+            if event is not None:
+                yield event
+        buffer = buffer[start:]
+        if len(buffer) > max_event_bytes:
+            print(f"⚠️ 丢弃超长事件（超过 {max_event_bytes} 字节）", flush=True)
+            buffer = b""
+            oversized = True
+
+    if buffer and not oversized:
+        event = _parse_line(buffer)
+        if event is not None:
+            yield event
+
+
+def _parse_line(line):
+    line = line.strip()
+    # 预检查：空行、心跳等不是 JSON 对象的行直接跳过，不做 JSON 解析
+    if not line or line[0] != 0x7B or b'"event"' not in line:  # 0x7B == "{"
+        return None
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        print(f"解析失败的行: {line[:200]!r}, 错误: {e}", flush=True)
+        return None
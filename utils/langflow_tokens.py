@@ -0,0 +1,123 @@
+"""Langflow token 事件处理
+
+Langflow 的 token 事件偶尔带有二次转义的 \\uXXXX 序列。旧代码对整个 chunk 调用
+encode().decode('unicode_escape')，会把 chunk 中已有的中文等非 ASCII 文本按
+latin-1 重新解码成乱码。这里只解码 \\uXXXX 序列本身（包括代理对），
+转义序列被拆分到两个 chunk 时会暂存尾部，再交给 ThinkStreamParser 分流。
+"""
+
+import re
+from json.decoder import scanstring
+
+from .thinking_utils import ThinkStreamParser
+
+# 连续的 \uXXXX 序列；前面的反斜杠为偶数个（含 0 个）时才是转义，奇数个说明 \u 的反斜杠本身被转义了
+_ESCAPE_RUN = re.compile(r"(?<!\\)((?:\\\\)*)((?:\\u[0-9a-fA-F]{4})+)")
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+
+def _decode_run(match):
+    # 一次解码连续的转义，UTF-16 解码时合并代理对，孤立的代理项替换为 U+FFFD
+    return match[1] + bytes.fromhex(match[2].replace("\\u", "")).decode("utf-16-be", "replace")
+
+
+def _escaped(text, index):
+    """text[index] 的反斜杠前面是否有奇数个反斜杠，即它本身被转义了"""
+    start = index
+    while start and text[start - 1] == "\\":
+        start -= 1
+    return (index - start) % 2 == 1
+
+
+def _is_high_surrogate(text, index):
+    # text[index:index + 6] 为 \uD800-\uDBFF
+    return (
+        text[index + 2] in "dD" and text[index + 3] in "89abAB" and text[index + 1] == "u"
+        and _HEX_DIGITS.issuperset(text[index + 4:index + 6])
+    )
+
+
+def _partial_escape_start(chunk):
+    """chunk 末尾未完整的转义的起点，没有时返回 len(chunk)
+
+    只看最后 6 个字符中的最后一个反斜杠，用字符串比较代替正则。反斜杠本身被转义时
+    （前面有奇数个反斜杠）后面的内容是普通文本，没有待定的转义。
+    """
+    end = len(chunk)
+    index = chunk.rfind("\\", end - 6 if end > 6 else 0)
+    if index < 0:
+        return end
+    if index == end - 6:
+        # 末尾是完整的 6 个字符：只有代理对的前半个需要等待后半个
+        return index if _is_high_surrogate(chunk, index) and not _escaped(chunk, index) else end
+    rest = chunk[index + 1:]
+    if rest and (rest[0] != "u" or not _HEX_DIGITS.issuperset(rest[1:])):
+        return end  # 其他转义（\n 等）
+    # 单独的反斜杠或不完整的 \uXXXX
+    if _escaped(chunk, index):
+        return end
+    if index >= 6 and chunk[index - 6] == "\\" and _is_high_surrogate(chunk, index - 6) and not _escaped(chunk, index - 6):
+        # 前面紧接着代理对的前半个，一起暂存
+        return index - 6
+    return index
+
+
+def decode_escapes(text):
+    """解码文本中的 \\uXXXX 序列，其余内容（包括 \\n 等其他转义和被转义的反斜杠）原样保留
+
+    文本中的反斜杠都属于 \\u 时（最常见的情况），交给 json 的 C 实现 scanstring 解码，
+    它同时合并代理对；否则（有被转义的反斜杠、其他转义或不合法的 \\u）用正则逐段解码。
+    """
+    if "\\u" not in text:
+        return text
+    if text.count("\\") == text.count("\\u"):
+        try:
+            # 补上结尾的引号，文本中的引号转义后原样保留；strict=False 允许换行等控制字符
+            decoded = scanstring(text.replace('"', '\\"') + '"', 0, False)[0]
+        except ValueError:
+            pass  # \\u 后不是 4 位十六进制数
+        else:
+            if "\\ud" in text or "\\uD" in text:
+                try:
+                    decoded.encode("utf-8")
+                except UnicodeEncodeError:
+                    # 孤立的代理项替换为 U+FFFD
+                    decoded = decoded.encode("utf-16-le", "surrogatepass").decode("utf-16-le", "replace")
+            return decoded
+    return _ESCAPE_RUN.sub(_decode_run, text)
+
+
+class LangflowTokenPipeline:
+    """Langflow token 处理流水线：转义解码 + <think> 分流，每个响应创建一个实例
+
+    feed/flush 返回 (类型, 文本) 片段，类型为 THINKING 或 ANSWER。
+    """
+
+    __slots__ = ("_parser", "_tail")
+
+    def __init__(self):
+        self._parser = ThinkStreamParser()
+        self._tail = ""
+
+    def feed(self, chunk):
+        """处理一个 token 事件的 chunk"""
+        if self._tail:
+            chunk = self._tail + chunk
+            self._tail = ""
+        # 快速路径：没有反斜杠的 chunk 无需解码
+        if "\\" in chunk:
+            start = _partial_escape_start(chunk)
+            if start < len(chunk):
+                self._tail = chunk[start:]
+                chunk = chunk[:start]
+            chunk = decode_escapes(chunk)
+        return self._parser.feed(chunk)
+
+    def flush(self):
+        """流结束时调用，输出暂存的尾部"""
+        segments = []
+        if self._tail:
+            tail, self._tail = self._tail, ""
+            segments.extend(self._parser.feed(decode_escapes(tail)))
+        segments.extend(self._parser.flush())
+        return segments
@@ -0,0 +1,246 @@
+"""流式 Markdown 修正
+
+模型经常把代码块的开始标记直接接在句子后面（"如下：```python"），或者把结束标记
+接在代码行末尾、把后续正文接在结束标记后面，前端渲染时整段回答都会变成代码或
+代码块无法识别。以前靠系统提示词要求模型在 ``` 前空一行，每轮都要为这段提示词
+付出 token 和预填充时间，模型仍会偶尔忽略。
+
+MarkdownStreamNormalizer 在回答流中逐段修正这些问题。普通文本立即输出，只有可能
+构成代码块标记或标题的少量字符会暂存，暂存长度不超过 lookahead 个字符。
+"""
+
+import re
+
+# 行首：缩进 + 可能的代码块标记或标题标记
+_LINE_PREFIX = re.compile(r"([ \t]*)(`+|~+|#+)?")
+# 行中出现 ``` 时，其后的语言标识（到行尾）
+_INFO_STRING = re.compile(r"[\w+#.-]*[ \t]*")
+_BLANKS = re.compile(r"[ \t]*")
+_SCAN = {"`": re.compile(r"[`\n]"), "~": re.compile(r"[~\n]")}
+# 内容本身是 Markdown 的代码块中可能嵌套代码块，不修正其中的结束标记
+_MARKDOWN_LANGS = frozenset(("markdown", "md"))
+
+
+class MarkdownStreamNormalizer:
+    """修正流式回答中的 Markdown 格式，每个回答创建一个实例
+
+    - 代码块开始标记（```lang）接在文字后面时换行，并保证前面有一个空行
+    - 行首的开始标记前一行不是空行时补一个空行
+    - 代码块内结束标记接在代码行末尾时换行，结束标记后接着正文时把正文移到新段落
+    - "##标题" 补上 # 后的空格
+    - 流结束时补上未闭合的代码块
+
+    Args:
+        lookahead: 最多暂存的字符数，超过后按普通文本输出
+    """
+
+    __slots__ = ("_lookahead", "_pending", "_line_start", "_line_text", "_prev_blank", "_fence", "_nested", "_inline", "_hold_from", "fixes")
+
+    def __init__(self, lookahead=32):
+        self._lookahead = lookahead
+        self._pending = ""
+        self._line_start = True
+        self._line_text = False  # 当前行是否已输出非空白字符
+        self._prev_blank = True  # 上一行是否为空行，回答开头视为空行
+        self._fence = None  # 代码块内：(标记字符, 标记长度, 语言)
+        self._nested = 0  # Markdown 代码块内嵌套的代码块层数
+        self._inline = 0  # 未闭合的行内代码的反引号个数
+        self._hold_from = 0
+        self.fixes = 0  # 修正次数
+
+    @property
+    def held(self):
+        """当前暂存、尚未输出的字符数"""
+        return len(self._pending)
+
+    def feed(self, text):
+        """处理一段回答文本，返回可以立即输出的部分"""
+        if not text:
+            return ""
+        # 快速路径：行中的普通文本原样输出
+        if not self._pending and not self._line_start and "\n" not in text and "`" not in text and "~" not in text:
+            if not self._line_text and not text.isspace():
+                self._line_text = True
+            return text
+        self._pending += text
+        return self._process(final=False)
+
+    def flush(self):
+        """流结束（或被取消）时调用，输出暂存的内容并闭合未结束的代码块"""
+        out = self._process(final=True)
+        if self._fence:
+            char, length, _ = self._fence
+            out += ("" if self._line_start else "\n") + char * length + "\n"
+            self._fence = None
+            self.fixes += 1
+        return out
+
+    def _process(self, final):
+        text, out = self._pending, []
+        position = 0
+        while position < len(text):
+            step = self._line_start_step if self._line_start else self._inline_step
+            position = step(text, position, final, out)
+            if position is None:
+                # 需要更多字符才能判断，保留未处理的部分
+                self._pending = text[self._hold_from:]
+                return "".join(out)
+        self._pending = ""
+        return "".join(out)
+
+    def _wait(self, text, start, end, final):
+        """扫描到已收到文本的末尾时是否暂存等待：只看标记起点之后 lookahead 个字符，流结束时不再等待"""
+        if final or end < len(text) or end - start >= self._lookahead:
+            return False
+        self._hold_from = start
+        return True
+
+    def _line_start_step(self, text, start, final, out):
+        limit = start + self._lookahead
+        match = _LINE_PREFIX.match(text, start, limit)
+        end = match.end()
+        if self._wait(text, start, end, final):
+            return None
+        indent, marker = match.groups()
+
+        if self._fence:
+            char, length, lang = self._fence
+            if marker and marker[0] == char and lang in _MARKDOWN_LANGS and len(marker) >= 3:
+                return self._markdown_fence_line(text, start, end, final, out)
+            if marker and marker[0] == char and len(marker) >= length and lang not in _MARKDOWN_LANGS:
+                after = _BLANKS.match(text, end, limit).end()
+                if self._wait(text, start, after, final):
+                    return None
+                if after < min(len(text), limit) and text[after] != "\n":
+                    # 结束标记后直接接着正文
+                    out.append(text[start:end] + "\n\n")
+                    self._fence = None
+                    self._line_text, self._prev_blank = False, True
+                    self.fixes += 1
+                    return after
+            # 代码行或正常的结束标记，由 _inline_step 输出
+            self._line_start = False
+            return start
+
+        if marker and marker[0] in "`~" and len(marker) >= 3:
+            newline = text.find("\n", end, limit)
+            if newline < 0 and self._wait(text, start, len(text), final):
+                return None
+            self._line_start = False
+            if newline < 0 and len(text) >= limit:
+                # 窗口内没有换行，不是代码块标记
+                return start
+            info_end = newline if newline >= 0 else len(text)
+            info = text[end:info_end]
+            if marker[0] == "`" and "`" in info:
+                # 一行内的 ```code```，是行内代码
+                return start
+            if not self._prev_blank:
+                out.append("\n")
+                self.fixes += 1
+            out.append(text[start:info_end])
+            self._fence = (marker[0], len(marker), (info.split() or [""])[0].lower())
+            self._nested = 0
+            self._line_text = True
+            return info_end
+
+        self._line_start = False
+        if marker and marker[0] == "#" and 2 <= len(marker) <= 6 and len(indent) <= 3:
+            if end < min(len(text), limit) and text[end] not in " \t\n#":
+                out.append(text[start:end] + " ")
+                self._line_text = True
+                self.fixes += 1
+                return end
+        return start
+
+    def _markdown_fence_line(self, text, start, end, final, out):
+        """Markdown 代码块内行首的代码块标记：带语言的是嵌套代码块的开始，不带语言的结束最内层的代码块
+
+        嵌套的代码块原样输出，不做任何修正；没有嵌套时不带语言的标记由 _inline_step 作为结束标记处理。
+        """
+        limit = start + self._lookahead
+        newline = text.find("\n", end, limit)
+        if newline < 0 and self._wait(text, start, len(text), final):
+            return None
+        self._line_start = False
+        if newline < 0 and len(text) >= limit:
+            # 窗口内没有换行，按代码块内容处理
+            out.append(text[start:end])
+            self._line_text = True
+            return end
+        line_end = newline if newline >= 0 else len(text)
+        if text[end:line_end].strip():
+            self._nested += 1
+        elif self._nested:
+            self._nested -= 1
+        else:
+            return start
+        out.append(text[start:line_end])
+        self._line_text = True
+        return line_end
+
+    def _inline_step(self, text, start, final, out):
+        char = self._fence[0] if self._fence else "`"
+        match = _SCAN[char].search(text, start)
+        end = match.start() if match else len(text)
+        if end > start:
+            chunk = text[start:end]
+            out.append(chunk)
+            if not self._line_text and not chunk.isspace():
+                self._line_text = True
+            return end
+
+        if text[start] == "\n":
+            out.append("\n")
+            self._prev_blank = not self._line_text
+            self._line_start, self._line_text = True, False
+            self._inline = 0
+            return start + 1
+
+        limit = start + self._lookahead
+        bound = min(len(text), limit)
+        end = start
+        while end < bound and text[end] == char:
+            end += 1
+        if self._wait(text, start, end, final):
+            return None
+        run = end - start
+
+        if self._fence:
+            _, length, lang = self._fence
+            # Markdown 代码块的内容原样输出，只有行首的结束标记（由 _markdown_fence_line 判断）才结束它
+            if run >= length and not (lang in _MARKDOWN_LANGS and self._line_text):
+                after = _BLANKS.match(text, end, limit).end()
+                if self._wait(text, start, after, final):
+                    return None
+                if after == len(text) < limit or (after < bound and text[after] == "\n"):
+                    if self._line_text:
+                        # 结束标记接在代码行末尾
+                        out.append("\n")
+                        self.fixes += 1
+                    out.append(text[start:end])
+                    self._fence = None
+                    self._line_text = True
+                    return end
+        elif self._inline:
+            if run == self._inline:
+                self._inline = 0
+        elif run >= 3:
+            after = _INFO_STRING.match(text, end, limit).end()
+            if self._wait(text, start, after, final):
+                return None
+            if after < bound and text[after] == "\n":
+                # 开始标记接在文字后面
+                info = text[end:after]
+                out.append("\n\n" + text[start:after])
+                self._fence = ("`", run, (info.split() or [""])[0].lower())
+                self._nested = 0
+                self._line_text = True
+                self.fixes += 1
+                return after
+            self._inline = run
+        else:
+            self._inline = run
+        out.append(text[start:end])
+        self._line_text = True
+        return end
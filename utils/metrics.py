@@ -0,0 +1,343 @@
+"""延迟指标与 Prometheus 文本格式导出
+
+- Histogram / Counter：按标签分组的进程内指标，无第三方依赖
+- RequestTrace：记录一次聊天请求的首 token、首个回答 token、token/s、流耗时，
+  结束时写入直方图，并可选写入 JSONL 追踪文件
+- install_metrics_endpoint：在 Chainlit 的 FastAPI 应用上挂载 /metrics
+"""
+
+import bisect
+import hmac
+import ipaddress
+import json
+import threading
+import time
+
+from config.chat_settings import get_metrics_config
+
+from .thinking_utils import THINKING
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """按标签分组的直方图"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # 标签值 -> [各桶计数..., +Inf 计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """按标签分组的计数器"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表；gauge 在导出时通过回调取值"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._gauges = {}
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, help_text, label_names, buckets)
+        return self._metrics[name]
+
+    def counter(self, name, help_text, label_names=()):
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, help_text, label_names)
+        return self._metrics[name]
+
+    def gauge(self, name, help_text, func):
+        """注册一个 gauge，func 返回数值或 {标签字典的元组: 数值}"""
+        self._gauges[name] = (help_text, func)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for name, (help_text, func) in self._gauges.items():
+            try:
+                value = func()
+            except Exception as e:
+                print(f"❌ 读取指标 {name} 失败: {e}", flush=True)
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for labels, item in value.items():
+                    names = [label for label, _ in labels]
+                    values = [label_value for _, label_value in labels]
+                    lines.append(f"{name}{_format_labels(names, values)} {_format_value(item)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CHAT_TTFT = registry.histogram(
+    "chat_time_to_first_token_seconds", "请求开始到第一个 token（含思考）的时间", ("backend", "model")
+)
+CHAT_TTFA = registry.histogram(
+    "chat_time_to_first_answer_token_seconds", "请求开始到第一个回答 token 的时间", ("backend", "model")
+)
+CHAT_DURATION = registry.histogram(
+    "chat_stream_duration_seconds", "一次回复的总耗时", ("backend", "model", "status")
+)
+CHAT_TOKENS_PER_SECOND = registry.histogram(
+    "chat_tokens_per_second", "首 token 之后的输出速度（chunk/s）", ("backend", "model"), RATE_BUCKETS
+)
+CHAT_TOKENS = registry.counter("chat_tokens_total", "输出的 token（chunk）总数", ("backend", "model", "kind"))
+CHAT_CANCELLED = registry.counter(
+    "chat_cancelled_total", "用户停止或断开连接而取消的回复数", ("backend", "model", "reason")
+)
+CHAT_TOKENS_SAVED = registry.counter(
+    "chat_cancelled_tokens_saved_total", "取消后上游不再生成的 token（chunk）数（按近期完整回复的平均长度估计）",
+    ("backend", "model"),
+)
+TITLE_LATENCY = registry.histogram("title_generation_seconds", "标题生成耗时", ("model", "status"))
+DB_LATENCY = registry.histogram("db_operation_seconds", "数据库操作耗时", ("operation",))
+
+
+# (backend, model) -> 近期完整回复的平均 token（chunk）数，指数移动平均
+_completion_sizes = {}
+_COMPLETION_SIZE_ALPHA = 0.1
+
+
+class _TraceWriter:
+    """JSONL 追踪文件（按行追加，多线程安全）"""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_trace_writer = None
+_trace_writer_loaded = False
+
+
+def _get_trace_writer():
+    global _trace_writer, _trace_writer_loaded
+    if not _trace_writer_loaded:
+        _trace_writer_loaded = True
+        path = get_metrics_config()["trace_file"]
+        if path:
+            _trace_writer = _TraceWriter(path)
+    return _trace_writer
+
+
+def close_metrics():
+    """关闭追踪文件（进程退出时调用）"""
+    global _trace_writer
+    if _trace_writer is not None:
+        writer, _trace_writer = _trace_writer, None
+        writer.close()
+
+
+class RequestTrace:
+    """一次聊天请求的计时
+
+    用法：请求开始时创建，每个输出片段调用 on_token(kind)，结束时调用 finish()，
+    被用户停止或断开连接时调用 cancel(reason)。
+    """
+
+    __slots__ = ("backend", "model", "start", "first_token", "first_answer", "tokens", "thinking_tokens", "extra")
+
+    def __init__(self, backend, model):
+        self.backend = backend
+        self.model = model
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.first_answer = None
+        self.tokens = 0
+        self.thinking_tokens = 0
+        self.extra = {}
+
+    def on_token(self, kind):
+        now = None
+        if self.first_token is None:
+            now = time.perf_counter()
+            self.first_token = now
+        if kind == THINKING:
+            self.thinking_tokens += 1
+        else:
+            self.tokens += 1
+            if self.first_answer is None:
+                self.first_answer = now or time.perf_counter()
+
+    def finish(self, status="ok"):
+        """写入直方图和追踪文件，返回本次请求的记录"""
+        end = time.perf_counter()
+        labels = {"backend": self.backend, "model": self.model}
+        record = {
+            "ts": time.time(),
+            **labels,
+            "status": status,
+            "duration": round(end - self.start, 4),
+            "ttft": None,
+            "ttfa": None,
+            "tokens": self.tokens,
+            "thinking_tokens": self.thinking_tokens,
+            "tokens_per_second": None,
+            **self.extra,
+        }
+        CHAT_DURATION.observe(end - self.start, status=status, **labels)
+        if self.first_token is not None:
+            record["ttft"] = round(self.first_token - self.start, 4)
+            CHAT_TTFT.observe(self.first_token - self.start, **labels)
+            total = self.tokens + self.thinking_tokens
+            if total > 1 and end > self.first_token:
+                rate = (total - 1) / (end - self.first_token)
+                record["tokens_per_second"] = round(rate, 2)
+                CHAT_TOKENS_PER_SECOND.observe(rate, **labels)
+        if self.first_answer is not None:
+            record["ttfa"] = round(self.first_answer - self.start, 4)
+            CHAT_TTFA.observe(self.first_answer - self.start, **labels)
+        CHAT_TOKENS.inc(self.tokens, kind="answer", **labels)
+        if self.thinking_tokens:
+            CHAT_TOKENS.inc(self.thinking_tokens, kind="thinking", **labels)
+
+        if status == "ok":
+            key = (self.backend, self.model)
+            size = self.tokens + self.thinking_tokens
+            average = _completion_sizes.get(key)
+            _completion_sizes[key] = size if average is None else average + _COMPLETION_SIZE_ALPHA * (size - average)
+
+        writer = _get_trace_writer()
+        if writer is not None:
+            try:
+                writer.write(record)
+            except Exception as e:
+                print(f"❌ 写入追踪文件失败: {e}", flush=True)
+        return record
+
+    def cancel(self, reason):
+        """记录一次取消的回复，并估计因提前断开上游而节省的 token 数"""
+        labels = {"backend": self.backend, "model": self.model}
+        average = _completion_sizes.get((self.backend, self.model))
+        saved = max(0, round(average - self.tokens - self.thinking_tokens)) if average is not None else 0
+        CHAT_CANCELLED.inc(reason=reason, **labels)
+        if saved:
+            CHAT_TOKENS_SAVED.inc(saved, **labels)
+        self.extra["cancel_reason"] = reason
+        self.extra["tokens_saved_estimate"] = saved
+        return self.finish("cancelled")
+
+
+_endpoint_installed = False
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def install_metrics_endpoint():
+    """在 Chainlit 服务上挂载 Prometheus 格式的指标接口（重复调用无副作用）"""
+    global _endpoint_installed
+    config = get_metrics_config()
+    if _endpoint_installed or not config["enabled"]:
+        return
+    _endpoint_installed = True
+
+    from chainlit.server import app
+    from fastapi import HTTPException, Request
+    from fastapi.responses import PlainTextResponse
+
+    # 指标中有上游地址、各模型流量和数据库耗时，不能对能访问聊天界面的所有人公开
+    expected = f"Bearer {config['token']}".encode("utf-8") if config["token"] else None
+    if expected is None:
+        print(f"🔒 未设置 METRICS_TOKEN，{config['path']} 只允许本机访问", flush=True)
+
+    async def metrics(request: Request):
+        if expected is not None:
+            supplied = request.headers.get("authorization", "").encode("utf-8")
+            if not hmac.compare_digest(supplied, expected):
+                raise HTTPException(status_code=401, detail="需要 METRICS_TOKEN", headers={"WWW-Authenticate": "Bearer"})
+        elif not _is_loopback(request.client.host if request.client else None):
+            raise HTTPException(status_code=403, detail="只允许本机访问")
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+    app.add_api_route(config["path"], metrics, methods=["GET"], include_in_schema=False)
+    # Chainlit 最后注册了匹配所有路径的前端路由，新路由需要移到最前面才能生效
+    app.router.routes.insert(0, app.router.routes.pop())
@@ -0,0 +1,204 @@
+"""模型回复缓存（可选）
+
+很多用户发送相同的开场问题，温度也常被调到 0，这些请求每次都会访问上游模型。
+ResponseCache 以 (实际生成回复的模型, 温度, 规范化后的消息列表) 为键缓存完整回复：
+
+- 内存 LRU 作为一级缓存
+- SQLite 表作为二级缓存，支持 TTL 和按总大小淘汰（总大小在内存中累计，写入时不必
+  重新统计整张表；过期条目每分钟最多清理一次）
+- 命中时由调用方按正常流式路径回放（包括思考内容）
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .thinking_utils import ANSWER, THINKING
+
+# 两次清理过期条目之间的最短间隔（秒）
+PURGE_INTERVAL = 60
+# 行尾的空格和制表符
+_TRAILING_SPACES = re.compile(r"[ \t]+$", re.MULTILINE)
+
+
+def _normalize_content(content):
+    """只去掉首尾空白和行尾空格；换行和缩进保留在键中，代码或表格排版不同的问题不会共用回复"""
+    return _TRAILING_SPACES.sub("", content.strip())
+
+
+def make_cache_key(model_name, temperature, messages):
+    """根据模型、温度和规范化后的消息列表生成缓存键"""
+    normalized = [[message["role"], _normalize_content(message.get("content") or "")] for message in messages]
+    payload = json.dumps([model_name, round(float(temperature), 4), normalized], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def replay_segments(thinking, answer, chunk_size=64):
+    """把缓存的回复切成 (类型, 文本) 片段，按正常流式路径回放"""
+    for kind, text in ((THINKING, thinking), (ANSWER, answer)):
+        for i in range(0, len(text), chunk_size):
+            yield kind, text[i:i + chunk_size]
+
+
+class ResponseCache:
+    """两级回复缓存
+
+    Args:
+        db_file: SQLite 缓存文件（只由一个进程写入，总大小在打开时统计一次）
+        ttl: 缓存有效期（秒）
+        max_bytes: SQLite 中缓存内容的总大小上限
+        memory_entries: 内存 LRU 的条目数
+    """
+
+    def __init__(self, db_file="response_cache.db", ttl=86400, max_bytes=64 * 1024 * 1024, memory_entries=512):
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (过期时间, thinking, answer)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                thinking TEXT,
+                answer TEXT,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache (last_access)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+        self._next_purge = 0.0
+        self.stats = {"hits": 0, "memory_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bytes_saved": 0}
+
+    @property
+    def hit_ratio(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    async def get(self, key):
+        """查询缓存，命中返回 (thinking, answer)，否则返回 None"""
+        return await self.get_first([key])
+
+    async def get_first(self, keys):
+        """依次查询多个键（例如回复可能来自的多个模型），返回第一个命中的 (thinking, answer)"""
+        now = time.time()
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._hit(entry[1], entry[2])
+
+        for key in keys:
+            row = await asyncio.to_thread(self._db_get, key, now)
+            if row is not None:
+                expires_at, thinking, answer = row
+                self._remember(key, expires_at, thinking, answer)
+                return self._hit(thinking, answer)
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key, thinking, answer):
+        """写入缓存"""
+        if not answer:
+            return
+        expires_at = time.time() + self._ttl
+        self._remember(key, expires_at, thinking or "", answer)
+        self.stats["stores"] += 1
+        evicted = await asyncio.to_thread(self._db_set, key, thinking or "", answer, expires_at)
+        for evicted_key in evicted:
+            self._memory.pop(evicted_key, None)
+        self.stats["evictions"] += len(evicted)
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "hit_ratio": round(self.hit_ratio, 4),
+            "memory_entries": len(self._memory),
+            "db_bytes": self._total_bytes,
+        }
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+    def _hit(self, thinking, answer):
+        self.stats["hits"] += 1
+        self.stats["bytes_saved"] += len(thinking.encode("utf-8")) + len(answer.encode("utf-8"))
+        return thinking, answer
+
+    def _remember(self, key, expires_at, thinking, answer):
+        self._memory[key] = (expires_at, thinking, answer)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self._memory_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key, now):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT expires_at, thinking, answer, size FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._total_bytes -= row[3]
+                return None
+            self._conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            return row[:3]
+
+    def _db_set(self, key, thinking, answer, expires_at):
+        size = len(thinking.encode("utf-8")) + len(answer.encode("utf-8"))
+        now = time.time()
+        with self._db_lock:
+            total = self._total_bytes
+            self._conn.execute("BEGIN")
+            try:
+                old = self._conn.execute("SELECT size FROM response_cache WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, thinking, answer, size, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, thinking, answer, size, expires_at, now),
+                )
+                self._total_bytes += size - (old[0] if old else 0)
+                evicted = self._evict(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._total_bytes = total
+                raise
+        return evicted
+
+    def _evict(self, now):
+        """定期删除过期条目，总大小超过上限时按最近访问时间淘汰，返回被淘汰的键"""
+        if now >= self._next_purge:
+            # expires_at 没有索引，清理需要扫描整张表，因此限制频率
+            self._next_purge = now + PURGE_INTERVAL
+            expired = self._conn.execute(
+                "DELETE FROM response_cache WHERE expires_at <= ? RETURNING size", (now,)
+            ).fetchall()
+            self._total_bytes -= sum(size for (size,) in expired)
+        if self._total_bytes <= self._max_bytes:
+            return []
+        excess = self._total_bytes - self._max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM response_cache ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM response_cache WHERE key = ?", victims)
+        self._total_bytes -= freed
+        return [key for (key,) in victims]
@@ -0,0 +1,428 @@
+"""多端点路由与故障转移
+
+同一个逻辑模型可以配置多个 OpenAI 兼容端点（MODEL_ENDPOINTS）。ChatRouter：
+
+- 用滑动窗口记录每个端点的首 token 时间（TTFT）和错误率，优先选择最快的健康端点
+- 在第一个 token 输出之前失败（连接错误、5xx、429、首 token 超时）时换下一个端点重试
+- 连续失败或错误率过高的端点进入熔断冷却，冷却结束后放行一个探测请求
+- 可选的对冲请求：首 token 超过分位数截止时间时向备用端点再发一份，先出 token 者胜出
+- 路由决策和端点状态通过 /metrics 暴露
+"""
+
+import asyncio
+import random
+import statistics
+import time
+from collections import deque
+
+import openai
+
+from .client_pool import get_openai_client
+from .metrics import registry
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+ROUTER_REQUESTS = registry.counter(
+    "router_requests_total", "路由结果：ok / failover / error / cancelled / breaker_open", ("endpoint", "outcome")
+)
+ROUTER_HEDGES = registry.counter(
+    "router_hedges_total", "对冲请求：started / hedge_won / primary_won / budget_exhausted", ("outcome",)
+)
+
+
+def _has_token(chunk):
+    """chunk 是否包含输出内容（忽略只有 role 的首个 chunk）"""
+    if not chunk.choices:
+        return False
+    delta = chunk.choices[0].delta
+    return bool(getattr(delta, "content", None) or getattr(delta, "reasoning_content", None))
+
+
+def is_retryable(error):
+    """端点自身的问题（可以换端点重试，并计入熔断），客户端请求错误除外"""
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+class Endpoint:
+    """一个上游端点及其滑动窗口统计、熔断状态"""
+
+    def __init__(self, name, base_url, api_key, model_name, window=50):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model_name = model_name
+        self.samples = deque(maxlen=window)  # (成功, TTFT 秒或 None)
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.cooldown = 0.0
+        self.consecutive_failures = 0
+        self.in_flight = 0
+        self.probing = False
+
+    @property
+    def client(self):
+        return get_openai_client(self.base_url, self.api_key)
+
+    def ttft_values(self):
+        return [ttft for ok, ttft in self.samples if ok and ttft is not None]
+
+    def ttft_p50(self):
+        values = self.ttft_values()
+        return statistics.median(values) if values else None
+
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for ok, _ in self.samples if not ok) / len(self.samples)
+
+    def to_dict(self):
+        p50 = self.ttft_p50()
+        return {
+            "name": self.name,
+            "model": self.model_name,
+            "state": self.state,
+            "ttft_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "samples": len(self.samples),
+            "in_flight": self.in_flight,
+            "cooldown_s": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == OPEN else 0.0,
+        }
+
+
+class _Attempt:
+    """向一个端点发起的流式请求，读到第一个 token 为止的 chunk 会先缓存"""
+
+    def __init__(self, endpoint, max_retries=None, model=None):
+        self.endpoint = endpoint
+        self.max_retries = max_retries
+        self.model = model or endpoint.model_name
+        self.stream = None
+        self.iterator = None
+        self.buffered = []
+        self.exhausted = False
+        self.started = time.perf_counter()
+        self.ttft = None
+
+    async def start(self, request):
+        client = self.endpoint.client
+        if self.max_retries is not None:
+            client = client.with_options(max_retries=self.max_retries)
+        self.stream = await client.chat.completions.create(
+            model=self.model, stream=True, **request
+        )
+        self.iterator = self.stream.__aiter__()
+        while True:
+            try:
+                chunk = await self.iterator.__anext__()
+            except StopAsyncIteration:
+                self.exhausted = True
+                break
+            self.buffered.append(chunk)
+            if _has_token(chunk):
+                break
+        self.ttft = time.perf_counter() - self.started
+        return self
+
+    async def close(self):
+        if self.stream is not None:
+            try:
+                await self.stream.close()
+            except Exception:
+                pass
+
+
+class ChatRouter:
+    """按 TTFT 和错误率在多个端点间路由流式请求
+
+    Args:
+        endpoints: [{"name", "base_url", "api_key", "model_name"}, ...]，顺序即默认优先级
+        window: 每个端点保留的最近请求数
+        error_threshold: 窗口内错误率达到该值时熔断
+        min_samples: 按错误率熔断前至少需要的样本数
+        failure_threshold: 连续失败多少次熔断
+        cooldown: 首次熔断的冷却时间（秒），探测失败后加倍
+        max_cooldown: 冷却时间上限（秒）
+        first_token_timeout: 等待第一个 token 的超时（秒），超时按失败处理
+        explore: 随机选择次优端点的概率，用来刷新其统计
+        max_in_flight: 每个端点的并发上限，达到上限的端点排在最后（0 表示不限）
+        hedge: 对冲配置（None 表示关闭），包含 percentile、min_delay、max_delay、
+            default_delay、max_rate、burst、model，见 config.chat_settings.get_hedge_config
+    """
+
+    def __init__(
+        self,
+        endpoints,
+        window=50,
+        error_threshold=0.5,
+        min_samples=5,
+        failure_threshold=3,
+        cooldown=30.0,
+        max_cooldown=300.0,
+        first_token_timeout=60.0,
+        explore=0.05,
+        max_in_flight=0,
+        hedge=None,
+    ):
+        self._window = window
+        self._source = None
+        self.endpoints = []
+        self.set_endpoints(endpoints)
+        self._error_threshold = error_threshold
+        self._min_samples = min_samples
+        self._failure_threshold = failure_threshold
+        self._base_cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self.first_token_timeout = first_token_timeout
+        self._explore = explore
+        self._max_in_flight = max_in_flight
+        self._hedge = hedge
+        self._hedge_tokens = hedge["burst"] if hedge else 0.0
+        self._register_gauges()
+
+    def set_endpoints(self, endpoints):
+        """替换端点列表（配置热加载），配置未变的端点保留统计和熔断状态
+
+        传入与上次相同的列表对象时直接返回；进行中的请求继续使用原来的端点。
+        """
+        if endpoints is self._source:
+            return
+        if not endpoints:
+            raise ValueError("至少需要配置一个模型端点")
+        current = {(e.name, e.base_url, e.api_key, e.model_name): e for e in self.endpoints}
+        self.endpoints = [
+            current.get((e["name"], e["base_url"], e["api_key"], e["model_name"]))
+            or Endpoint(window=self._window, **e)
+            for e in endpoints
+        ]
+        self._source = endpoints
+        # 有备用端点时不在客户端内部重试，失败后直接切换端点
+        self._max_retries = 0 if len(self.endpoints) > 1 else None
+
+    def candidates(self):
+        """按优先级返回本次可尝试的端点"""
+        now = time.monotonic()
+        available = []
+        for endpoint in self.endpoints:
+            if endpoint.state == OPEN and now >= endpoint.open_until:
+                endpoint.state = HALF_OPEN
+            if endpoint.state == CLOSED or (endpoint.state == HALF_OPEN and not endpoint.probing):
+                available.append(endpoint)
+
+        if not available:
+            # 全部熔断时仍然尝试最快恢复的端点，避免直接拒绝请求
+            return [min(self.endpoints, key=lambda e: e.open_until)]
+
+        # 没有样本的端点得分为 0，会被优先尝试一次；得分相同时保持配置顺序；
+        # 达到并发上限的端点只在其他端点都失败时使用
+        cap = self._max_in_flight
+        ordered = sorted(available, key=lambda e: (bool(cap) and e.in_flight >= cap, e.ttft_p50() or 0.0))
+        if len(ordered) > 1 and random.random() < self._explore:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+        return ordered
+
+    async def open_stream(self, request):
+        """发起流式请求，返回 (端点, 实际使用的模型名, chunk 异步迭代器)
+
+        在第一个 token 之前失败时自动换端点；之后的错误直接抛给调用方。
+        开启对冲时，若超过截止时间仍没有首 token，会向备用端点（或备用模型）再发一份
+        请求，先出 token 的一方胜出，另一方立即取消。
+        request 为 chat.completions.create 的参数（不含 model 和 stream）。
+        """
+        queue = self.candidates()
+        self._refill_hedge_budget()
+        pending = {}  # task -> (端点, 发起时间, 是否为对冲请求)
+        hedged = False
+        last_error = None
+        try:
+            while queue or pending:
+                if not pending:
+                    primary = queue.pop(0)
+                    pending[asyncio.create_task(self._try(primary, request))] = (primary, time.perf_counter(), False)
+                    deadline = self.hedge_delay(primary) if self._can_hedge(primary, queue) else None
+
+                timeout = deadline if not hedged else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 截止时间内主请求没有首 token：每个请求最多对冲一次
+                    hedged = True
+                    if not self._take_hedge_budget():
+                        ROUTER_HEDGES.inc(outcome="budget_exhausted")
+                        continue
+                    target = queue.pop(0) if queue else primary
+                    model = self._hedge["model"] or None
+                    ROUTER_HEDGES.inc(outcome="started")
+                    print(f"🪝 {deadline:.2f}s 内无首 token，对冲到端点 {target.name}", flush=True)
+                    task = asyncio.create_task(self._try(target, request, model))
+                    pending[task] = (target, time.perf_counter(), True)
+                    continue
+
+                winner = None
+                for task in done:
+                    endpoint, _, is_hedge = pending.pop(task)
+                    result = task.result()
+                    if not isinstance(result, _Attempt):
+                        last_error = result
+                        if not is_retryable(result):
+                            raise result
+                    elif winner is None:
+                        winner = (result, is_hedge)
+                    else:
+                        await self._discard(result)
+                if winner:
+                    attempt, is_hedge = winner
+                    if hedged:
+                        ROUTER_HEDGES.inc(outcome="hedge_won" if is_hedge else "primary_won")
+                    # 输掉的请求至少慢了这么久，记入样本避免低估慢端点的 TTFT
+                    for loser, started, _ in pending.values():
+                        loser.samples.append((True, time.perf_counter() - started))
+                    return attempt.endpoint, attempt.model, self._relay(attempt)
+        finally:
+            for task in pending:
+                task.cancel()
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, _Attempt):
+                    await self._discard(result)
+        raise last_error
+
+    async def _try(self, endpoint, request, model=None):
+        """向一个端点发起请求并等待第一个 token，失败时返回异常"""
+        self._begin(endpoint)
+        attempt = _Attempt(endpoint, self._max_retries, model)
+        try:
+            await asyncio.wait_for(attempt.start(request), self.first_token_timeout)
+        except asyncio.CancelledError:
+            await attempt.close()
+            self._end(endpoint)
+            raise
+        except Exception as e:
+            await attempt.close()
+            self._end(endpoint)
+            if is_retryable(e):
+                self.record_failure(endpoint)
+                ROUTER_REQUESTS.inc(endpoint=endpoint.name, outcome="failover")
+                print(f"⚠️ 端点 {endpoint.name} 在首 token 前失败，尝试下一个: {type(e).__name__}: {e}", flush=True)
+            else:
+                ROUTER_REQUESTS.inc(endpoint=endpoint.name, outcome="error")
+            return e
+        self.record_ttft(endpoint, attempt.ttft)
+        return attempt
+
+    async def _discard(self, attempt):
+        """关闭已经拿到首 token 但没有被采用的请求"""
+        await attempt.close()
+        self._end(attempt.endpoint)
+        ROUTER_REQUESTS.inc(endpoint=attempt.endpoint.name, outcome="cancelled")
+
+    def _can_hedge(self, primary, queue):
+        """是否有可对冲的目标：另一个端点，或与主请求不同的备用模型
+
+        只有一个端点且没有备用模型时，对冲只会向已经变慢的端点再发一份相同的请求，不对冲。
+        """
+        if not self._hedge:
+            return False
+        model = self._hedge["model"]
+        return bool(queue) or bool(model and model != primary.model_name)
+
+    def hedge_delay(self, endpoint):
+        """对冲截止时间：端点窗口内 TTFT 的指定分位数，样本不足时用默认值"""
+        hedge = self._hedge
+        values = sorted(endpoint.ttft_values())
+        if len(values) < self._min_samples:
+            delay = hedge["default_delay"]
+        else:
+            delay = values[min(len(values) - 1, int(len(values) * hedge["percentile"] / 100))]
+        return min(hedge["max_delay"], max(hedge["min_delay"], delay))
+
+    def _refill_hedge_budget(self):
+        # 每个请求补充 max_rate 个对冲额度，长期对冲比例不超过 max_rate
+        if self._hedge:
+            self._hedge_tokens = min(self._hedge["burst"], self._hedge_tokens + self._hedge["max_rate"])
+
+    def _take_hedge_budget(self):
+        if self._hedge_tokens < 1:
+            return False
+        self._hedge_tokens -= 1
+        return True
+
+    async def _relay(self, attempt):
+        endpoint = attempt.endpoint
+        outcome = "cancelled"
+        try:
+            for chunk in attempt.buffered:
+                yield chunk
+            if not attempt.exhausted:
+                async for chunk in attempt.iterator:
+                    yield chunk
+            outcome = "ok"
+        except Exception as e:
+            outcome = "error"
+            if is_retryable(e):
+                self.record_failure(endpoint)
+            raise
+        finally:
+            # 调用方提前停止（GeneratorExit/CancelledError）记为 cancelled，不计入失败；
+            # 先释放探测名额，半开端点可以放行下一个探测请求
+            ROUTER_REQUESTS.inc(endpoint=endpoint.name, outcome=outcome)
+            self._end(endpoint)
+            await attempt.close()
+
+    def _begin(self, endpoint):
+        endpoint.in_flight += 1
+        if endpoint.state == HALF_OPEN:
+            endpoint.probing = True
+
+    def _end(self, endpoint):
+        endpoint.in_flight -= 1
+        endpoint.probing = False
+
+    def record_ttft(self, endpoint, ttft):
+        """首 token 成功到达"""
+        endpoint.samples.append((True, ttft))
+        endpoint.consecutive_failures = 0
+        if endpoint.state != CLOSED:
+            print(f"✅ 端点 {endpoint.name} 探测成功，恢复使用", flush=True)
+            endpoint.state = CLOSED
+            endpoint.cooldown = 0.0
+            # 清除熔断前的失败记录，避免恢复后立即再次熔断
+            endpoint.samples.clear()
+            endpoint.samples.append((True, ttft))
+
+    def record_failure(self, endpoint):
+        endpoint.samples.append((False, None))
+        endpoint.consecutive_failures += 1
+        should_open = (
+            endpoint.state == HALF_OPEN
+            or endpoint.consecutive_failures >= self._failure_threshold
+            or (len(endpoint.samples) >= self._min_samples and endpoint.error_rate() >= self._error_threshold)
+        )
+        if should_open and endpoint.state != OPEN:
+            endpoint.cooldown = min(self._max_cooldown, endpoint.cooldown * 2 or self._base_cooldown)
+            endpoint.state = OPEN
+            endpoint.open_until = time.monotonic() + endpoint.cooldown
+            ROUTER_REQUESTS.inc(endpoint=endpoint.name, outcome="breaker_open")
+            print(f"🔌 端点 {endpoint.name} 熔断 {endpoint.cooldown:.0f}s（错误率 {endpoint.error_rate():.0%}）", flush=True)
+
+    def get_stats(self):
+        return [endpoint.to_dict() for endpoint in self.endpoints]
+
+    def _register_gauges(self):
+        def per_endpoint(func):
+            return lambda: {(("endpoint", e.name),): func(e) for e in self.endpoints}
+
+        registry.gauge(
+            "router_endpoint_state", "端点熔断状态：0 正常，1 探测中，2 熔断",
+            per_endpoint(lambda e: _STATE_VALUES[e.state]),
+        )
+        registry.gauge(
+            "router_endpoint_ttft_p50_seconds", "窗口内首 token 时间中位数",
+            per_endpoint(lambda e: e.ttft_p50() or 0.0),
+        )
+        registry.gauge("router_endpoint_error_rate", "窗口内错误率", per_endpoint(lambda e: e.error_rate()))
+        registry.gauge("router_endpoint_in_flight", "正在进行的请求数", per_endpoint(lambda e: e.in_flight))
@@ -0,0 +1,239 @@
+"""聊天记录全文搜索
+
+索引（search_index，FTS5 trigram）由 migrate_db.py 的迁移 5 创建并由触发器维护。
+每个文档的 rowid 高位是所属用户在 users 表中的 rowid，搜索时用 rowid 范围限定在
+当前用户自己的文档中，匹配的代价只与该用户的数据量有关。
+
+- 长度不少于 3 个字符的词用 MATCH 查询；trigram 无法索引更短的词（例如两个字的中文词），
+  这些词在该用户的文档范围内用 LIKE 过滤
+- 排序只看文档本身：取最近的 candidates 条匹配，按命中次数（BM25 的词频饱和与长度归一化，
+  标题命中权重更高）排序，同分时新的在前。FTS5 自带的 bm25() 需要统计词语在全部用户
+  文档中的出现次数，常见词上代价与整个索引的大小成正比，因此不使用
+- 结果中的摘要已做 HTML 转义，命中部分用 <mark> 标出
+"""
+
+import html
+import time
+
+from config.chat_settings import get_search_config
+
+from .metrics import DB_LATENCY
+
+OWNER_SHIFT = 40
+MIN_MATCH_CHARS = 3  # trigram 分词能索引的最短子串
+# 标记命中位置的私有区字符，转义后替换为 <mark>
+MARK_START, MARK_END = "\ue000", "\ue001"
+SNIPPET_CHARS = 80
+TITLE_WEIGHT = 4.0
+
+# 命中次数 = 加标记后增加的长度；正文按 BM25 的方式做词频饱和（k1=1.2、b=0.75，平均长度按 400 字符计）
+_HITS = "(length(COALESCE({column}, '')) - length(replace(COALESCE({column}, ''), '" + MARK_START + "', '')))"
+SCORE = (
+    f"{TITLE_WEIGHT} * {_HITS.format(column='c.title')} / ({_HITS.format(column='c.title')} + 1.2) + "
+    f"{_HITS.format(column='c.body')} * 1.0 / "
+    f"({_HITS.format(column='c.body')} + 1.2 * (0.25 + 0.75 * length(c.body) / 400.0))"
+)
+
+
+class SearchError(ValueError):
+    """搜索参数无效"""
+
+
+def owner_range(owner):
+    """用户的文档 rowid 范围（闭区间）"""
+    low = owner << OWNER_SHIFT
+    return low, low | ((1 << OWNER_SHIFT) - 1)
+
+
+def parse_terms(text, max_terms=8):
+    """按空白拆分搜索词，去重并保持顺序"""
+    terms = list(dict.fromkeys(term for term in text.split() if term))
+    if not terms:
+        raise SearchError("搜索内容不能为空")
+    return terms[:max_terms]
+
+
+def _fts_string(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def build_search(terms, owner, limit, offset, candidates=1000):
+    """构造搜索语句，返回 (sql, 命名参数)；多取一行用于判断是否还有下一页"""
+    low, high = owner_range(owner)
+    params = {
+        "low": low,
+        "high": high,
+        "limit": limit + 1,
+        "offset": offset,
+        "candidates": max(candidates, offset + limit + 1),
+    }
+    long_terms = [term for term in terms if len(term) >= MIN_MATCH_CHARS]
+    short_terms = [term for term in terms if len(term) < MIN_MATCH_CHARS]
+
+    conditions = ["si.rowid BETWEEN :low AND :high"]
+    if long_terms:
+        conditions.append("search_index MATCH :query")
+        params["query"] = " ".join(_fts_string(term) for term in long_terms)
+        # 列顺序：thread_id, step_id, title, body
+        columns = (
+            f"highlight(search_index, 2, '{MARK_START}', '{MARK_END}') AS title, "
+            f"highlight(search_index, 3, '{MARK_START}', '{MARK_END}') AS body"
+        )
+        score = SCORE
+    else:
+        columns = "si.title AS title, si.body AS body"
+        score = "0.0"
+    for index, term in enumerate(short_terms):
+        conditions.append(f"(si.title LIKE :like{index} ESCAPE '\\' OR si.body LIKE :like{index} ESCAPE '\\')")
+        params[f"like{index}"] = _like_pattern(term)
+
+    # 候选按 rowid 倒序取（rowid 越大越新，FTS5 可以直接按范围定位），再在候选中排序分页
+    sql = f"""
+        SELECT r.thread_id AS thread_id, r.step_id AS step_id, r.title AS title, r.body AS body, r.score AS score,
+               t.name AS thread_name, COALESCE(s."createdAt", t."createdAt") AS created_at,
+               COALESCE(s.type, 'thread') AS type
+        FROM (
+            SELECT c.rowid AS rowid, c.thread_id AS thread_id, c.step_id AS step_id, c.title AS title, c.body AS body,
+                   {score} AS score
+            FROM (
+                SELECT si.rowid AS rowid, si.thread_id AS thread_id, si.step_id AS step_id, {columns}
+                FROM search_index si
+                WHERE {" AND ".join(conditions)}
+                ORDER BY si.rowid DESC
+                LIMIT :candidates
+            ) c
+            ORDER BY score DESC, c.rowid DESC
+            LIMIT :limit OFFSET :offset
+        ) r
+        LEFT JOIN threads t ON t.id = r.thread_id
+        LEFT JOIN steps s ON s.id = r.step_id
+        ORDER BY r.score DESC, r.rowid DESC
+    """
+    return sql, params
+
+
+def _mark_all(text, term):
+    lower, needle = text.lower(), term.lower()
+    parts, position = [], 0
+    while True:
+        index = lower.find(needle, position)
+        if index < 0:
+            break
+        parts.append(text[position:index] + MARK_START + text[index:index + len(term)] + MARK_END)
+        position = index + len(term)
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def make_snippet(text, short_terms=(), width=SNIPPET_CHARS):
+    """从已标记 MATCH 命中的文本中截取第一个命中附近的片段，补上短词的标记"""
+    text = " ".join((text or "").split())
+    for term in sorted(short_terms, key=len, reverse=True):
+        text = _mark_all(text, term)
+    first = text.find(MARK_START)
+    start = max(0, first - width // 3) if first > 0 else 0
+    end = start + width
+    # 不在标记中间截断
+    while start > 0 and text.count(MARK_START, 0, start) != text.count(MARK_END, 0, start):
+        start -= 1
+    while end < len(text) and text.count(MARK_START, 0, end) != text.count(MARK_END, 0, end):
+        end += 1
+    return ("…" if start > 0 else "") + text[start:end] + ("…" if end < len(text) else "")
+
+
+def render_snippet(snippet):
+    """HTML 转义后把命中标记替换为 <mark>"""
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def format_results(rows, terms, limit, offset):
+    short_terms = [term for term in terms if len(term) < MIN_MATCH_CHARS]
+    results = []
+    for row in rows[:limit]:
+        text = row["title"] if row["step_id"] is None else row["body"]
+        results.append({
+            "thread_id": row["thread_id"],
+            "thread_name": (row["thread_name"] or "").strip(),
+            "step_id": row["step_id"],
+            "type": row["type"],
+            "created_at": row["created_at"],
+            "snippet": render_snippet(make_snippet(text, short_terms)),
+            "score": round(row["score"], 4),
+        })
+    return {"results": results, "next_offset": offset + limit if len(rows) > limit else None}
+
+
+class HistorySearch:
+    """按用户搜索聊天记录（通过共享数据层的连接池读取）
+
+    Args:
+        data_layer: TunedSQLAlchemyDataLayer
+        max_limit: 每页最多返回的结果数
+        max_offset: 最大翻页偏移，避免深翻页拖慢查询
+        candidates: 参与排序的最近匹配数，常见词的查询代价以此为上限
+    """
+
+    def __init__(self, data_layer, max_limit=50, max_offset=1000, candidates=1000):
+        self.data_layer = data_layer
+        self.max_limit = max_limit
+        self.max_offset = max_offset
+        self.candidates = candidates
+
+    async def search(self, identifier, text, limit=20, offset=0):
+        """在用户 identifier 自己的会话中搜索 text，返回 {"results": [...], "next_offset": int | None}
+
+        Raises:
+            SearchError: 搜索内容为空或分页参数无效
+        """
+        if not 1 <= limit <= self.max_limit or not 0 <= offset <= self.max_offset:
+            raise SearchError(f"limit 需在 1-{self.max_limit} 之间，offset 需在 0-{self.max_offset} 之间")
+        terms = parse_terms(text)
+        owner = await self.data_layer.execute_sql("SELECT rowid FROM users WHERE identifier = :identifier", {"identifier": identifier})
+        if not owner:
+            return {"results": [], "next_offset": None}
+        sql, params = build_search(terms, owner[0]["rowid"], limit, offset, self.candidates)
+        rows = await self.data_layer.execute_sql(sql, params)
+        if rows is None:
+            # 数据库尚未迁移到包含全文索引的版本，或查询出错（已由数据层记录）
+            raise SearchError("搜索暂不可用，请确认已运行 python migrate_db.py")
+        return format_results(rows, terms, limit, offset)
+
+
+_endpoint_installed = False
+
+
+def install_search_endpoint(data_layer):
+    """在 Chainlit 服务上挂载搜索接口 GET <path>?q=...&limit=20&offset=0（需登录，只搜索当前用户的会话）"""
+    global _endpoint_installed
+    config = get_search_config()
+    if _endpoint_installed or not config["enabled"]:
+        return
+    _endpoint_installed = True
+
+    from chainlit.auth import get_current_user
+    from chainlit.server import app
+    from fastapi import Depends, HTTPException
+
+    searcher = HistorySearch(
+        data_layer, max_limit=config["max_limit"], max_offset=config["max_offset"], candidates=config["candidates"]
+    )
+
+    async def search(q: str, limit: int = 20, offset: int = 0, current_user=Depends(get_current_user)):
+        if current_user is None:
+            raise HTTPException(status_code=401, detail="未登录")
+        start = time.perf_counter()
+        try:
+            return await searcher.search(current_user.identifier, q, limit=limit, offset=offset)
+        except SearchError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - start, operation="search")
+
+    app.add_api_route(config["path"], search, methods=["GET"], include_in_schema=False)
+    # 与 /metrics 相同，移到 Chainlit 匹配所有路径的前端路由之前
+    app.router.routes.insert(0, app.router.routes.pop())
@@ -0,0 +1,111 @@
+"""流式 token 合并工具
+
+上游每个 delta 都直接调用 stream_token 会产生一个 websocket 帧，
+高速模型下 socket.io 的发送开销会占满 CPU。TokenCoalescer 把短时间内
+到达的 token 合并为一帧再发送。
+"""
+
+import asyncio
+import time
+
+
+class TokenCoalescer:
+    """按时间窗口 / 大小阈值 / 换行合并 token 后再写入 sink
+
+    - 第一个 token 立即发送，不增加首 token 延迟
+    - 缓冲区超过 max_size 个字符、或遇到换行（flush_on_newline）时立即发送
+    - 其余情况最多延迟 interval 秒，由定时器兜底发送（在后台任务中执行，
+      发送都经过同一把锁串行化；发送失败的异常在下一次 push 或 close 时抛出）
+
+    Args:
+        sink: 异步回调，接收合并后的文本，例如 cl.Message.stream_token
+        interval: 时间窗口（秒），<= 0 表示不合并
+        max_size: 缓冲区字符数阈值
+        flush_on_newline: 是否在遇到换行时立即发送
+    """
+
+    def __init__(self, sink, interval=0.04, max_size=256, flush_on_newline=True):
+        self._sink = sink
+        self._interval = interval
+        self._max_size = max_size
+        self._flush_on_newline = flush_on_newline
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = 0.0
+        self._timer = None
+        self._flush_task = None  # 定时器触发的发送任务
+        self._lock = asyncio.Lock()
+        self.tokens = 0  # 收到的 token 数
+        self.frames = 0  # 实际发送的帧数
+
+    @property
+    def frames_saved(self):
+        """相比逐 token 发送节省的帧数"""
+        return self.tokens - self.frames
+
+    async def push(self, text):
+        """写入一个 token"""
+        if not text:
+            return
+        self._check_flush_task()
+        self.tokens += 1
+        self._buffer.append(text)
+        self._buffered += len(text)
+
+        if (
+            self.frames == 0
+            or self._interval <= 0
+            or self._buffered >= self._max_size
+            or (self._flush_on_newline and "\n" in text)
+            or time.monotonic() - self._last_flush >= self._interval
+        ):
+            await self.flush()
+        elif self._timer is None:
+            delay = self._interval - (time.monotonic() - self._last_flush)
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0), self._on_timer)
+
+    async def flush(self):
+        """立即发送缓冲区中的内容"""
+        self._cancel_timer()
+        async with self._lock:
+            if not self._buffer:
+                return
+            text = "".join(self._buffer)
+            self._buffer.clear()
+            self._buffered = 0
+            self._last_flush = time.monotonic()
+            self.frames += 1
+            await self._sink(text)
+
+    async def close(self):
+        """流结束时调用，等待进行中的定时发送，发送剩余内容并返回统计信息"""
+        self._cancel_timer()
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            await task
+        await self.flush()
+        return self.stats()
+
+    def stats(self):
+        return {
+            "tokens": self.tokens,
+            "frames": self.frames,
+            "frames_saved": self.frames_saved,
+        }
+
+    def _on_timer(self):
+        self._timer = None
+        if self._buffer and self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    def _check_flush_task(self):
+        """回收已完成的定时发送任务，发送失败时在这里抛出异常"""
+        task = self._flush_task
+        if task is not None and task.done():
+            self._flush_task = None
+            task.result()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
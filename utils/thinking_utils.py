@@ -2,6 +2,13 @@
 
 import re
 
+# 流式解析器输出的片段类型
+THINKING = "thinking"
+ANSWER = "answer"
+
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+
 
 def get_thinking_content(delta):
     """从模型响应中获取思考内容
@@ -10,6 +17,9 @@ def get_thinking_content(delta):
     1. reasoning_content 属性（DeepSeek 等模型）
     2. <think>...</think> 标签格式
     
+    注意：本函数只处理单个 delta，标签被拆分到多个 chunk 时无法识别，
+    流式场景请使用 ThinkStreamParser。
+    
     Args:
         delta: 模型响应的 delta 对象
         
@@ -50,4 +60,120 @@ def filter_content(content):
     # 移除可能残留的未闭合标签
     filtered = filtered.replace("<think>", "").replace("</think>", "")
     
-    return filtered if filtered else ""
\ No newline at end of file
+    return filtered if filtered else ""
+
+
+class ThinkStreamParser:
+    """流式 <think> 标签解析器，每个响应创建一个实例
+
+    逐个喂入 delta，按顺序输出 (类型, 文本) 片段，类型为 THINKING 或 ANSWER。
+    标签在任意位置被拆分到多个 chunk 时也能正确识别：疑似标签前缀的尾部会暂存，
+    等下一个 chunk 到达后再判断。每次 feed 的开销与 chunk 长度成线性关系。
+
+    回答中残留的孤立 </think>（部分模型省略了开头标签）会被丢弃，
+    与 filter_content 的行为保持一致。
+    """
+
+    __slots__ = ("_in_think", "_pending")
+
+    def __init__(self):
+        self._in_think = False
+        self._pending = ""
+
+    @property
+    def in_think(self):
+        """当前是否处于 <think> 标签内部"""
+        return self._in_think
+
+    def feed_delta(self, delta):
+        """解析 OpenAI 风格的 delta（同时支持 reasoning_content 与 content）
+
+        Returns:
+            list[tuple[str, str]]: 按顺序排列的片段
+        """
+        segments = []
+        reasoning_content = getattr(delta, "reasoning_content", None)
+        if reasoning_content:
+            segments.append((THINKING, reasoning_content))
+        content = getattr(delta, "content", None)
+        if content:
+            segments.extend(self.feed(content))
+        return segments
+
+    def feed(self, text):
+        """解析一段文本
+
+        Returns:
+            list[tuple[str, str]]: 按顺序排列的片段，相邻同类片段已合并
+        """
+        if not text:
+            return []
+        if self._pending:
+            text = self._pending + text
+            self._pending = ""
+        # 快速路径：不含 '<' 的 chunk 直接输出，无需查找标签
+        if "<" not in text:
+            return [(THINKING if self._in_think else ANSWER, text)]
+
+        segments = []
+        pos = 0
+        length = len(text)
+        while pos < length:
+            if self._in_think:
+                idx = text.find(CLOSE_TAG, pos)
+                tag_len = len(CLOSE_TAG)
+            else:
+                # 回答模式下同时识别 <think> 与孤立的 </think>
+                idx = text.find(OPEN_TAG, pos)
+                tag_len = len(OPEN_TAG)
+                close_idx = text.find(CLOSE_TAG, pos, idx if idx != -1 else length)
+                if close_idx != -1:
+                    idx, tag_len = close_idx, len(CLOSE_TAG)
+
+            if idx == -1:
+                break
+            if idx > pos:
+                self._append(segments, text[pos:idx])
+            pos = idx + tag_len
+            if tag_len == len(OPEN_TAG):
+                self._in_think = True
+            elif self._in_think:
+                self._in_think = False
+            # 孤立的 </think> 直接丢弃，状态不变
+
+        if pos < length:
+            # 尾部可能是被拆分的标签前缀，暂存到下一个 chunk
+            cut = self._partial_tag_start(text, pos)
+            if cut < length:
+                self._pending = text[cut:]
+            if cut > pos:
+                self._append(segments, text[pos:cut])
+        return segments
+
+    def flush(self):
+        """流结束时调用，输出暂存的尾部文本"""
+        if not self._pending:
+            return []
+        text, self._pending = self._pending, ""
+        return [(THINKING if self._in_think else ANSWER, text)]
+
+    def _append(self, segments, text):
+        kind = THINKING if self._in_think else ANSWER
+        if segments and segments[-1][0] == kind:
+            segments[-1] = (kind, segments[-1][1] + text)
+        else:
+            segments.append((kind, text))
+
+    def _partial_tag_start(self, text, pos):
+        """返回尾部疑似标签前缀的起始位置，没有则返回 len(text)
+
+        标签只在首位包含 '<'，因此只需检查最后一个 '<' 之后的内容。
+        """
+        length = len(text)
+        lt = text.rfind("<", max(pos, length - len(CLOSE_TAG) + 1))
+        if lt == -1:
+            return length
+        tail = text[lt:]
+        if CLOSE_TAG.startswith(tail) or (not self._in_think and OPEN_TAG.startswith(tail)):
+            return lt
+        return length
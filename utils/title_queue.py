@@ -0,0 +1,110 @@
+"""后台标题生成队列
+
+标题生成需要额外一次 LLM 调用和一次数据库写入，放在 on_message 中同步等待
+会阻塞用户的下一条消息。TitleQueue 在后台执行这些任务：
+
+- 并发数有上限，避免与聊天请求争抢上游额度
+- 优先级低于聊天：正在进行的聊天流较多时推迟执行（最多推迟 max_defer 秒）
+- 按 thread_id 去重，同一会话只生成一次
+- 单个任务有超时限制
+"""
+
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+
+class TitleQueue:
+    """后台标题生成队列
+
+    Args:
+        concurrency: 同时执行的标题任务数
+        timeout: 单个任务的超时时间（秒）
+        defer_threshold: 进行中的聊天流达到该数量时推迟标题任务
+        max_defer: 最长推迟时间（秒），超过后不再让步
+        remember: 记住已完成 thread_id 的数量，用于去重
+    """
+
+    def __init__(self, concurrency=2, timeout=20.0, defer_threshold=8, max_defer=30.0, remember=10000):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._timeout = timeout
+        self._defer_threshold = defer_threshold
+        self._max_defer = max_defer
+        self._remember = remember
+        self._pending = {}  # thread_id -> asyncio.Task
+        self._done = OrderedDict()  # 已成功生成标题的 thread_id
+        self._active_chats = 0
+        self._chat_idle = asyncio.Event()
+        self._chat_idle.set()
+        self.stats = {"submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0, "timeouts": 0}
+
+    def submit(self, thread_id, job):
+        """提交标题任务
+
+        Args:
+            thread_id: 会话 ID，用于去重
+            job: 无参数的异步函数，返回 True 表示标题已更新
+
+        Returns:
+            bool: 是否已加入队列（重复提交返回 False）
+        """
+        if thread_id in self._pending or thread_id in self._done:
+            self.stats["deduplicated"] += 1
+            return False
+        self.stats["submitted"] += 1
+        # create_task 会复制当前上下文，任务内仍可访问 Chainlit 会话
+        task = asyncio.create_task(self._run(thread_id, job))
+        self._pending[thread_id] = task
+        return True
+
+    @asynccontextmanager
+    async def chat_stream(self):
+        """包裹一次聊天流，标题任务会为进行中的聊天让步"""
+        self._active_chats += 1
+        if self._active_chats >= self._defer_threshold:
+            self._chat_idle.clear()
+        try:
+            yield
+        finally:
+            self._active_chats -= 1
+            if self._active_chats < self._defer_threshold:
+                self._chat_idle.set()
+
+    async def shutdown(self):
+        """取消所有未完成的标题任务"""
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self):
+        return {**self.stats, "pending": len(self._pending), "active_chats": self._active_chats}
+
+    async def _wait_for_chat_idle(self):
+        if self._chat_idle.is_set():
+            return
+        try:
+            await asyncio.wait_for(self._chat_idle.wait(), self._max_defer)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, thread_id, job):
+        try:
+            await self._wait_for_chat_idle()
+            async with self._semaphore:
+                updated = await asyncio.wait_for(job(), self._timeout)
+            if updated:
+                self.stats["succeeded"] += 1
+                self._done[thread_id] = True
+                if len(self._done) > self._remember:
+                    self._done.popitem(last=False)
+            else:
+                self.stats["failed"] += 1
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            print(f"❌ 标题生成超时: thread_id={thread_id}", flush=True)
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"❌ 标题生成任务异常: {e}", flush=True)
+        finally:
+            self._pending.pop(thread_id, None)
@@ -0,0 +1,128 @@
+"""异步写回（write-behind）缓冲区
+
+流式输出时每个消息和 Thinking 步骤都会产生多次 create/update 调用，每次调用
+一个事务，多个会话并发时 SQLite 唯一的写锁会成为瓶颈。WriteBehindBuffer
+先把写入缓存在内存中：同一个键的多次写入合并为一次，按时间或数量触发，
+在一个事务中批量写入。
+"""
+
+import asyncio
+import time
+
+
+class WriteBehindBuffer:
+    """按键合并、定时/定量批量落库的写缓冲
+
+    Args:
+        flush_func: 异步函数，接收一批条目（list）并写入数据库
+        interval: 最长缓存时间（秒）
+        max_batch: 待写入条目达到该数量时立即触发写入
+    """
+
+    def __init__(self, flush_func, interval=0.2, max_batch=200):
+        self._flush_func = flush_func
+        self._interval = interval
+        self._max_batch = max_batch
+        self._pending = {}  # key -> (条目, merge)，保持首次写入的顺序
+        self._lock = asyncio.Lock()
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._closed = False
+        self.stats = {
+            "enqueued": 0,
+            "merged": 0,
+            "flushed": 0,
+            "batches": 0,
+            "max_batch_size": 0,
+            "max_depth": 0,
+            "errors": 0,
+        }
+        self._flush_seconds = 0.0
+
+    @property
+    def depth(self):
+        """当前等待写入的条目数"""
+        return len(self._pending)
+
+    def put(self, key, item, merge=None):
+        """加入一个待写入条目，相同键的条目用 merge(旧, 新) 合并"""
+        self.stats["enqueued"] += 1
+        previous = self._pending.get(key)
+        if previous is not None:
+            self.stats["merged"] += 1
+            item = merge(previous[0], item) if merge else item
+        self._pending[key] = (item, merge)
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._pending))
+
+        if self._closed:
+            return
+        self._has_items.set()
+        if len(self._pending) >= self._max_batch:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def discard(self, key):
+        """丢弃尚未写入的条目（例如条目已被删除）"""
+        self._pending.pop(key, None)
+
+    async def flush(self):
+        """立即写入所有待写入条目，并等待正在进行的写入完成"""
+        async with self._lock:
+            while self._pending:
+                entries, self._pending = self._pending, {}
+                batch = [item for item, _ in entries.values()]
+                start = time.perf_counter()
+                try:
+                    await self._flush_func(batch)
+                    self.stats["flushed"] += len(batch)
+                except asyncio.CancelledError:
+                    self._restore(entries)
+                    raise
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print(f"❌ 批量写入失败，丢弃 {len(batch)} 条: {e}", flush=True)
+                self._flush_seconds += time.perf_counter() - start
+                self.stats["batches"] += 1
+                self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+            self._has_items.clear()
+
+    async def close(self):
+        """停止后台任务并写入剩余条目（进程退出时调用）"""
+        self._closed = True
+        if self._task is not None:
+            # 唤醒后台任务并等它退出；不取消，正在进行的写入照常完成
+            self._has_items.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def _restore(self, entries):
+        """写入被取消时放回这一批，写入期间新加入的条目按原顺序合并到后面"""
+        for key, (item, merge) in self._pending.items():
+            previous = entries.get(key)
+            if previous is not None:
+                item = merge(previous[0], item) if merge else item
+            entries[key] = (item, merge)
+        self._pending = entries
+
+    def get_stats(self):
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "depth": self.depth,
+            "avg_batch_size": round(self.stats["flushed"] / batches, 2) if batches else 0.0,
+            "avg_flush_ms": round(self._flush_seconds / batches * 1000, 3) if batches else 0.0,
+        }
+
+    async def _run(self):
+        while not self._closed:
+            await self._has_items.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()